@@ -0,0 +1,305 @@
+"""
+Headless bot swarm, for finding out how the simulation cost scales with the
+number of players.
+
+Run with:
+    python -m src.bots --counts 1,10,50,100 --ticks 600
+"""
+
+import argparse
+import math
+import time
+
+import numpy as np
+
+from panda3d.bullet import BulletRigidBodyNode
+from panda3d.bullet import BulletSphereShape
+from panda3d.core import Point3
+from panda3d.core import Vec3
+
+from src import graphics
+from src import physics
+from src.headless import makeHeadlessApp
+from src.headless import useFixedFrameRate
+from src.kinematic import KinematicController
+from src.logconfig import newLogger
+from src.main import initModules
+from src.physics import COLLIDE_MASK_PLAYER
+from src.physics import TICK_DT
+from src.physics import TICK_RATE
+from src.simlod import addInterestNode
+from src.simlod import getTierCounts
+from src.world import MAX_X
+from src.world import MAX_Y
+from src.world import MIN_X
+from src.world import MIN_Y
+from src.world import makeBullet
+from src.world import setFallHandler
+from src.world_config import PLAYER_HEIGHT
+
+log = newLogger(__name__)
+
+BEHAVIOUR_WANDER = 0
+BEHAVIOUR_STRAFE = 1
+BEHAVIOUR_FIRE   = 2 # Stand still and fire at the smiley.
+
+ALL_BEHAVIOURS = (BEHAVIOUR_WANDER, BEHAVIOUR_STRAFE, BEHAVIOUR_FIRE)
+
+# TODO: Magic numbers. These are roughly what a human player does.
+BOT_SPEED        = 10.0 # Meters per second
+BOT_TURN_RATE    = 180.0 # Degrees per second
+WANDER_JITTER    = 360.0 # Max change in wander heading, degrees per second
+STRAFE_FLIP_TIME = 1.5   # Average seconds between strafe direction changes
+FIRE_CONE        = 5.0   # Fire when within this many degrees of the target
+FIRE_INTERVAL    = 0.25  # Seconds between shots
+BULLET_SPEED     = 30.0
+
+# Bots this close to the edge of the arena turn back toward the middle.
+ARENA_MARGIN = 2.0
+
+app = None
+
+bots = []
+
+# Per-bot state used for steering, stored as arrays (one row per bot) so that
+# the steering for the whole swarm can be computed in one batch.
+wanderHeadings = np.zeros(0)
+strafeSigns    = np.zeros(0)
+fireCooldowns  = np.zeros(0)
+behaviours     = np.zeros(0, dtype=int)
+
+rng = np.random.RandomState(0)
+
+
+def initBots(app_):
+    global app
+    app = app_
+
+    physics.addPreTickCallback(steerAllBots)
+
+
+class Bot(object):
+    def __init__(self, pos, behaviour):
+        super(Bot, self).__init__()
+
+        # Bots have the same shape as the player.
+        shape = BulletSphereShape(0.5 * PLAYER_HEIGHT)
+        node = BulletRigidBodyNode("Bot")
+        node.addShape(shape)
+        node.setKinematic(True)
+
+        self.bodyNP = app.render.attachNewNode(node)
+        self.bodyNP.setPos(pos)
+        self.bodyNP.setCollideMask(COLLIDE_MASK_PLAYER)
+        physics.attachBody(self.bodyNP, "bots.Bot")
+
+        self.headNP = self.bodyNP.attachNewNode("BotHead")
+        self.headNP.setPos(0, 0, 0.3 * PLAYER_HEIGHT)
+
+        self.controller = KinematicController(self.bodyNP, shape,
+                                              stepHeight=0.2, maxSlope=45.0)
+        self.behaviour = behaviour
+
+        # Like the player, a bot that falls through the floor goes back to
+        # where it started rather than being removed.
+        self.spawnPos = Point3(pos)
+        setFallHandler(self.bodyNP, self.respawn)
+
+        # Bots are players too, as far as deciding which bodies are worth
+        # simulating in detail.
+        addInterestNode(self.bodyNP)
+
+    def respawn(self):
+        log.debug("Bot fell through the floor; respawning.")
+        self.bodyNP.setPos(self.spawnPos)
+        self.controller.verticalVel = 0.0
+
+
+def spawnBot(pos, behaviour):
+    global wanderHeadings, strafeSigns, fireCooldowns, behaviours
+
+    bot = Bot(pos, behaviour)
+    bots.append(bot)
+    wanderHeadings = np.append(wanderHeadings, rng.uniform(0, 360))
+    strafeSigns    = np.append(strafeSigns,    rng.choice([-1.0, 1.0]))
+    fireCooldowns  = np.append(fireCooldowns,  rng.uniform(0, FIRE_INTERVAL))
+    behaviours     = np.append(behaviours,     behaviour)
+    return bot
+
+
+def spawnRandomBots(count):
+    for _ in range(count):
+        pos = Point3(rng.uniform(MIN_X + ARENA_MARGIN, MAX_X - ARENA_MARGIN),
+                     rng.uniform(MIN_Y + ARENA_MARGIN, MAX_Y - ARENA_MARGIN),
+                     0.5 * PLAYER_HEIGHT)
+        spawnBot(pos, rng.choice(ALL_BEHAVIOURS))
+
+
+def steerAllBots(dt):
+    global wanderHeadings
+
+    if not bots:
+        return
+
+    positions = np.array([[pos.getX(), pos.getY(), pos.getZ()]
+                          for pos in (bot.headNP.getPos(app.render)
+                                      for bot in bots)])
+    headings = np.array([bot.bodyNP.getH() for bot in bots])
+    smileyPos = graphics.smileyNP.getPos(app.render)
+    target = np.array([smileyPos.getX(), smileyPos.getY(), smileyPos.getZ()])
+
+    wanderHeadings += rng.uniform(-1, 1, len(bots)) * WANDER_JITTER * dt
+    flipStrafe = rng.uniform(0, 1, len(bots)) < dt / STRAFE_FLIP_TIME
+    strafeSigns[flipStrafe] *= -1
+    fireCooldowns[:] -= dt
+
+    localVels, angularVels, wantsToFire, aimDirs = computeSteering(
+        positions, headings, target, dt)
+
+    for i, bot in enumerate(bots):
+        bot.controller.setLinearMovement(Vec3(localVels[i, 0],
+                                              localVels[i, 1], 0))
+        bot.controller.setAngularMovement(angularVels[i])
+
+    for i in np.nonzero(wantsToFire)[0]:
+        fireCooldowns[i] = FIRE_INTERVAL
+        makeBullet(Point3(*positions[i]), headings[i],
+                   Vec3(*(aimDirs[i] * BULLET_SPEED)))
+
+
+def computeSteering(positions, headings, target, dt):
+    """
+    Compute the steering for every bot at once. positions is an (N, 3) array
+    of the bots' head positions, headings is an (N,) array in degrees, and
+    target is the position of the smiley.
+
+    Return a tuple (localVels, angularVels, wantsToFire, aimDirs): the (N, 2)
+    velocities relative to each bot, the (N,) rotation speeds in degrees per
+    second, an (N,) Boolean array of which bots should fire this tick, and the
+    (N, 3) unit vectors from each bot to the target.
+    """
+
+    toTarget = target - positions
+    distances = np.maximum(np.linalg.norm(toTarget, axis=1), 1e-6)
+    aimDirs = toTarget / distances[:, np.newaxis]
+    # Heading 0 faces +y, and positive headings turn to the left.
+    targetHeadings = np.degrees(np.arctan2(-toTarget[:, 0], toTarget[:, 1]))
+
+    isWander = behaviours == BEHAVIOUR_WANDER
+    isStrafe = behaviours == BEHAVIOUR_STRAFE
+    isFire   = behaviours == BEHAVIOUR_FIRE
+
+    desiredHeadings = np.where(isWander, wanderHeadings, targetHeadings)
+
+    # Anyone wandering too close to the edge turns back toward the middle.
+    nearEdge = ((positions[:, 0] < MIN_X + ARENA_MARGIN) |
+                (positions[:, 0] > MAX_X - ARENA_MARGIN) |
+                (positions[:, 1] < MIN_Y + ARENA_MARGIN) |
+                (positions[:, 1] > MAX_Y - ARENA_MARGIN))
+    towardCenter = np.degrees(np.arctan2(positions[:, 0], -positions[:, 1]))
+    turnBack = isWander & nearEdge
+    desiredHeadings = np.where(turnBack, towardCenter, desiredHeadings)
+    wanderHeadings[turnBack] = towardCenter[turnBack]
+    # Strafers near the edge strafe whichever way takes them back toward the
+    # middle. (A bot's local +x direction is (cos h, sin h) in render's
+    # coordinate system.)
+    bounce = isStrafe & nearEdge
+    headingRadians = np.radians(headings)
+    outward = (np.cos(headingRadians) * positions[:, 0] +
+               np.sin(headingRadians) * positions[:, 1])
+    strafeSigns[bounce] = -np.sign(outward[bounce])
+
+    headingErrors = wrapDegrees(desiredHeadings - headings)
+    maxTurn = BOT_TURN_RATE * dt
+    angularVels = np.clip(headingErrors, -maxTurn, maxTurn) / dt
+
+    localVels = np.zeros((len(positions), 2))
+    localVels[isWander, 1] = BOT_SPEED
+    localVels[isStrafe, 0] = BOT_SPEED * strafeSigns[isStrafe]
+
+    wantsToFire = (isFire & (np.abs(headingErrors) < FIRE_CONE) &
+                   (fireCooldowns <= 0))
+    return localVels, angularVels, wantsToFire, aimDirs
+
+
+def wrapDegrees(angles):
+    """
+    Wrap angles (in degrees) into the range [-180, 180).
+    """
+
+    return np.mod(angles + 180.0, 360.0) - 180.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument("--counts", default="1,10,25,50,100,200",
+                        help="Comma-separated bot counts to measure.")
+    parser.add_argument("--ticks", type=int, default=10 * TICK_RATE,
+                        help="Ticks to measure at each bot count.")
+    args = parser.parse_args()
+
+    counts = sorted(int(count) for count in args.counts.split(","))
+    runScalingBenchmark(counts, args.ticks)
+
+
+def runScalingBenchmark(counts, numTicks):
+    """
+    Measure the cost of a simulation tick with each number of bots in counts
+    (which must be sorted), and log a table of the results. Return a list of
+    (count, meanMs, p95Ms) tuples.
+    """
+
+    headlessApp = makeHeadlessApp()
+    initModules(headlessApp)
+    initBots(headlessApp)
+    # One tick per frame, so each frame's cost is one tick's cost.
+    useFixedFrameRate(TICK_RATE)
+
+    results = []
+    for count in counts:
+        spawnRandomBots(count - len(bots))
+
+        # Let everyone settle onto the floor and get a few bullets flying
+        # before we start measuring.
+        for _ in range(TICK_RATE):
+            headlessApp.taskMgr.step()
+
+        tickTimes = []
+        for _ in range(numTicks):
+            startTime = time.time()
+            headlessApp.taskMgr.step()
+            tickTimes.append(time.time() - startTime)
+
+        tickTimesMs = np.array(tickTimes) * 1000.0
+        results.append((count, tickTimesMs.mean(),
+                        np.percentile(tickTimesMs, 95)))
+        log.debug("%d bots; bodies by simulation tier: %s",
+                  count, getTierCounts())
+
+    budgetMs = TICK_DT * 1000.0
+    log.info("%6s %10s %10s %12s", "bots", "mean ms", "p95 ms", "us/bot")
+    for count, meanMs, p95Ms in results:
+        log.info("%6d %10.3f %10.3f %12.1f",
+                 count, meanMs, p95Ms, 1000.0 * meanMs / count)
+    withinBudget = [count for count, _, p95Ms in results if p95Ms < budgetMs]
+    if withinBudget:
+        log.info("Largest count with p95 tick under %.1f ms: %d",
+                 budgetMs, max(withinBudget))
+    else:
+        log.info("No count measured had p95 tick under %.1f ms.", budgetMs)
+    if len(results) >= 2:
+        # Estimate the marginal cost per bot from the two largest counts.
+        (count1, mean1, _), (count2, mean2, _) = results[-2:]
+        if count2 > count1:
+            perBotMs = (mean2 - mean1) / (count2 - count1)
+            log.info("Marginal cost: %.1f us/bot", 1000.0 * perBotMs)
+            if perBotMs > 0:
+                log.info("Projected capacity at %.1f ms/tick: %d bots",
+                         budgetMs,
+                         int(count2 + math.floor((budgetMs - mean2) /
+                                                 perBotMs)))
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -4,27 +4,53 @@ import sys
 from direct.showbase.InputStateGlobal import inputState
 from direct.task import Task
 
+from panda3d.core import GraphicsWindow
 from panda3d.core import Vec3
 from panda3d.core import WindowProperties
 
 from src.graphics import changePlayerHeadingPitch
+from src.hitscan import firePlayerHitscanShot
 from src.logconfig import newLogger
+from src.profiler import toggleCapture
 from src.world import makePlayerBullet
 from src.world_config import GRAVITY_ACCEL
 
 # FIXME[bullet]
-from src import graphics
+from src import world
 
 log = newLogger(__name__)
 
 FRAMES_NEEDED_TO_WARP = 2
 
+# In meters per second.
+# FIXME: The player does not move at 15 m/s. What units does this use??
+# TODO: This is too high... if we rescale the environment more sanely
+# can it feel natural with a not-absurd top speed?
+PLAYER_MAX_SPEED = 15
+
+# Degrees per second.
+PLAYER_MAX_ROTATE_SPEED = 90
+
+# Meters.
+PLAYER_JUMP_HEIGHT = 1.1
+
+# Weapon modes, toggled with the "f" key. Projectile weapons fire physical
+# bullets; hitscan weapons hit instantly with a ray test.
+WEAPON_PROJECTILE = 0
+WEAPON_HITSCAN    = 1
+
 app = None
 
 # How many previous frames have we successfully warped the mouse? Only tracked
 # up to FRAMES_NEEDED_TO_WARP.
 successfulMouseWarps = 0
 
+weaponMode = WEAPON_PROJECTILE
+
+# Whether the most recent attempt to warp the mouse succeeded. It fails when
+# the window doesn't have the focus.
+lastMouseWarpSucceeded = False
+
 
 def initControl(app_):
     # Why does 'global x' cause pylint to assume x is a constant? If I wanted
@@ -39,15 +65,22 @@ def initControl(app_):
 def initKeyboardAndMouse():
     # Hide the mouse.
     app.disableMouse()
-    props = WindowProperties()
-    props.setCursorHidden(True)
-    app.win.requestProperties(props)
+    # When running headless (see headless.py), there's either no window at all
+    # or just an offscreen buffer, so there's no mouse to hide or warp.
+    hasWindow = isinstance(app.win, GraphicsWindow)
+    if hasWindow:
+        props = WindowProperties()
+        props.setCursorHidden(True)
+        app.win.requestProperties(props)
 
     # Provide a way to exit even when we make the window fullscreen.
     app.accept('control-q', sys.exit)
+    # Start or stop a profiler capture (see profiler.py).
+    app.accept('control-p', toggleCapture)
 
     # Handle the mouse.
     app.accept("mouse1", clicked, [])
+    app.accept("f", toggleWeaponMode, [])
 
     # Handle window close request (clicking the X, Alt-F4, etc.)
     # app.win.set_close_request_event("window-close")
@@ -62,10 +95,19 @@ def initKeyboardAndMouse():
     inputState.watchWithModifiers("turnRight", "e")
     inputState.watchWithModifiers("jump",      "space")
 
-    app.taskMgr.add(controlCameraTask, "ControlCameraTask")
+    if hasWindow:
+        app.taskMgr.add(controlCameraTask, "ControlCameraTask")
     app.taskMgr.add(movePlayerTask,    "MovePlayerTask")
 
 
+def getJumpSpeed():
+    """
+    Return the initial upward speed needed to jump PLAYER_JUMP_HEIGHT high.
+    """
+
+    return math.sqrt(2 * GRAVITY_ACCEL * PLAYER_JUMP_HEIGHT)
+
+
 # We don't use task, but we can't remove it because the function signature
 # is from Panda3D.
 # TODO: Rename this. This is the function that moves the player based on the
@@ -81,11 +123,7 @@ def movePlayerTask(task):  # pylint: disable=unused-argument
     # sidewaysSpeed = 15
     # backwardSpeed = 10
 
-    # In meters per second.
-    # FIXME: The player does not move at 15 m/s. What units does this use??
-    # TODO: This is too high... if we rescale the environment more sanely
-    # can it feel natural with a not-absurd top speed?
-    maxSpeed = 15
+    maxSpeed = PLAYER_MAX_SPEED
 
     # TODO[bullet]: Make the player accelerate to a top speed, rather than
     # instantaneously changing their velocity. Some parameters from before:
@@ -93,8 +131,7 @@ def movePlayerTask(task):  # pylint: disable=unused-argument
     # timeToReachTopSpeed = 0.3
     # maxAccel = maxSpeed / timeToReachTopSpeed
 
-    # Degrees per second.
-    maxRotateSpeed = 90
+    maxRotateSpeed = PLAYER_MAX_ROTATE_SPEED
 
     netRunRight = 0
     netRunFwd   = 0
@@ -121,19 +158,14 @@ def movePlayerTask(task):  # pylint: disable=unused-argument
     if inputState.isSet("turnRight"):
         rotateSpeed -= maxRotateSpeed
 
-    # FIXME[bullet]: What about old z velocity from a previous jump??
+    # Note: the controller keeps track of the vertical velocity (from jumping
+    # and falling) separately, so this doesn't cancel out a jump in progress.
     playerVel = Vec3(netRunRight, netRunFwd, 0)
-    graphics.playerNP.node().setLinearMovement (playerVel, True)
-    graphics.playerNP.node().setAngularMovement(rotateSpeed)
+    world.playerController.setLinearMovement(playerVel)
+    world.playerController.setAngularMovement(rotateSpeed)
 
     if inputState.isSet("jump"):
-        jumpHeight = 1.1
-        jumpSpeed = math.sqrt(2 * GRAVITY_ACCEL * jumpHeight)
-        # Note: some example code makes this call as well, but I don't think it
-        # has any effect...
-        # graphics.playerNP.node().setMaxJumpHeight(jumpHeight)
-        graphics.playerNP.node().setJumpSpeed(jumpSpeed)
-        graphics.playerNP.node().doJump()
+        world.playerController.doJump(getJumpSpeed())
 
     return Task.cont
 
@@ -142,6 +174,7 @@ def movePlayerTask(task):  # pylint: disable=unused-argument
 # mouse.
 def controlCameraTask(task):  # pylint: disable=unused-argument
     global successfulMouseWarps
+    global lastMouseWarpSucceeded
 
     # Degrees per pixel
     mouseGain = 0.25
@@ -158,6 +191,7 @@ def controlCameraTask(task):  # pylint: disable=unused-argument
     # just going to re-apply the same mouse motion on the next frame, so
     # that would cause the camera to go spinning wildly out of control.
     mouseWarpSucceeded = app.win.movePointer(0, centerX, centerY)
+    lastMouseWarpSucceeded = mouseWarpSucceeded
 
     # Also don't move the camera if, since the last failed attempt to warp
     # the mouse, we have not had at least FRAMES_NEEDED_TO_WARP successful
@@ -182,6 +216,35 @@ def controlCameraTask(task):  # pylint: disable=unused-argument
     return Task.cont
 
 
+def isWindowActive():
+    """
+    Return whether the window is in active use: it exists, isn't minimized,
+    and has the focus.
+    """
+
+    if not isinstance(app.win, GraphicsWindow):
+        return False
+    props = app.win.getProperties()
+    if props.getMinimized() or not props.getForeground():
+        return False
+    # getForeground isn't reliable on every platform, so also use the same
+    # test as controlCameraTask.
+    return lastMouseWarpSucceeded
+
+
 def clicked():
-    makePlayerBullet()
+    if weaponMode == WEAPON_HITSCAN:
+        firePlayerHitscanShot()
+    else:
+        makePlayerBullet()
+
+
+def toggleWeaponMode():
+    global weaponMode
+    if weaponMode == WEAPON_HITSCAN:
+        weaponMode = WEAPON_PROJECTILE
+        log.info("Switched to projectile weapon.")
+    else:
+        weaponMode = WEAPON_HITSCAN
+        log.info("Switched to hitscan weapon.")
 
@@ -0,0 +1,286 @@
+"""
+Cosmetic effects for projectiles hitting scenery: bullet-hole decals left on
+the panel, and a burst of sparks.
+
+Every effect of a given type lives in a single Geom with room for a fixed
+number of effects, and new effects are written into it ring-buffer style,
+overwriting the oldest once it's full. So no matter how much anyone shoots,
+impacts never create nodes, and the memory and draw cost stay the same.
+"""
+
+import numpy as np
+
+from panda3d.core import ClockObject
+from panda3d.core import Geom
+from panda3d.core import GeomNode
+from panda3d.core import GeomPoints
+from panda3d.core import GeomTriangles
+from panda3d.core import GeomVertexData
+from panda3d.core import GeomVertexFormat
+from panda3d.core import GeomVertexWriter
+from panda3d.core import NodePath
+from panda3d.core import Vec3
+from panda3d.core import VBase4
+
+from src import physics
+from src.hitscan import addHitCallback
+from src.logconfig import newLogger
+from src.physics import COLLIDE_MASK_BULLET
+from src.physics import COLLIDE_MASK_SCENERY
+from src.resources import KIND_NODEPATH
+from src.resources import noteCreated
+from src.shadows import SHADOW_CAMERA_MASK
+from src.telemetry import incrementCounter
+from src.utils import RingBuffer
+from src.world_config import GRAVITY_ACCEL
+
+log = newLogger(__name__)
+
+# Maximum number of decals and spark bursts that can exist at once.
+DECAL_CAPACITY       = 256
+SPARK_BURST_CAPACITY = 64
+
+DECAL_SIZE  = 0.12 # Side length, in meters
+# How far in front of the surface to put decals, so they don't z-fight with it.
+# (We also use a depth offset, but that alone isn't always enough at a
+# distance.)
+DECAL_OFFSET = 0.005
+DECAL_COLOR  = VBase4(0.05, 0.05, 0.05, 1)
+
+SPARKS_PER_BURST = 8
+SPARK_LIFETIME   = 0.4 # Seconds
+SPARK_MIN_SPEED  = 2.0
+SPARK_MAX_SPEED  = 5.0
+SPARK_THICKNESS  = 3.0 # Pixels
+SPARK_COLOR      = VBase4(1.0, 0.8, 0.3, 1)
+
+app = None
+
+decals = None
+sparks = None
+
+# Pairs of (bullet key, panel key), as in NodePath.getKey(), that were touching
+# at the end of the last tick. A bullet that rests against (or rolls along) a
+# panel stays in contact for many ticks, but should only leave one mark.
+previousContacts = set()
+
+rng = np.random.RandomState(0)
+
+
+def initEffects(app_):
+    global app
+    app = app_
+
+    global decals, sparks
+    decals = DecalBatch(app.render)
+    sparks = SparkBatch(app.render)
+
+    physics.addPostTickCallback(findNewImpacts)
+    addHitCallback(onHitscanHit)
+    app.taskMgr.add(updateSparksTask, "UpdateImpactSparks")
+
+
+def addImpact(pos, normal):
+    """
+    Show an impact on a surface at pos, with the given surface normal (both in
+    render's coordinate system).
+    """
+
+    normal = Vec3(normal)
+    if normal.length() == 0:
+        return
+    normal.normalize()
+    decals.add(pos, normal)
+    sparks.add(pos, normal, ClockObject.getGlobalClock().getFrameTime())
+    incrementCounter("effects.impacts")
+
+
+def findNewImpacts(tickCount):  # pylint: disable=unused-argument
+    """
+    Look through the contacts from the tick that just finished for bullets
+    touching panels, and add an impact wherever a bullet has just hit one.
+    """
+
+    global previousContacts
+
+    contacts = set()
+    for manifold in physics.world.getManifolds():
+        if manifold.getNumManifoldPoints() == 0:
+            continue
+        node0 = manifold.getNode0()
+        node1 = manifold.getNode1()
+        if isBullet(node0) and isScenery(node1):
+            bulletNode, panelNode, normalSign = node0, node1, 1
+        elif isBullet(node1) and isScenery(node0):
+            bulletNode, panelNode, normalSign = node1, node0, -1
+        else:
+            continue
+
+        pair = (NodePath(bulletNode).getKey(), NodePath(panelNode).getKey())
+        contacts.add(pair)
+        if pair in previousContacts:
+            continue
+
+        # The normal on B points from B toward A. We want it pointing out of
+        # the panel, toward the bullet.
+        point = manifold.getManifoldPoint(0)
+        if normalSign > 0:
+            pos = point.getPositionWorldOnB()
+        else:
+            pos = point.getPositionWorldOnA()
+        addImpact(pos, point.getNormalWorldOnB() * normalSign)
+    previousContacts = contacts
+
+
+def onHitscanHit(hit):
+    if isScenery(hit.hitNP.node()):
+        addImpact(hit.pos, hit.normal)
+
+
+def isBullet(node):
+    return not (node.getIntoCollideMask() & COLLIDE_MASK_BULLET).isZero()
+
+def isScenery(node):
+    return not (node.getIntoCollideMask() & COLLIDE_MASK_SCENERY).isZero()
+
+
+def updateSparksTask(task):
+    clock = ClockObject.getGlobalClock()
+    sparks.update(clock.getDt(), clock.getFrameTime())
+    return task.cont
+
+
+class DecalBatch(object):
+    """
+    Up to DECAL_CAPACITY square decals, drawn as one Geom with four vertices
+    and two triangles per decal. Decals last until they're overwritten.
+    """
+
+    def __init__(self, parent):
+        super(DecalBatch, self).__init__()
+
+        self.ring = RingBuffer(DECAL_CAPACITY)
+
+        vertexData = GeomVertexData("ImpactDecals", GeomVertexFormat.getV3(),
+                                    Geom.UHDynamic)
+        # Unused slots have all four corners at the origin, so they're
+        # degenerate and don't draw anything.
+        vertexData.setNumRows(4 * DECAL_CAPACITY)
+        triangles = GeomTriangles(Geom.UHStatic)
+        for slot in range(DECAL_CAPACITY):
+            first = 4 * slot
+            triangles.addVertices(first, first + 1, first + 2)
+            triangles.addVertices(first, first + 2, first + 3)
+        geom = Geom(vertexData)
+        geom.addPrimitive(triangles)
+
+        self.geomNode = GeomNode("ImpactDecals")
+        self.geomNode.addGeom(geom)
+        self.nodePath = parent.attachNewNode(self.geomNode)
+        self.nodePath.setColor(DECAL_COLOR)
+        self.nodePath.setLightOff()
+        self.nodePath.setDepthOffset(1)
+        self.nodePath.setTwoSided(True)
+        # Decals are painted onto surfaces, so they have no shadow of their
+        # own. (See shadows.py.)
+        self.nodePath.hide(SHADOW_CAMERA_MASK)
+        noteCreated(KIND_NODEPATH, "effects.DecalBatch")
+
+    def add(self, pos, normal):
+        # Two unit vectors in the plane of the surface.
+        tangent = normal.cross(Vec3(0, 0, 1))
+        if tangent.length() < 1e-3:
+            # The surface is horizontal, so any horizontal tangent will do.
+            tangent = Vec3(1, 0, 0)
+        tangent.normalize()
+        bitangent = normal.cross(tangent)
+
+        center = pos + normal * DECAL_OFFSET
+        halfU  = tangent   * (0.5 * DECAL_SIZE)
+        halfV  = bitangent * (0.5 * DECAL_SIZE)
+
+        slot = self.ring.push()
+        writer = GeomVertexWriter(
+            self.geomNode.modifyGeom(0).modifyVertexData(), "vertex")
+        writer.setRow(4 * slot)
+        for corner in (center - halfU - halfV, center + halfU - halfV,
+                       center + halfU + halfV, center - halfU + halfV):
+            writer.setData3f(corner)
+
+
+class SparkBatch(object):
+    """
+    Up to SPARK_BURST_CAPACITY bursts of SPARKS_PER_BURST sparks, drawn as one
+    Geom of points. The sparks are simulated with numpy, and the whole
+    position array is copied into the vertex data each frame.
+    """
+
+    def __init__(self, parent):
+        super(SparkBatch, self).__init__()
+
+        self.ring = RingBuffer(SPARK_BURST_CAPACITY)
+
+        numSparks = SPARK_BURST_CAPACITY * SPARKS_PER_BURST
+        self.positions  = np.zeros((numSparks, 3), dtype=np.float32)
+        self.velocities = np.zeros((numSparks, 3), dtype=np.float32)
+        # Frame time at which each burst was spawned.
+        self.burstTimes = np.zeros(SPARK_BURST_CAPACITY)
+
+        vertexData = GeomVertexData("ImpactSparks", GeomVertexFormat.getV3(),
+                                    Geom.UHDynamic)
+        vertexData.setNumRows(numSparks)
+        geom = Geom(vertexData)
+        # Which points get drawn is decided in update, according to which
+        # bursts are still alive.
+        geom.addPrimitive(GeomPoints(Geom.UHDynamic))
+
+        self.geomNode = GeomNode("ImpactSparks")
+        self.geomNode.addGeom(geom)
+        self.nodePath = parent.attachNewNode(self.geomNode)
+        self.nodePath.setColor(SPARK_COLOR)
+        self.nodePath.setLightOff()
+        self.nodePath.setRenderModeThickness(SPARK_THICKNESS)
+        # Sparks are far too small to show up in the shadow map.
+        self.nodePath.hide(SHADOW_CAMERA_MASK)
+        noteCreated(KIND_NODEPATH, "effects.SparkBatch")
+
+    def add(self, pos, normal, frameTime):
+        slot = self.ring.push()
+        self.burstTimes[slot] = frameTime
+
+        # Random directions, flipped into the hemisphere in front of the
+        # surface.
+        directions = rng.normal(size=(SPARKS_PER_BURST, 3))
+        directions /= np.linalg.norm(directions, axis=1)[:, np.newaxis]
+        normalArray = np.array([normal.getX(), normal.getY(), normal.getZ()])
+        behind = directions.dot(normalArray) < 0
+        directions[behind] *= -1
+        speeds = rng.uniform(SPARK_MIN_SPEED, SPARK_MAX_SPEED,
+                             SPARKS_PER_BURST)
+
+        rows = slice(slot * SPARKS_PER_BURST, (slot + 1) * SPARKS_PER_BURST)
+        self.positions[rows]  = (pos.getX(), pos.getY(), pos.getZ())
+        self.velocities[rows] = directions * speeds[:, np.newaxis]
+
+    def update(self, dt, frameTime):
+        # Every burst lives for the same length of time, so they expire in the
+        # order they were spawned, and the live bursts stay contiguous in the
+        # ring.
+        while self.ring.count > 0 and \
+                frameTime - self.burstTimes[self.ring.oldest()] > \
+                SPARK_LIFETIME:
+            self.ring.popOldest()
+
+        geom = self.geomNode.modifyGeom(0)
+        points = geom.modifyPrimitive(0)
+        points.clearVertices()
+        if self.ring.count == 0:
+            return
+
+        self.velocities[:, 2] -= GRAVITY_ACCEL * dt
+        self.positions += self.velocities * dt
+        geom.modifyVertexData().modifyArray(0).modifyHandle().setData(
+            self.positions.tobytes())
+        for firstSlot, numSlots in self.ring.liveRanges():
+            points.addConsecutiveVertices(firstSlot * SPARKS_PER_BURST,
+                                          numSlots * SPARKS_PER_BURST)
@@ -2,14 +2,16 @@ import os
 import sys
 
 from panda3d.bullet import BulletRigidBodyNode
-from panda3d.bullet import BulletTriangleMesh
-from panda3d.bullet import BulletTriangleMeshShape
 from panda3d.core import Filename
-from panda3d.core import Point3
+from panda3d.core import NodePath
 from panda3d.core import Texture
 from panda3d.core import TextureStage
 
 from src.physics import COLLIDE_MASK_SCENERY
+from src.resources import KIND_TEXTURE
+from src.resources import KIND_TEXTURE_STAGE
+from src.resources import noteCreated
+from src.shapes import getPanelShapes
 
 # FIXME[bullet]
 from src import physics
@@ -51,11 +53,15 @@ class Panel(object):
     # TODO: "width" and "height" aren't the best names here. They're really the
     # dimensions in the x and y directions, but "height" sounds like the z
     # direction.
-    def __init__(self, app, pos, hpr, width, height, textureName, parent=None):
+    def __init__(self, app, pos, hpr, width, height, textureName, parent=None,
+                 attach=True):
         """
         Create a (width x height) wall, with its bottom-left corner at pos,
         rotated according to hpr. The wall's texture will be tiled
         appropriately.
+
+        If attach is False, the panel is built but not added to the scene graph
+        or the physics world until attach() is called.
         """
 
         super(Panel, self).__init__()
@@ -73,30 +79,28 @@ class Panel(object):
         #       - self.collisionNP
         #           - self.collisionGeom
 
-        bl = Point3(0,     0,      0)
-        br = Point3(width, 0,      0)
-        tr = Point3(width, height, 0)
-        tl = Point3(0,     height, 0)
-        mesh = BulletTriangleMesh()
-        mesh.addTriangle(bl, tl, br)
-        mesh.addTriangle(tl, br, tr)
-        # TODO: Comment about merits of TriangleMesh vs. Box.
-        shape = BulletTriangleMeshShape(mesh, dynamic=False)
-
+        # A box behind the panel, rather than a two-triangle mesh. They
+        # collide the same on the visible side, but the box is much cheaper
+        # for Bullet's narrowphase, and panels of the same size share a shape.
         node = BulletRigidBodyNode("Panel")
-        node.addShape(shape)
+        for shape, transform in getPanelShapes(width, height):
+            node.addShape(shape, transform)
 
-        self.rootNP = parent.attachNewNode(node)
+        self.parent = parent
+        self.rootNP = NodePath(node)
         self.rootNP.setPos(pos)
         self.rootNP.setHpr(hpr)
         self.rootNP.setCollideMask(COLLIDE_MASK_SCENERY)
 
-        physics.world.attachRigidBody(node)
+        physics.registerBody(self.rootNP, "panel.Panel")
 
         self.model = loadModel(app, "unit-tile-notex.egg")
         self.model.reparentTo(self.rootNP)
 
-        self.texStage = getTextureStage("WallTextureStage")
+        # Panels with the same dimensions use the same texture scale, so they
+        # can safely share a TextureStage (see the comment above
+        # getTextureStage).
+        self.texStage = getTextureStage("WallTextureStage", (width, height))
 
         self.texture = loadTexture(app, textureName)
         # When the model is larger than the texture, cover it by tiling the
@@ -116,6 +120,28 @@ class Panel(object):
         self.model.setScale(width, height, 1)
         self.model.setTexScale(self.texStage, width, height)
 
+        if attach:
+            self.attach()
+
+    def attach(self):
+        """
+        Add the panel to the scene graph and the physics world.
+        """
+
+        physics.resumeBody(self.rootNP, self.parent)
+
+    def detach(self):
+        """
+        Remove the panel from the scene graph and the physics world, keeping it
+        around so it can be attached again later.
+        """
+
+        physics.suspendBody(self.rootNP)
+
+    def destroy(self):
+        physics.removeBody(self.rootNP)
+        self.rootNP.removeNode()
+
 
 class Wall(Panel):
     def __init__(self, app, pos, hpr, width, height, **kwargs):
@@ -176,8 +202,19 @@ class Floor(Panel):
 # default shaders, so a better(?) possibility might be to write our own
 # shaders.
 numTextureStages = 0
-def getTextureStage(baseName=None):
+textureStageCache = {}
+def getTextureStage(baseName=None, cacheKey=None):
+    """
+    Return a TextureStage with a unique name. If cacheKey is not None, then
+    repeated calls with the same baseName and cacheKey return the same
+    TextureStage, so that we don't create a new one for every single panel.
+    """
+
     global numTextureStages
+    if cacheKey is not None:
+        fullKey = (baseName, cacheKey)
+        if fullKey in textureStageCache:
+            return textureStageCache[fullKey]
     if baseName is None:
         prefix = ""
     else:
@@ -190,6 +227,9 @@ def getTextureStage(baseName=None):
     # TextureStage returned by this function will have a unique name.
     texStage = TextureStage(prefix + str(numTextureStages))
     numTextureStages += 1
+    noteCreated(KIND_TEXTURE_STAGE, "panel.getTextureStage")
+    if cacheKey is not None:
+        textureStageCache[fullKey] = texStage
     return texStage
 
 # FIXME: Factor these out.
@@ -211,17 +251,27 @@ def loadModel(app, modelName):
 
     return app.loader.loadModel(modelsDir + modelName)
 
+# The loader already hands back the same Texture when asked for the same file
+# twice, but keep our own cache too, so that we know when a texture is actually
+# new for the purposes of resource accounting.
+loadedTextures = {}
 def loadTexture(app, textureName):
     """
     Load and return a Panda3D model given a path. The textureName is relative
     to the repo's assets/models/tex directory.
     """
 
+    if textureName in loadedTextures:
+        return loadedTextures[textureName]
+
     repository = os.path.abspath(sys.path[0])
     repository = Filename.fromOsSpecific(repository).getFullpath()
     if not repository.endswith('/'):
         repository += '/'
     textureDir = repository + 'assets/models/tex/'
 
-    return app.loader.loadTexture(textureDir + textureName)
+    texture = app.loader.loadTexture(textureDir + textureName)
+    loadedTextures[textureName] = texture
+    noteCreated(KIND_TEXTURE, "panel.loadTexture")
+    return texture
 
@@ -0,0 +1,202 @@
+"""
+Take control of when Python's cyclic garbage collector runs.
+
+Left to itself, the collector runs whenever enough allocations have piled up,
+which can be in the middle of a frame, and a collection of the older
+generations can take several milliseconds. Instead, we turn automatic
+collection off, and at the end of each frame (after rendering, before the
+frame pacer sleeps) collect the young generations if there's enough time left
+in the frame budget for it. Full collections happen only at safe points where
+a pause doesn't matter, such as right after loading the world: how long one
+takes depends on everything that's alive, so no estimate of it is reliable
+enough to fit one into a frame. In case there are no safe points for a long
+time, a full collection is also forced once generation 2 is long overdue, so
+that garbage which has made it to the oldest generation is still freed
+eventually.
+
+Every collection is recorded, with how long it took and which frame it was in.
+"""
+
+import collections
+import gc
+import time
+
+from src.logconfig import newLogger
+from src.telemetry import addFrameStartCallback
+from src.telemetry import getFrameStartTime
+from src.telemetry import incrementCounter
+from src.telemetry import recordEvent
+from src.telemetry import setGauge
+
+log = newLogger(__name__)
+
+# Sort for the task that does the collections. igLoop, which renders, has sort
+# 50; the frame pacer has sort 60.
+GC_TASK_SORT = 55
+
+# Initial guesses at how long a collection of each generation takes, in
+# seconds. These are replaced with measurements as collections happen.
+INITIAL_PAUSE_ESTIMATES = (0.0005, 0.002, 0.010)
+
+# Weight given to the latest measurement when updating the estimates.
+PAUSE_ESTIMATE_SMOOTHING = 0.2
+
+# Leave this much of the frame budget unused, as a margin for error.
+SAFETY_MARGIN = 0.001
+
+# If generation 0 grows to this many times its threshold without there ever
+# being time to collect it, collect it anyway. Young collections only get more
+# expensive the longer they're put off.
+FORCE_GEN0_FACTOR = 10
+
+# Likewise, collect generation 2 anyway once it grows to this many times its
+# threshold. This is a noticeable pause, but with the default thresholds it
+# only happens after a hundred young collections.
+FORCE_GEN2_FACTOR = 10
+
+# Pauses at least this long are also recorded as telemetry events.
+EVENT_PAUSE_THRESHOLD = 0.001
+
+# How many pauses to remember.
+PAUSE_HISTORY = 10000
+
+# One recorded collection. reason is "idle" (in leftover frame time), "forced"
+# (generation 0 or 2 got too big), "safe point", or "external" (started by
+# someone else, such as a direct call to gc.collect).
+GcPause = collections.namedtuple("GcPause",
+                                 ["frame", "generation", "seconds", "reason"])
+
+app = None
+
+manager = None
+
+
+def initGcManager(app_, frameRate):
+    global app
+    app = app_
+
+    global manager
+    manager = GcManager(1.0 / frameRate)
+    manager.install()
+
+    addFrameStartCallback(onFrameStart)
+    app.taskMgr.add(gcIdleTask, "GcIdle", sort=GC_TASK_SORT)
+
+def onFrameStart():
+    manager.startFrame(getFrameStartTime())
+
+def gcIdleTask(task):
+    manager.collectInSpareTime()
+    return task.cont
+
+def collectAtSafePoint(reason="safe point"):
+    """
+    Do a full collection now. Call this when a pause won't be noticed, such as
+    right after loading something.
+    """
+
+    if manager is not None:
+        manager.collect(2, reason)
+
+
+class GcManager(object):
+    def __init__(self, frameBudget, gcModule=gc, clock=time.time):
+        super(GcManager, self).__init__()
+
+        self.frameBudget = frameBudget
+        self.gc = gcModule
+        self.clock = clock
+
+        self.frameNumber = 0
+        self.frameStartTime = clock()
+        self.pauseEstimates = list(INITIAL_PAUSE_ESTIMATES)
+        self.pauses = collections.deque(maxlen=PAUSE_HISTORY)
+
+        # Set while we're running a collection ourselves, so that the
+        # gc.callbacks hook knows not to record it a second time.
+        self.collecting = False
+        self.externalStartTime = None
+
+    def install(self):
+        self.gc.disable()
+        # gc.callbacks only exists in Python 3.3 and later. Without it, we
+        # just don't find out about collections we didn't start.
+        callbacks = getattr(self.gc, "callbacks", None)
+        if callbacks is not None:
+            callbacks.append(self.onGcEvent)
+        log.info("Automatic garbage collection disabled; frame budget "
+                 "%.1f ms.", 1000.0 * self.frameBudget)
+
+    def startFrame(self, frameStartTime=None):
+        """
+        Start a new frame, which started at frameStartTime (by our clock), or
+        now if that's None.
+        """
+
+        self.frameNumber += 1
+        if frameStartTime is None:
+            frameStartTime = self.clock()
+        self.frameStartTime = frameStartTime
+
+    def collectInSpareTime(self):
+        """
+        Collect the oldest young generation (1 or 0) that is due for a
+        collection and that we expect to finish within what's left of this
+        frame's budget. Return the generation collected, or None. Generation 2
+        is left for collectAtSafePoint, unless it's long overdue.
+        """
+
+        spareTime = (self.frameBudget - SAFETY_MARGIN -
+                     (self.clock() - self.frameStartTime))
+        counts     = self.gc.get_count()
+        thresholds = self.gc.get_threshold()
+
+        # Checked first, since otherwise a young generation that's due would
+        # always be collected instead.
+        if counts[2] >= FORCE_GEN2_FACTOR * thresholds[2]:
+            self.collect(2, "forced")
+            return 2
+        for generation in (1, 0):
+            if counts[generation] >= thresholds[generation] and \
+                    self.pauseEstimates[generation] <= spareTime:
+                self.collect(generation, "idle")
+                return generation
+
+        if counts[0] >= FORCE_GEN0_FACTOR * thresholds[0]:
+            self.collect(0, "forced")
+            return 0
+        return None
+
+    def collect(self, generation, reason):
+        self.collecting = True
+        try:
+            startTime = self.clock()
+            self.gc.collect(generation)
+            seconds = self.clock() - startTime
+        finally:
+            self.collecting = False
+
+        self.recordPause(generation, seconds, reason)
+        self.pauseEstimates[generation] += PAUSE_ESTIMATE_SMOOTHING * (
+            seconds - self.pauseEstimates[generation])
+
+    def onGcEvent(self, phase, info):
+        if self.collecting:
+            return
+        if phase == "start":
+            self.externalStartTime = self.clock()
+        elif phase == "stop" and self.externalStartTime is not None:
+            self.recordPause(info["generation"],
+                             self.clock() - self.externalStartTime,
+                             "external")
+            self.externalStartTime = None
+
+    def recordPause(self, generation, seconds, reason):
+        pause = GcPause(self.frameNumber, generation, seconds, reason)
+        self.pauses.append(pause)
+        incrementCounter("gc.gen{}Collections".format(generation))
+        setGauge("gc.lastPauseMs", round(1000.0 * seconds, 3))
+        if seconds >= EVENT_PAUSE_THRESHOLD:
+            recordEvent("gc.pause", frame=self.frameNumber,
+                        generation=generation,
+                        ms=round(1000.0 * seconds, 3), reason=reason)
@@ -1,4 +1,10 @@
+import threading
+
+import numpy as np
+
+from panda3d.core import Mat4
 from panda3d.core import Point3
+from panda3d.core import Vec3
 
 from src.logconfig import newLogger
 from src.utils import constrainToInterval
@@ -15,19 +21,116 @@ smileyNP     = None
 smileyModel  = None
 frowneyModel = None
 
+# Changes to the structure of the scene graph (reparenting, attaching,
+# detaching models) that were requested during the frame but haven't been made
+# yet. See deferSceneGraphChange.
+pendingSceneGraphChanges = []
+pendingSceneGraphChangesLock = threading.Lock()
+
+# Net transforms of the player, their head and the camera (relative to render),
+# and values derived from them, computed at most once per physics tick. The
+# cache is valid while transformCacheTick == latestTick; anything that moves
+# the player between ticks (such as looking around) invalidates it. See
+# updateTransformCache.
+latestTick         = 0
+transformCacheTick = None
+cachedPlayerMat    = None
+cachedHeadMat      = None
+cachedCameraMat    = None
+cachedHeadPos      = None
+cachedHeadForward  = None
+cachedHeadingPitch = None
+
+# Sort for the task that applies deferred scene graph changes. igLoop, which
+# renders the frame, has sort 50; we want to run right before it.
+APPLY_SCENE_GRAPH_CHANGES_SORT = 49
+
 def initGraphics(app_):
     global app
     app = app_
 
+    app.taskMgr.add(applySceneGraphChangesTask, "ApplySceneGraphChanges",
+                    sort=APPLY_SCENE_GRAPH_CHANGES_SORT)
+
+def deferSceneGraphChange(func, *args):
+    """
+    Call func(*args) at the end of the app stage of the current frame, right
+    before it's handed off to be culled and drawn.
+
+    With the threaded render pipeline (threading-model Cull/Draw), the cull
+    thread may still be walking the previous frame's scene graph while our
+    tasks run, so structural changes made in the middle of the frame can be
+    seen half-done. Batching them up at a single point keeps each frame's
+    changes together. This is safe to call from any thread (for example, from
+    an asynchronous loader callback).
+    """
+
+    with pendingSceneGraphChangesLock:
+        pendingSceneGraphChanges.append((func, args))
+
+def applySceneGraphChangesTask(task):
+    global pendingSceneGraphChanges
+    with pendingSceneGraphChangesLock:
+        changes = pendingSceneGraphChanges
+        pendingSceneGraphChanges = []
+    for func, args in changes:
+        func(*args)
+    return task.cont
+
 def toggleSmileyFrowney():
+    # Update the game state right away, so that anything checking it later in
+    # this frame sees the new value. The models get swapped at the end of the
+    # frame.
     global smileyIsFrowney
-    if not smileyIsFrowney:
+    smileyIsFrowney = not smileyIsFrowney
+    deferSceneGraphChange(updateSmileyModel)
+
+def updateSmileyModel():
+    """
+    Make sure the smiley NodePath has the right model (smiley or frowney)
+    attached, according to smileyIsFrowney.
+    """
+
+    if smileyIsFrowney:
         smileyModel.detachNode()
         frowneyModel.reparentTo(smileyNP)
     else:
         frowneyModel.detachNode()
         smileyModel.reparentTo(smileyNP)
-    smileyIsFrowney = not smileyIsFrowney
+
+def onTickFinished(tickCount):
+    """
+    Post-tick callback: the simulation may have moved the player, so the
+    cached transforms are out of date.
+    """
+
+    global latestTick
+    latestTick = tickCount
+
+def invalidateTransformCache():
+    """
+    Call this after moving the player or their head outside of a physics tick.
+    """
+
+    global transformCacheTick
+    transformCacheTick = None
+
+def updateTransformCache():
+    global transformCacheTick, cachedPlayerMat, cachedHeadMat, \
+        cachedCameraMat, cachedHeadPos, cachedHeadForward, cachedHeadingPitch
+
+    if transformCacheTick == latestTick:
+        return
+
+    cachedPlayerMat = playerNP.getMat(app.render)
+    cachedHeadMat   = playerHeadNP.getMat(app.render)
+    # If we're running headless without any window, then there's no camera.
+    if app.camera is not None:
+        cachedCameraMat = app.camera.getMat(app.render)
+    cachedHeadPos      = cachedHeadMat.xformPoint(Point3(0, 0, 0))
+    cachedHeadForward  = cachedHeadMat.xformVec(Vec3(0, 1, 0))
+    cachedHeadingPitch = (playerNP.getH(), playerHeadNP.getP())
+    transformCacheTick = latestTick
 
 def getRelativePlayerVector(vector):
     """
@@ -35,7 +138,8 @@ def getRelativePlayerVector(vector):
     coordinate system.
     """
 
-    return app.render.getRelativeVector(playerNP, vector)
+    updateTransformCache()
+    return cachedPlayerMat.xformVec(vector)
 
 def getRelativePlayerHeadVector(vector):
     """
@@ -43,7 +147,41 @@ def getRelativePlayerHeadVector(vector):
     coordinate system.
     """
 
-    return app.render.getRelativeVector(playerHeadNP, vector)
+    updateTransformCache()
+    return cachedHeadMat.xformVec(vector)
+
+def getRelativePlayerHeadVectors(vectors):
+    """
+    Like getRelativePlayerHeadVector, but for an (N, 3) array of vectors at
+    once. Return the converted vectors as an (N, 3) array.
+    """
+
+    updateTransformCache()
+    # Panda3D matrices act on row vectors (v' = v M), so the upper-left 3x3
+    # block can be applied to the whole array with a single product.
+    rotation = np.array([[cachedHeadMat.getCell(row, col) for col in range(3)]
+                         for row in range(3)])
+    return np.asarray(vectors).dot(rotation)
+
+def getPlayerHeadForward():
+    """
+    Return the direction the player is looking, as a unit vector in the
+    render's coordinate system.
+    """
+
+    updateTransformCache()
+    return Vec3(cachedHeadForward)
+
+def getCameraMat():
+    """
+    Return the camera's transform relative to the render, or None if there's
+    no camera.
+    """
+
+    updateTransformCache()
+    if cachedCameraMat is None:
+        return None
+    return Mat4(cachedCameraMat)
 
 # TODO[#2]: This and getPlayerVel should be in the same module. Probably
 # physics.  And probably it should use the physics node instead of the graphics
@@ -53,12 +191,12 @@ def getPlayerPos():
 
 # TODO[#2]: Uh... not sure we can move this one to physics. What do??
 def getPlayerHeadPos():
-    return app.render.getRelativePoint(playerHeadNP, Point3(0, 0, 0))
+    updateTransformCache()
+    return Point3(cachedHeadPos)
 
 def getPlayerHeadingPitch():
-    heading = playerNP.getH()
-    pitch   = playerHeadNP.getP()
-    return (heading, pitch)
+    updateTransformCache()
+    return cachedHeadingPitch
 
 def changePlayerHeadingPitch(deltaHeading, deltaPitch):
     # Note that the heading change is applied to the playerNP, while
@@ -83,3 +221,5 @@ def changePlayerHeadingPitch(deltaHeading, deltaPitch):
     newPitch = constrainToInterval(newPitch, -89, 89)
     playerHeadNP.setP(newPitch)
 
+    invalidateTransformCache()
+
@@ -0,0 +1,52 @@
+from direct.showbase.ShowBase import ShowBase
+from panda3d.core import ClockObject
+from pandac.PandaModules import loadPrcFileData
+
+from src.logconfig import newLogger
+
+log = newLogger(__name__)
+
+# Values for windowType. "none" doesn't open any window or graphics context at
+# all, so it works even on machines without a display. "offscreen" renders into
+# an offscreen buffer, which is useful when we want to measure rendering too.
+WINDOW_TYPE_NONE      = "none"
+WINDOW_TYPE_OFFSCREEN = "offscreen"
+
+
+def makeHeadlessApp(windowType=WINDOW_TYPE_NONE, extraPrcLines=()):
+    """
+    Create and return a ShowBase that doesn't open a window on screen, for
+    running smush without anyone at the keyboard (soak tests, benchmarks,
+    etc.). Panda3D only allows one ShowBase per process, so this can only be
+    called once.
+
+    The caller is responsible for running initModules on the result.
+    """
+
+    loadPrcFileData("", "window-type {}".format(windowType))
+    # There's nobody to listen, and opening an audio device can fail on
+    # headless machines.
+    loadPrcFileData("", "audio-library-name null")
+    for line in extraPrcLines:
+        loadPrcFileData("", line)
+
+    log.info("Creating headless app (window-type %s).", windowType)
+    return ShowBase()
+
+
+def useFixedFrameRate(frameRate):
+    """
+    Make the global clock advance by exactly 1/frameRate seconds every frame,
+    no matter how long the frame actually took. That way a headless run
+    simulates as fast as the machine allows, and is independent of how busy
+    the machine is.
+    """
+
+    clock = ClockObject.getGlobalClock()
+    clock.setMode(ClockObject.MNonRealTime)
+    clock.setFrameRate(frameRate)
+
+
+def stepFrames(app, numFrames):
+    for _ in range(numFrames):
+        app.taskMgr.step()
@@ -0,0 +1,93 @@
+import collections
+
+from panda3d.core import NodePath
+from panda3d.core import Point3
+from panda3d.core import Vec3
+
+from src import physics
+from src.graphics import getPlayerHeadForward
+from src.graphics import getPlayerHeadPos
+from src.logconfig import newLogger
+from src.physics import COLLIDE_MASK_ENTITY
+from src.physics import COLLIDE_MASK_GROUND_PLANE
+from src.physics import COLLIDE_MASK_SCENERY
+
+log = newLogger(__name__)
+
+# How far a hitscan shot reaches, in meters.
+HITSCAN_RANGE = 100.0
+
+# Hitscan shots hit whatever a bullet would, except for other bullets (which
+# are far too small to be worth aiming at).
+HITSCAN_MASK = (COLLIDE_MASK_GROUND_PLANE | COLLIDE_MASK_SCENERY |
+                COLLIDE_MASK_ENTITY)
+
+# The result of a hitscan shot that hit something. hitNP is a NodePath for the
+# node that was hit; pos and normal are in render's coordinate system.
+HitscanHit = collections.namedtuple("HitscanHit",
+                                    ["fromPos", "toPos", "hitNP", "pos",
+                                     "normal"])
+
+app = None
+
+# Shots requested since the last tick, as a list of (fromPos, toPos) pairs in
+# render's coordinate system.
+pendingShots = []
+
+# Functions to call with a HitscanHit for every shot that hits something.
+hitCallbacks = []
+
+
+def initHitscan(app_):
+    global app
+    app = app_
+
+    # Resolve the shots at the start of each tick, before anything moves, so
+    # that they hit what the shooter saw when they fired.
+    physics.addPreTickCallback(resolvePendingShots)
+
+
+def addHitCallback(callback):
+    hitCallbacks.append(callback)
+
+
+def fireHitscanShot(fromPos, direction):
+    """
+    Request a hitscan shot from fromPos in the given direction (both in
+    render's coordinate system). The shot is resolved, along with every other
+    shot requested this tick, at the start of the next tick.
+    """
+
+    direction = Vec3(direction)
+    direction.normalize()
+    pendingShots.append((Point3(fromPos),
+                         Point3(fromPos + direction * HITSCAN_RANGE)))
+
+
+def firePlayerHitscanShot():
+    fireHitscanShot(getPlayerHeadPos(), getPlayerHeadForward())
+
+
+def resolvePendingShots(dt):  # pylint: disable=unused-argument
+    global pendingShots
+
+    if not pendingShots:
+        return
+
+    # Swap the list out first, in case a callback fires more shots; those
+    # belong to the next tick.
+    shots, pendingShots = pendingShots, []
+
+    # Do all the ray queries in one pass, then deliver the hits, so that the
+    # callbacks can't change the world out from under the remaining rays.
+    hits = []
+    for fromPos, toPos in shots:
+        result = physics.world.rayTestClosest(fromPos, toPos, HITSCAN_MASK)
+        if result.hasHit():
+            hits.append(HitscanHit(fromPos, toPos, NodePath(result.getNode()),
+                                   result.getHitPos(),
+                                   result.getHitNormal()))
+
+    for hit in hits:
+        for callback in hitCallbacks:
+            callback(hit)
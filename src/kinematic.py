@@ -0,0 +1,227 @@
+import math
+
+from panda3d.core import TransformState
+from panda3d.core import Vec3
+
+from src import physics
+from src.logconfig import newLogger
+from src.physics import COLLIDE_MASK_ENTITY
+from src.physics import COLLIDE_MASK_GROUND_PLANE
+from src.physics import COLLIDE_MASK_SCENERY
+from src.world_config import GRAVITY_ACCEL
+
+log = newLogger(__name__)
+
+# What a character can bump into. Note that this doesn't include other
+# characters, just like the collision matrix in physics.initCollisionGroups.
+CHARACTER_SWEEP_MASK = (COLLIDE_MASK_GROUND_PLANE | COLLIDE_MASK_SCENERY |
+                        COLLIDE_MASK_ENTITY)
+
+# After a sweep hits something, back off by this much so that the next sweep
+# doesn't start out already touching (and therefore immediately hitting) the
+# same surface.
+SKIN_WIDTH = 0.01
+
+# While standing on the ground, stick to it if it drops away by no more than
+# this much in a single tick. This is what keeps characters from briefly going
+# airborne every time they walk down a slope or off a tiny ledge.
+GROUND_SNAP_DISTANCE = 0.1
+
+# How many times a horizontal move can be deflected along a wall in a single
+# tick. Running into a corner uses up two.
+MAX_SLIDE_ITERATIONS = 4
+
+# Anything shorter than this is considered not moving at all.
+EPSILON = 1e-6
+
+# All controllers created so far, in the order they were created. They are all
+# updated once per physics tick by stepAllControllers.
+allControllers = []
+
+
+def stepAllControllers(dt):
+    for controller in allControllers:
+        controller.tick(dt)
+
+
+class KinematicController(object):
+    """
+    Moves a kinematic rigid body around like a character: walking, stepping up
+    small ledges, sliding along walls, refusing to walk up overly steep slopes,
+    snapping to the ground and falling (or jumping) under gravity.
+
+    Unlike BulletCharacterControllerNode, the collision detection is done with
+    a handful of convex sweep tests once per physics tick, rather than on every
+    Bullet substep. Since the ticks have a fixed length, the controller also
+    behaves the same no matter what the frame rate is.
+    """
+
+    def __init__(self, bodyNP, shape, stepHeight, maxSlope,
+                 sweepMask=CHARACTER_SWEEP_MASK):
+        """
+        Control the kinematic body at bodyNP. shape must be convex, and should
+        be the shape the body uses for collisions. maxSlope is in degrees.
+        """
+
+        super(KinematicController, self).__init__()
+
+        self.bodyNP     = bodyNP
+        self.shape      = shape
+        self.stepHeight = stepHeight
+        self.sweepMask  = sweepMask
+
+        # A surface is walkable if its normal's z component is at least this
+        # much.
+        self.minGroundNormalZ = math.cos(math.radians(maxSlope))
+
+        # Requested movement, relative to the body's own coordinate system.
+        self.linearMovement  = Vec3(0, 0, 0)
+        # Requested rotation, in degrees per second. Positive is to the left.
+        self.angularMovement = 0.0
+
+        self.verticalVel = 0.0
+        self.isGrounded  = False
+
+        # Speed of the jump to start at the next tick, or None.
+        self.pendingJumpSpeed = None
+
+        allControllers.append(self)
+
+    def setLinearMovement(self, velocity):
+        """
+        Set the horizontal velocity the character should move with, relative to
+        its own coordinate system. The z component is ignored; vertical motion
+        comes from gravity and jumping, and is preserved across calls.
+        """
+
+        self.linearMovement = Vec3(velocity.getX(), velocity.getY(), 0)
+
+    def setAngularMovement(self, degreesPerSecond):
+        self.angularMovement = degreesPerSecond
+
+    def doJump(self, jumpSpeed):
+        """
+        Jump with the given initial upward speed, if standing on the ground at
+        the next tick.
+        """
+
+        self.pendingJumpSpeed = jumpSpeed
+
+    def getVelocity(self):
+        """
+        Return the velocity the character is trying to move with, in the
+        render's coordinate system.
+        """
+
+        render = self.bodyNP.getTop()
+        velocity = render.getRelativeVector(self.bodyNP, self.linearMovement)
+        velocity.setZ(self.verticalVel)
+        return velocity
+
+    def tick(self, dt):
+        render = self.bodyNP.getTop()
+
+        if self.angularMovement != 0:
+            self.bodyNP.setH(self.bodyNP.getH() + self.angularMovement * dt)
+
+        horizontalMove = render.getRelativeVector(self.bodyNP,
+                                                  self.linearMovement) * dt
+        horizontalMove.setZ(0)
+
+        if self.pendingJumpSpeed is not None and self.isGrounded:
+            self.verticalVel = self.pendingJumpSpeed
+            self.isGrounded  = False
+        self.pendingJumpSpeed = None
+
+        if not self.isGrounded:
+            self.verticalVel -= GRAVITY_ACCEL * dt
+
+        pos = self.bodyNP.getPos(render)
+
+        # Step up first, so that the horizontal move can carry us over
+        # anything shorter than stepHeight. We undo this when stepping down
+        # below.
+        stepUp = 0.0
+        if self.isGrounded and self.stepHeight > 0:
+            steppedPos, _ = self.sweep(pos, pos + Vec3(0, 0, self.stepHeight))
+            stepUp = steppedPos.getZ() - pos.getZ()
+            pos = steppedPos
+
+        pos = self.slide(pos, horizontalMove)
+
+        if self.verticalVel > 0:
+            pos, hit = self.sweep(pos, pos + Vec3(0, 0, self.verticalVel * dt))
+            if hit is not None:
+                # Bumped our head.
+                self.verticalVel = 0.0
+
+        # Step back down, falling as well if we're falling, and snapping to
+        # the ground if we were on it.
+        drop = stepUp
+        if self.verticalVel <= 0:
+            drop -= self.verticalVel * dt
+            if self.isGrounded:
+                drop += GROUND_SNAP_DISTANCE
+        if drop > EPSILON:
+            droppedPos, hit = self.sweep(pos, pos - Vec3(0, 0, drop))
+            if hit is not None and self.verticalVel <= 0 and \
+                    hit.getHitNormal().getZ() >= self.minGroundNormalZ:
+                self.isGrounded  = True
+                self.verticalVel = 0.0
+            else:
+                self.isGrounded = False
+            pos = droppedPos
+        else:
+            self.isGrounded = False
+
+        self.bodyNP.setPos(render, pos)
+
+    def slide(self, pos, move):
+        """
+        Move from pos by move, sliding along anything in the way. Return the
+        resulting position.
+        """
+
+        for _ in range(MAX_SLIDE_ITERATIONS):
+            if move.length() < EPSILON:
+                break
+            target = pos + move
+            pos, hit = self.sweep(pos, target)
+            if hit is None:
+                break
+            remaining = target - pos
+            normal = hit.getHitNormal()
+            if normal.getZ() >= self.minGroundNormalZ:
+                # A walkable slope: keep going, but along the slope.
+                remaining -= normal * remaining.dot(normal)
+            else:
+                # A wall (or a slope too steep to walk up). Slide along it
+                # horizontally; don't let it push us up into the air.
+                wallNormal = Vec3(normal.getX(), normal.getY(), 0)
+                if wallNormal.length() < EPSILON:
+                    break
+                wallNormal.normalize()
+                remaining -= wallNormal * remaining.dot(wallNormal)
+            move = remaining
+        return pos
+
+    def sweep(self, fromPos, toPos):
+        """
+        Sweep our shape from fromPos toward toPos. Return a pair (pos, hit),
+        where pos is as far as we can get without hitting anything (minus
+        SKIN_WIDTH) and hit is the sweep result if we hit something, else None.
+        """
+
+        delta  = toPos - fromPos
+        length = delta.length()
+        if length < EPSILON:
+            return fromPos, None
+
+        result = physics.world.sweepTestClosest(
+            self.shape, TransformState.makePos(fromPos),
+            TransformState.makePos(toPos), self.sweepMask, 0.0)
+        if not result.hasHit():
+            return toPos, None
+
+        fraction = max(0.0, result.getHitFraction() - SKIN_WIDTH / length)
+        return fromPos + delta * fraction, result
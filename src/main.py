@@ -1,10 +1,33 @@
+import argparse
+
 from direct.showbase.ShowBase import ShowBase
+from panda3d.core import GraphicsWindow
+from pandac.PandaModules import loadPrcFileData
+
+from src import world
 
 from src.control import initControl
+from src.control import isWindowActive
+from src.effects import initEffects
+from src.gcmanager import collectAtSafePoint
+from src.gcmanager import initGcManager
 from src.graphics import initGraphics
+from src.hitscan import initHitscan
 from src.logconfig import enableDebugLogging
 from src.logconfig import newLogger
+from src.pacing import DEFAULT_IDLE_FRAME_RATE
+from src.pacing import DEFAULT_TARGET_FRAME_RATE
+from src.pacing import initPacing
 from src.physics import initPhysics
+from src.profiler import DEFAULT_HITCH_THRESHOLD_MS
+from src.profiler import initProfiler
+from src.quality import initQuality
+from src.shadows import initShadows
+from src.simlod import initSimLod
+from src.snapshot import initSnapshots
+from src.streaming import initStreaming
+from src.telemetry import initTelemetry
+from src.triggers import initTriggers
 from src.world import initWorld
 
 log = newLogger(__name__)
@@ -12,6 +35,8 @@ log = newLogger(__name__)
 LOG_DEBUG = False
 
 def main():
+    args = parseArgs()
+
     log.info("Begin.")
 
     if LOG_DEBUG:
@@ -21,6 +46,12 @@ def main():
     else:
         log.info("Debug logging disabled.")
 
+    # This has to be set before the window (and therefore the graphics
+    # pipeline) is created.
+    if args.threading_model:
+        log.info("Using threading model %r.", args.threading_model)
+        loadPrcFileData("", "threading-model {}".format(args.threading_model))
+
     app = ShowBase()
 
     # Sigh. Other modules can't just import app from us, because Python imports
@@ -58,17 +89,70 @@ def main():
     # scale well. For now, though, it works.
     initModules(app)
 
+    initProfiler(app, args.hitch_ms, startCapturing=args.profile)
+
+    targetFrameRate = args.fps if args.fps > 0 else DEFAULT_TARGET_FRAME_RATE
+    initQuality(app, targetFrameRate)
+
+    # Loading the world churns through a lot of objects; clean up after it
+    # now, before anyone is playing.
+    initGcManager(app, targetFrameRate)
+    collectAtSafePoint("world loaded")
+
+    # Only pace frames when there's a window on screen. Headless runs set up
+    # their own clocks (see headless.py).
+    if args.fps > 0 and isinstance(app.win, GraphicsWindow):
+        initPacing(app, isWindowActive, args.fps, args.idle_fps)
+
     app.run()
 
     # Not reached; I think Panda3D calls sys.exit when you close the window.
     log.info("End.")
 
 
+def parseArgs():
+    parser = argparse.ArgumentParser(
+        description="SMUSH: Silly Mostly-Untested SHooter")
+    parser.add_argument("--fps", type=float,
+                        default=DEFAULT_TARGET_FRAME_RATE,
+                        help="Target frame rate. 0 means don't limit it.")
+    parser.add_argument("--idle-fps", type=float,
+                        default=DEFAULT_IDLE_FRAME_RATE,
+                        help="Frame rate while the window is unfocused or "
+                             "minimized.")
+    parser.add_argument("--threading-model", default="",
+                        metavar="MODEL",
+                        help="Panda3D render pipeline threading model, such "
+                             "as 'Cull/Draw' (cull and draw each in their own "
+                             "thread) or '/Draw' (cull and draw together in "
+                             "one thread). The default runs everything in "
+                             "the main thread.")
+    parser.add_argument("--profile", action="store_true",
+                        help="Start a profiler capture right away. It's "
+                             "written out when stopped with control-p or "
+                             "when the game exits.")
+    parser.add_argument("--hitch-ms", type=float,
+                        default=DEFAULT_HITCH_THRESHOLD_MS,
+                        help="Write a profiler capture for any frame that "
+                             "takes longer than this many milliseconds. This "
+                             "keeps the profiler sampling all the time, so "
+                             "it's off (0) by default.")
+    return parser.parse_args()
+
+
 def initModules(app):
+    initTelemetry(app)
     initPhysics(app)
     initControl(app)
     initGraphics(app)
+    initHitscan(app)
+    initStreaming(app)
+    initTriggers(app)
+    initShadows(app)
     initWorld(app)
+    initEffects(app)
+    initSimLod(app)
+    initSnapshots(app, world.playerController)
 
 
 if __name__ == "__main__":
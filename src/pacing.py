@@ -0,0 +1,145 @@
+import collections
+import math
+import time
+
+from src.logconfig import newLogger
+from src.telemetry import setGauge
+
+log = newLogger(__name__)
+
+# Default frame rates, in frames per second. When the window doesn't have the
+# focus (or is minimized), there's nobody watching, so we only need to run
+# often enough to keep the simulation ticking and the window responsive.
+DEFAULT_TARGET_FRAME_RATE = 60.0
+DEFAULT_IDLE_FRAME_RATE   = 10.0
+
+# time.sleep() commonly overshoots by a millisecond or so. To keep frame
+# intervals even, sleep until this long before the deadline, then spin for the
+# rest.
+SPIN_TIME = 0.002
+
+# Number of recent frame intervals used for the jitter statistics.
+JITTER_HISTORY = 120
+
+app = None
+pacer = None
+
+# Function returning whether the window is in active use (has the focus and
+# isn't minimized).
+isWindowActive = None
+
+
+def initPacing(app_, isWindowActive_,
+               targetFrameRate=DEFAULT_TARGET_FRAME_RATE,
+               idleFrameRate=DEFAULT_IDLE_FRAME_RATE):
+    global app, pacer, isWindowActive
+    app = app_
+    isWindowActive = isWindowActive_
+
+    pacer = FramePacer(targetFrameRate, idleFrameRate)
+    log.info("Pacing frames at %.0f fps (%.0f fps while idle).",
+             targetFrameRate, idleFrameRate)
+
+    # Run after igLoop (sort 50), which renders and flips the frame. That way
+    # the time between flips is what gets evened out.
+    app.taskMgr.add(framePacingTask, "FramePacing", sort=60)
+
+
+def framePacingTask(task):
+    pacer.setIdle(not isWindowActive())
+    pacer.waitForNextFrame()
+
+    stats = pacer.getJitterStats()
+    if stats is not None:
+        setGauge("pacing.idle",               pacer.isIdle)
+        setGauge("pacing.mean interval ms",   stats.meanMs)
+        setGauge("pacing.stddev ms",          stats.stddevMs)
+        setGauge("pacing.p95 deviation ms",   stats.p95DeviationMs)
+        setGauge("pacing.max deviation ms",   stats.maxDeviationMs)
+    return task.cont
+
+
+JitterStats = collections.namedtuple(
+    "JitterStats",
+    ["meanMs", "stddevMs", "p95DeviationMs", "maxDeviationMs"])
+
+
+class FramePacer(object):
+    """
+    Sleeps at the end of each frame so that frames start at a steady rate,
+    using a lower rate while idle.
+    """
+
+    def __init__(self, targetFrameRate, idleFrameRate, clock=time.time,
+                 sleep=time.sleep):
+        super(FramePacer, self).__init__()
+
+        self.targetInterval = 1.0 / targetFrameRate
+        self.idleInterval   = 1.0 / idleFrameRate
+        self.clock = clock
+        self.sleep = sleep
+
+        self.isIdle = False
+        self.nextDeadline = None
+        self.lastFrameEnd = None
+
+        # Recent (actual interval, intended interval) pairs, in seconds.
+        self.intervals = collections.deque(maxlen=JITTER_HISTORY)
+
+    def setIdle(self, isIdle):
+        if isIdle != self.isIdle:
+            log.debug("Frame pacing now %s.", "idle" if isIdle else "active")
+            self.isIdle = isIdle
+            # Start the new rate from now, rather than waiting out (or
+            # rushing through) a deadline computed for the old rate.
+            self.nextDeadline = None
+
+    def currentInterval(self):
+        return self.idleInterval if self.isIdle else self.targetInterval
+
+    def waitForNextFrame(self):
+        interval = self.currentInterval()
+        now = self.clock()
+        if self.nextDeadline is None:
+            self.nextDeadline = (now if self.lastFrameEnd is None
+                                 else self.lastFrameEnd) + interval
+
+        remaining = self.nextDeadline - now
+        if remaining > SPIN_TIME:
+            self.sleep(remaining - SPIN_TIME)
+        while self.clock() < self.nextDeadline:
+            pass
+
+        now = self.clock()
+        if self.lastFrameEnd is not None:
+            self.intervals.append((now - self.lastFrameEnd, interval))
+        self.lastFrameEnd = now
+
+        # Schedule the next frame relative to the deadline rather than to now,
+        # so that small oversleeps don't accumulate into a lower frame rate.
+        # But if we've fallen more than a whole frame behind, don't try to
+        # catch up with a burst of short frames; just start over from now.
+        self.nextDeadline += interval
+        if self.nextDeadline < now:
+            self.nextDeadline = now + interval
+
+    def getJitterStats(self):
+        """
+        Return a JitterStats for the recent frames, or None if there haven't
+        been any yet.
+        """
+
+        if not self.intervals:
+            return None
+        actuals = [actual for actual, _ in self.intervals]
+        deviations = sorted(abs(actual - intended)
+                            for actual, intended in self.intervals)
+        mean = sum(actuals) / len(actuals)
+        variance = sum((actual - mean) ** 2 for actual in actuals) / \
+            len(actuals)
+        p95Index = min(len(deviations) - 1,
+                       int(math.ceil(0.95 * len(deviations))) - 1)
+        return JitterStats(meanMs         = 1000.0 * mean,
+                           stddevMs       = 1000.0 * math.sqrt(variance),
+                           p95DeviationMs = 1000.0 * deviations[p95Index],
+                           maxDeviationMs = 1000.0 * deviations[-1])
@@ -3,6 +3,7 @@ from panda3d.core import BitMask32
 from panda3d.core import ClockObject
 from panda3d.core import CollisionHandlerEvent
 from panda3d.core import CollisionTraverser
+from panda3d.core import NodePath
 from panda3d.core import Vec3
 from panda3d.physics import PhysicsCollisionHandler
 
@@ -10,6 +11,8 @@ from pandac.PandaModules import loadPrcFileData
 
 from src.graphics import toggleSmileyFrowney
 from src.logconfig import newLogger
+from src.resources import noteBodyCreated
+from src.resources import noteBodyDestroyed
 from src.world_config import GRAVITY_ACCEL
 
 log = newLogger(__name__)
@@ -25,6 +28,7 @@ COLLIDE_BIT_BULLET       = 4
     # the player. Really this group is for "things that otherwise collide as
     # entities, except that they don't collide with the player". But I couldn't
     # think of a short name for that.
+COLLIDE_BIT_TRIGGER      = 5 # Ghost volumes that detect things (triggers.py)
 
 COLLIDE_MASK_NONE         = BitMask32(0x0)
 COLLIDE_MASK_GROUND_PLANE = BitMask32.bit(COLLIDE_BIT_GROUND_PLANE)
@@ -32,6 +36,30 @@ COLLIDE_MASK_SCENERY      = BitMask32.bit(COLLIDE_BIT_SCENERY     )
 COLLIDE_MASK_PLAYER       = BitMask32.bit(COLLIDE_BIT_PLAYER      )
 COLLIDE_MASK_ENTITY       = BitMask32.bit(COLLIDE_BIT_ENTITY      )
 COLLIDE_MASK_BULLET       = BitMask32.bit(COLLIDE_BIT_BULLET      )
+COLLIDE_MASK_TRIGGER      = BitMask32.bit(COLLIDE_BIT_TRIGGER     )
+
+# Tags stored on the nodes of rigid bodies attached via attachBody. The creator
+# tag lets us attribute the body in the resource counts when it's removed, even
+# if whoever removes it didn't create it. The removed tag makes removeBody safe
+# to call more than once on the same body. The suspended tag marks bodies that
+# still exist but are not currently in the physics world.
+CREATOR_TAG   = "creator"
+REMOVED_TAG   = "removed"
+SUSPENDED_TAG = "suspended"
+
+# The simulation advances in fixed ticks of TICK_DT seconds, each of which is
+# made up of SUBSTEPS_PER_TICK Bullet substeps. Anything that has to happen at
+# the simulation rate rather than the frame rate (such as the kinematic
+# character controllers) runs once per tick, via the pre/post-tick callbacks.
+TICK_RATE         = 60
+TICK_DT           = 1.0 / TICK_RATE
+SUBSTEP_DT        = 1.0 / 600.0
+SUBSTEPS_PER_TICK = int(round(TICK_DT / SUBSTEP_DT))
+
+# If a frame takes so long that we'd need more than this many ticks to catch
+# up, give up and drop the excess time instead. Otherwise a single long hitch
+# (say, loading something) would cause a spiral of ever-slower frames.
+MAX_TICKS_PER_FRAME = 10
 
 # Not used yet, but still define it preemptively because we'll probably want
 # it.
@@ -39,6 +67,17 @@ app = None
 
 world = None
 
+# Number of ticks simulated so far.
+tickCount = 0
+# Simulated time not yet consumed by a tick.
+tickAccumulator = 0.0
+
+# Functions to call at the start and end of every tick. Pre-tick callbacks are
+# called with the tick length (in seconds); post-tick callbacks are called with
+# the number of the tick that just finished.
+preTickCallbacks  = []
+postTickCallbacks = []
+
 physicsCollisionHandler = None
 eventCollisionHandler   = None
 
@@ -60,16 +99,55 @@ def initPhysics(app_):
     initCollisionHandling()
 
 def doPhysicsOneFrame(task):
+    global tickAccumulator
+
     # TODO: This next line doesn't lint, but maybe it would be more efficient
     # to cache the globalClock somehow instead of calling getGlobalClock()
     # every frame? I suppose we could just suppress the pylint warning.
     # dt = globalClock.getDt()
     dt = ClockObject.getGlobalClock().getDt()
+
+    tickAccumulator += dt
+    ticksThisFrame = 0
+    while tickAccumulator >= TICK_DT:
+        if ticksThisFrame >= MAX_TICKS_PER_FRAME:
+            log.debug("Dropping %.3f seconds of simulation time.",
+                      tickAccumulator)
+            tickAccumulator = 0.0
+            break
+        doPhysicsOneTick()
+        tickAccumulator -= TICK_DT
+        ticksThisFrame += 1
+    return task.cont
+
+def doPhysicsOneTick():
+    global tickCount
+
+    for callback in preTickCallbacks:
+        callback(TICK_DT)
+
     # TODO[#3] This seems excessive but until we fix recoil lets leave this
     # here for debugging purposes
-    # 90 substeps, at 1/600 frames per second for physics updates.
-    world.doPhysics(dt, 90, 1.0/600.0)
-    return task.cont
+    # Substeps at 1/600 seconds each for physics updates.
+    world.doPhysics(TICK_DT, SUBSTEPS_PER_TICK, SUBSTEP_DT)
+    tickCount += 1
+
+    for callback in postTickCallbacks:
+        callback(tickCount)
+
+def addPreTickCallback(callback, first=False):
+    """
+    Call callback(dt) at the start of every tick. If first is True, call it
+    before any of the callbacks added so far rather than after them.
+    """
+
+    if first:
+        preTickCallbacks.insert(0, callback)
+    else:
+        preTickCallbacks.append(callback)
+
+def addPostTickCallback(callback):
+    postTickCallbacks.append(callback)
 
 def initCollisionGroups():
     """
@@ -82,12 +160,16 @@ def initCollisionGroups():
     # only specify one half of the matrix.
     #
     #               ground
-    #               plane   scenery  player  entity  bullet
-    # ground plane    1        0       1       1       1
-    # scenery                  0       1       1       1
-    # player                           0       1       0
-    # entity                                   1       1
-    # bullet                                           1
+    #               plane   scenery  player  entity  bullet  trigger
+    # ground plane    1        0       1       1       1        0
+    # scenery                  0       1       1       1        0
+    # player                           0       1       0        1
+    # entity                                   1       1        1
+    # bullet                                           1        1
+    # trigger                                                   0
+    #
+    # Triggers are ghosts, so "colliding" with them just means being reported
+    # as overlapping them; nothing bounces off.
 
     setGroupCollisionFlags(COLLIDE_BIT_GROUND_PLANE,
                            [(COLLIDE_BIT_GROUND_PLANE, 1)])
@@ -116,6 +198,14 @@ def initCollisionGroups():
                             (COLLIDE_BIT_ENTITY,       1),
                             (COLLIDE_BIT_BULLET,       1)])
 
+    setGroupCollisionFlags(COLLIDE_BIT_TRIGGER,
+                           [(COLLIDE_BIT_GROUND_PLANE, 0),
+                            (COLLIDE_BIT_SCENERY,      0),
+                            (COLLIDE_BIT_PLAYER,       1),
+                            (COLLIDE_BIT_ENTITY,       1),
+                            (COLLIDE_BIT_BULLET,       1),
+                            (COLLIDE_BIT_TRIGGER,      0)])
+
 def setGroupCollisionFlags(bit1, otherBitSpec):
     for bit2, canCollide in otherBitSpec:
         world.setGroupCollisionFlag(bit1, bit2, bool(canCollide))
@@ -159,12 +249,74 @@ def onCollideEventIn(entry):
     # There, pylint, I used the parameter. Happy?
     log.debug("    %s", entry)
 
-    # Get rid of the bullet.
+    # Get rid of the bullet. Detaching it from the scene graph isn't enough;
+    # it also has to come out of the physics world, or Bullet will keep
+    # simulating it forever.
     bullet = entry.getFromNode().getParent(0)
-    bullet.getParent(0).removeChild(bullet)
+    removeBody(NodePath(bullet))
 
     toggleSmileyFrowney()
 
+def registerBody(bodyNP, creator):
+    """
+    Count the rigid body at bodyNP (and its shapes) as belonging to creator for
+    the purposes of resource accounting, without attaching it to the physics
+    world yet. Use resumeBody to attach it later.
+    """
+
+    bodyNP.setTag(CREATOR_TAG, creator)
+    bodyNP.setTag(SUSPENDED_TAG, "1")
+    noteBodyCreated(creator, bodyNP.node().getNumShapes())
+
+def attachBody(bodyNP, creator):
+    """
+    Attach the rigid body at bodyNP to the physics world, and count it (and its
+    shapes) as belonging to creator for the purposes of resource accounting.
+    """
+
+    registerBody(bodyNP, creator)
+    world.attachRigidBody(bodyNP.node())
+    bodyNP.clearTag(SUSPENDED_TAG)
+
+def suspendBody(bodyNP):
+    """
+    Temporarily take a body out of the physics world and the scene graph. It
+    still counts as live; use resumeBody to put it back.
+    """
+
+    if bodyNP.hasTag(SUSPENDED_TAG):
+        return
+    world.removeRigidBody(bodyNP.node())
+    bodyNP.setTag(SUSPENDED_TAG, "1")
+    bodyNP.detachNode()
+
+def resumeBody(bodyNP, parent):
+    """
+    Undo suspendBody (or registerBody), reattaching the body under parent.
+    """
+
+    if not bodyNP.hasTag(SUSPENDED_TAG):
+        return
+    bodyNP.reparentTo(parent)
+    world.attachRigidBody(bodyNP.node())
+    bodyNP.clearTag(SUSPENDED_TAG)
+
+def removeBody(bodyNP):
+    """
+    Undo attachBody (or registerBody): remove the body from the physics world
+    and detach it from the scene graph. Calling this on a body that was already
+    removed does nothing.
+    """
+
+    if bodyNP.isEmpty() or bodyNP.hasTag(REMOVED_TAG):
+        return
+    node = bodyNP.node()
+    if not bodyNP.hasTag(SUSPENDED_TAG):
+        world.removeRigidBody(node)
+    bodyNP.setTag(REMOVED_TAG, "1")
+    noteBodyDestroyed(bodyNP.getTag(CREATOR_TAG), node.getNumShapes())
+    bodyNP.detachNode()
+
 def onCollideEventOut(entry):
     # Note: I'm not sure we actually care about handling the "out" events.
     log.debug("Collision detected OUT.")
@@ -0,0 +1,110 @@
+"""
+Measure how the render pipeline's threading model affects frame time. Each
+threading model is run in its own process, rendering offscreen with Panda3D's
+software renderer (so it works on machines without a GPU).
+
+Run with:
+    python -m src.pipeline_bench --frames 600
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+import time
+
+from src.logconfig import newLogger
+
+log = newLogger(__name__)
+
+# Threading models to compare. The empty string is Panda3D's default of doing
+# everything in the main (app) thread.
+THREADING_MODELS = ["", "/Draw", "Cull/Draw"]
+
+# Frames to run before we start timing, so that startup work (loading models,
+# compiling shaders, building chunks) doesn't count.
+WARMUP_FRAMES = 60
+
+# How many bullets to have flying around during the measurement, so that
+# there's a nontrivial amount to cull and draw.
+NUM_BULLETS = 150
+
+# Display module for the software renderer.
+SOFTWARE_DISPLAY = "p3tinydisplay"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument("--frames", type=int, default=600,
+                        help="Frames to time for each threading model.")
+    parser.add_argument("--child", metavar="MODEL",
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        runChild(args.child, args.frames)
+    else:
+        runComparison(args.frames)
+
+
+def runComparison(numFrames):
+    results = {}
+    for model in THREADING_MODELS:
+        output = subprocess.check_output(
+            [sys.executable, "-m", "src.pipeline_bench",
+             "--frames", str(numFrames), "--child", model])
+        # The child's logging goes to stderr, so stdout is just our result.
+        results[model] = json.loads(output.decode("utf-8").strip()
+                                    .splitlines()[-1])
+
+    baselineMs = results[""]["meanMs"]
+    log.info("%-12s %10s %10s %10s", "model", "mean ms", "p95 ms", "speedup")
+    for model in THREADING_MODELS:
+        result = results[model]
+        log.info("%-12s %10.3f %10.3f %9.2fx", model or "(default)",
+                 result["meanMs"], result["p95Ms"],
+                 baselineMs / result["meanMs"])
+    return results
+
+
+def runChild(model, numFrames):
+    # Don't import any of this in the parent, which never creates a ShowBase.
+    from panda3d.core import Vec3
+
+    from src import world
+    from src.graphics import changePlayerHeadingPitch
+    from src.headless import WINDOW_TYPE_OFFSCREEN
+    from src.headless import makeHeadlessApp
+    from src.headless import stepFrames
+    from src.main import initModules
+
+    prcLines = ["load-display {}".format(SOFTWARE_DISPLAY)]
+    if model:
+        prcLines.append("threading-model {}".format(model))
+    app = makeHeadlessApp(WINDOW_TYPE_OFFSCREEN, prcLines)
+    initModules(app)
+
+    for _ in range(NUM_BULLETS):
+        changePlayerHeadingPitch(360.0 / NUM_BULLETS, 0)
+        world.makePlayerBullet()
+    # Keep the player moving, so that the view changes every frame.
+    world.playerController.setAngularMovement(45)
+    world.playerController.setLinearMovement(Vec3(0, 2, 0))
+    stepFrames(app, WARMUP_FRAMES)
+
+    frameTimes = []
+    for _ in range(numFrames):
+        startTime = time.time()
+        app.taskMgr.step()
+        frameTimes.append(time.time() - startTime)
+    frameTimes.sort()
+
+    result = {
+        "meanMs": 1000.0 * sum(frameTimes) / len(frameTimes),
+        "p95Ms":  1000.0 * frameTimes[int(0.95 * (len(frameTimes) - 1))],
+    }
+    sys.stdout.write(json.dumps(result) + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,333 @@
+"""
+A sampling profiler for finding out which Python code is responsible for slow
+frames in a live session.
+
+A background thread periodically grabs the main thread's Python stack. Each
+sample is tagged with the frame number and with the task that was running
+(meaning the outermost function on the stack that takes a "task" argument,
+which for us is the task function itself). Captures are written in two
+formats:
+  - <name>.collapsed: one "frame;frame;frame count" line per distinct stack,
+    for flamegraph.pl and friends.
+  - <name>.speedscope.json: for https://www.speedscope.app, which also shows
+    the samples in time order, grouped by frame number.
+
+A capture can be started and stopped by hand (control-p, or --profile on the
+command line). Independently of that, if a hitch threshold is set (it isn't
+by default), the sampler keeps the last few seconds of samples around, and
+whenever a frame takes longer than the threshold the samples for that frame
+are written out on their own.
+"""
+
+import atexit
+import collections
+import json
+import os
+import sys
+import threading
+import time
+
+from src.logconfig import newLogger
+from src.telemetry import addFrameStartCallback
+from src.telemetry import getFrameStartTime
+from src.telemetry import recordEvent
+
+log = newLogger(__name__)
+
+# Seconds between samples. Taking a sample means grabbing the GIL away from
+# the main thread, so this is a tradeoff between resolution and overhead.
+SAMPLE_INTERVAL = 0.002
+
+# Frames whose work (not counting the frame pacer's deliberate wait) takes
+# longer than the hitch threshold are written out as hitch captures. 0 disables
+# hitch captures. They're off unless asked for (with --hitch-ms), since they
+# keep the sampler thread running, and every sample takes the GIL away from
+# the main thread.
+DEFAULT_HITCH_THRESHOLD_MS = 0.0
+
+# When writing a hitch capture, also include this many frames before the slow
+# one, for context.
+HITCH_CONTEXT_FRAMES = 2
+
+# Don't write more than one hitch capture per this many seconds, so that a
+# run of slow frames doesn't flood the disk.
+HITCH_COOLDOWN = 5.0
+
+# How many seconds of samples to keep around for hitch captures.
+HITCH_HISTORY_SECONDS = 2.0
+
+# Stop recording a manual capture once it has this many samples, so that
+# forgetting to stop one doesn't eat all our memory.
+MAX_CAPTURE_SAMPLES = int(600.0 / SAMPLE_INTERVAL)
+
+# Where captures are written, relative to the current directory.
+PROFILE_DIR = "profiles"
+
+# Sort for the task that checks each frame for a hitch. It runs after igLoop
+# (sort 50), but before the frame pacer (sort 60) sleeps until the next frame.
+FRAME_END_SORT = 59
+
+NO_TASK_NAME = "(no task)"
+
+# One sample: the time it was taken, the frame number at the time, and the
+# stack as a tuple of code objects, outermost first.
+Sample = collections.namedtuple("Sample", ["time", "frameNumber", "stack"])
+
+app = None
+
+sampler = None
+
+# Samples of the manual capture in progress, or None if there isn't one.
+captureSamples = None
+
+hitchThreshold = 0.0
+lastHitchCaptureTime = None
+
+
+def initProfiler(app_, hitchThresholdMs=DEFAULT_HITCH_THRESHOLD_MS,
+                 startCapturing=False):
+    """
+    Set up the profiler. Must be called from the main thread, since that's the
+    thread that gets sampled.
+    """
+
+    global app
+    app = app_
+
+    global sampler, hitchThreshold
+    hitchThreshold = hitchThresholdMs / 1000.0
+    sampler = Sampler(threading.current_thread().ident, SAMPLE_INTERVAL,
+                      int(HITCH_HISTORY_SECONDS / SAMPLE_INTERVAL))
+
+    addFrameStartCallback(onFrameStart)
+    app.taskMgr.add(frameEndTask, "ProfilerFrameEnd", sort=FRAME_END_SORT)
+
+    if hitchThreshold > 0:
+        sampler.start()
+    if startCapturing:
+        startCapture()
+
+    # Don't lose a capture that's still running when the game exits.
+    atexit.register(stopCapture)
+
+
+def startCapture():
+    global captureSamples
+    if captureSamples is not None:
+        return
+    log.info("Starting profiler capture.")
+    captureSamples = []
+    sampler.listeners.append(recordCaptureSample)
+    sampler.start()
+
+def stopCapture():
+    """
+    Stop the capture in progress, if any, and write it out.
+    """
+
+    global captureSamples
+    if captureSamples is None:
+        return
+    sampler.listeners.remove(recordCaptureSample)
+    if hitchThreshold <= 0:
+        sampler.stop()
+    samples, captureSamples = captureSamples, None
+    writeCapture("profile-{}".format(time.strftime("%Y%m%d-%H%M%S")),
+                 samples)
+
+def toggleCapture():
+    if captureSamples is None:
+        startCapture()
+    else:
+        stopCapture()
+
+def recordCaptureSample(sample):
+    # Called on the sampler thread, which may not have noticed yet that the
+    # capture was stopped.
+    samples = captureSamples
+    if samples is not None and len(samples) < MAX_CAPTURE_SAMPLES:
+        samples.append(sample)
+
+
+def onFrameStart():
+    sampler.frameNumber += 1
+
+def frameEndTask(task):
+    global lastHitchCaptureTime
+
+    now = time.time()
+    frameTime = now - getFrameStartTime()
+    if hitchThreshold <= 0 or frameTime <= hitchThreshold:
+        return task.cont
+    if lastHitchCaptureTime is not None and \
+            now - lastHitchCaptureTime < HITCH_COOLDOWN:
+        return task.cont
+    lastHitchCaptureTime = now
+
+    frameNumber = sampler.frameNumber
+    samples = [sample for sample in list(sampler.recentSamples)
+               if sample.frameNumber >= frameNumber - HITCH_CONTEXT_FRAMES]
+    recordEvent("profiler.hitch", frame=frameNumber,
+                ms=round(1000.0 * frameTime, 1), samples=len(samples))
+    writeCapture("hitch-{}-frame{}".format(time.strftime("%Y%m%d-%H%M%S"),
+                                           frameNumber),
+                 samples)
+    return task.cont
+
+
+def writeCapture(name, samples):
+    if not samples:
+        log.info("Profiler capture %s has no samples; not writing it.", name)
+        return
+
+    if not os.path.isdir(PROFILE_DIR):
+        os.makedirs(PROFILE_DIR)
+    basePath = os.path.join(PROFILE_DIR, name)
+    with open(basePath + ".collapsed", "w") as collapsedFile:
+        collapsedFile.write(formatCollapsed(samples))
+    with open(basePath + ".speedscope.json", "w") as speedscopeFile:
+        json.dump(makeSpeedscope(name, samples), speedscopeFile)
+    log.info("Wrote %d profiler samples to %s.*", len(samples), basePath)
+
+
+def getTaskName(stack):
+    """
+    Return the name of the task function in stack (a tuple of code objects,
+    outermost first), or NO_TASK_NAME if there isn't one.
+    """
+
+    for code in stack:
+        if "task" in code.co_varnames[:code.co_argcount]:
+            return code.co_name
+    return NO_TASK_NAME
+
+def getFrameLabel(code):
+    return "{} ({}:{})".format(code.co_name,
+                               os.path.basename(code.co_filename),
+                               code.co_firstlineno)
+
+
+def formatCollapsed(samples):
+    """
+    Return the samples in the "collapsed stack" format used by flamegraph.pl:
+    one line per distinct stack, with the frames separated by semicolons and
+    followed by the number of samples. Each stack starts with the task it was
+    sampled in.
+    """
+
+    counts = collections.Counter()
+    for sample in samples:
+        labels = ["task " + getTaskName(sample.stack)]
+        labels.extend(getFrameLabel(code) for code in sample.stack)
+        counts[";".join(labels)] += 1
+    return "".join("{} {}\n".format(stack, count)
+                   for stack, count in sorted(counts.items()))
+
+
+def makeSpeedscope(name, samples):
+    """
+    Return the samples as a speedscope "sampled" profile (as a JSON-compatible
+    dict). Each stack starts with the frame number and then the task it was
+    sampled in, so the time-ordered view groups samples by frame.
+    """
+
+    frames = []
+    frameIndices = {}
+    def getFrameIndex(key, frameDict):
+        if key not in frameIndices:
+            frameIndices[key] = len(frames)
+            frames.append(frameDict)
+        return frameIndices[key]
+
+    stacks  = []
+    weights = []
+    for i, sample in enumerate(samples):
+        frameLabel = "frame {}".format(sample.frameNumber)
+        taskLabel  = "task " + getTaskName(sample.stack)
+        stack = [getFrameIndex(frameLabel, {"name": frameLabel}),
+                 getFrameIndex(taskLabel,  {"name": taskLabel})]
+        for code in sample.stack:
+            stack.append(getFrameIndex(code, {
+                "name": code.co_name,
+                "file": code.co_filename,
+                "line": code.co_firstlineno,
+            }))
+        stacks.append(stack)
+        # Weight each sample by how long it was until the next one.
+        if i + 1 < len(samples):
+            weights.append(1000.0 * (samples[i + 1].time - sample.time))
+        else:
+            weights.append(1000.0 * SAMPLE_INTERVAL)
+
+    return {
+        "$schema": "https://www.speedscope.app/file-format-schema.json",
+        "name": name,
+        "exporter": "smush profiler",
+        "shared": {"frames": frames},
+        "profiles": [{
+            "type": "sampled",
+            "name": name,
+            "unit": "milliseconds",
+            "startValue": 0,
+            "endValue": sum(weights),
+            "samples": stacks,
+            "weights": weights,
+        }],
+    }
+
+
+class Sampler(object):
+    """
+    Samples the Python stack of one thread, from a background thread.
+    """
+
+    def __init__(self, threadId, interval, historyLength):
+        super(Sampler, self).__init__()
+
+        self.threadId = threadId
+        self.interval = interval
+        # The most recent samples, oldest first.
+        self.recentSamples = collections.deque(maxlen=historyLength)
+        # Functions to call (on the sampler thread) with each new sample.
+        self.listeners = []
+        # Set by whoever owns the sampled thread; copied into every sample.
+        self.frameNumber = 0
+
+        self.thread = None
+        self.stopEvent = threading.Event()
+
+    def start(self):
+        if self.thread is not None:
+            return
+        self.stopEvent.clear()
+        self.thread = threading.Thread(target=self.run, name="Profiler")
+        # Don't keep the process alive just for the profiler.
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        if self.thread is None:
+            return
+        self.stopEvent.set()
+        self.thread.join()
+        self.thread = None
+
+    def run(self):
+        while not self.stopEvent.wait(self.interval):
+            self.takeSample()
+
+    def takeSample(self):
+        # pylint: disable=protected-access
+        frame = sys._current_frames().get(self.threadId)
+        if frame is None:
+            return
+        stack = []
+        while frame is not None:
+            stack.append(frame.f_code)
+            frame = frame.f_back
+        stack.reverse()
+
+        sample = Sample(time.time(), self.frameNumber, tuple(stack))
+        self.recentSamples.append(sample)
+        for listener in list(self.listeners):
+            listener(sample)
@@ -0,0 +1,175 @@
+"""
+Scale graphics quality up and down to keep frame times on target.
+
+Quality is a ladder of discrete tiers, from the full-quality settings at the
+top down to no shadows and no per-pixel lighting at the bottom. The
+QualityGovernor watches how long each frame's work takes (not counting the
+frame pacer's deliberate wait, or garbage collection in leftover time). When
+the 95th percentile over a window of frames is over the target, it steps down
+a tier; when there's been plenty of headroom for a while, it steps back up.
+The governor itself is just arithmetic on frame times, so it can be tested
+against synthetic traces.
+"""
+
+import collections
+import time
+
+from src.logconfig import newLogger
+from src.telemetry import getFrameStartTime
+from src.telemetry import recordEvent
+from src.telemetry import setGauge
+
+log = newLogger(__name__)
+
+# One rung of the quality ladder.
+#   - shadowSize: resolution of each face of the shadow cube map, or 0 for no
+#     shadows at all.
+#   - shadowUpdateInterval: when casters are moving, re-render the shadow map
+#     at most every this many frames (see shadows.py).
+#   - perPixelLighting: use the generated shaders (which do per-pixel lighting
+#     and shadows) rather than fixed-function, per-vertex lighting.
+#   - lodScale: multiplier for LOD switch distances; lower switches to the
+#     less detailed models sooner.
+QualityTier = collections.namedtuple(
+    "QualityTier",
+    ["name", "shadowSize", "shadowUpdateInterval", "perPixelLighting",
+     "lodScale"])
+
+# Best first.
+TIERS = [
+    QualityTier("high",    512, 1, True,  1.0),
+    QualityTier("medium",  256, 2, True,  0.75),
+    QualityTier("low",     128, 4, True,  0.5),
+    QualityTier("minimal",   0, 0, False, 0.25),
+]
+
+# Number of frames the p95 is computed over. The window is cleared after
+# every tier change, so that the new tier is judged on its own frames.
+WINDOW_FRAMES = 120
+
+# Step down when the p95 is more than this fraction over the target, and only
+# consider stepping up when it's under this fraction of the target. The gap
+# between the two is the hysteresis that keeps us from flip-flopping between
+# two tiers.
+STEP_DOWN_FRACTION = 1.05
+STEP_UP_FRACTION   = 0.6
+
+# Minimum frames between stepping down and then trying to step back up. Every
+# time a step up is followed by stepping right back down, this doubles, up to
+# MAX_UP_COOLDOWN_FRAMES.
+UP_COOLDOWN_FRAMES     = 600
+MAX_UP_COOLDOWN_FRAMES = 9600
+
+# A step down this soon after a step up counts as the step up having failed.
+FAILED_UP_FRAMES = 2 * WINDOW_FRAMES
+
+# Sort for the task that times each frame's work, from the frame start that
+# telemetry records. It runs after igLoop (sort 50), which renders, but before
+# the garbage collector (sort 55) and frame pacer (sort 60) use up the leftover
+# time.
+FRAME_END_SORT = 54
+
+app = None
+governor = None
+
+
+def initQuality(app_, targetFrameRate):
+    global app, governor
+    app = app_
+
+    governor = QualityGovernor(1.0 / targetFrameRate)
+    applyTier(TIERS[governor.tier])
+
+    app.taskMgr.add(qualityFrameEndTask, "QualityFrameEnd",
+                    sort=FRAME_END_SORT)
+
+
+def qualityFrameEndTask(task):
+    oldTier = governor.tier
+    newTier = governor.addFrameTime(time.time() - getFrameStartTime())
+    if newTier is not None:
+        p95Ms = 1000.0 * governor.lastP95
+        log.info("Graphics quality %s -> %s (p95 frame work %.1f ms).",
+                 TIERS[oldTier].name, TIERS[newTier].name, p95Ms)
+        recordEvent("quality.tierChange", fromTier=TIERS[oldTier].name,
+                    toTier=TIERS[newTier].name, p95Ms=round(p95Ms, 2))
+        applyTier(TIERS[newTier])
+    setGauge("quality.tier", TIERS[governor.tier].name)
+    if governor.lastP95 is not None:
+        setGauge("quality.p95 frame work ms",
+                 round(1000.0 * governor.lastP95, 2))
+    return task.cont
+
+
+def applyTier(tier):
+    # Imported here so that the governor can be used (and tested) without
+    # Panda3D.
+    from src.shadows import setShadowQuality
+
+    setShadowQuality(tier.shadowSize, tier.shadowUpdateInterval)
+
+    if tier.perPixelLighting:
+        app.render.setShaderAuto()
+    else:
+        app.render.setShaderOff()
+
+    # Camera.setLodScale only exists in newer versions of Panda3D.
+    if hasattr(app.camNode, "setLodScale"):
+        app.camNode.setLodScale(tier.lodScale)
+
+
+class QualityGovernor(object):
+    def __init__(self, targetFrameTime, numTiers=len(TIERS), startTier=0):
+        super(QualityGovernor, self).__init__()
+
+        self.targetFrameTime = targetFrameTime
+        self.numTiers = numTiers
+        # Index into the tiers; 0 is the best.
+        self.tier = startTier
+
+        self.window = collections.deque(maxlen=WINDOW_FRAMES)
+        self.lastP95 = None
+        self.frameCount = 0
+        self.lastChangeFrame = 0
+        self.lastStepWasUp = False
+        self.upCooldown = UP_COOLDOWN_FRAMES
+
+    def addFrameTime(self, frameTime):
+        """
+        Record how long a frame took. Return the new tier index if this
+        changes the tier, else None.
+        """
+
+        self.frameCount += 1
+        self.window.append(frameTime)
+        if len(self.window) < WINDOW_FRAMES:
+            return None
+
+        times = sorted(self.window)
+        self.lastP95 = times[int(0.95 * (len(times) - 1))]
+        framesSinceChange = self.frameCount - self.lastChangeFrame
+
+        if self.lastP95 > STEP_DOWN_FRACTION * self.targetFrameTime and \
+                self.tier < self.numTiers - 1:
+            if self.lastStepWasUp and framesSinceChange < FAILED_UP_FRAMES:
+                # That tier was too much after all; wait longer before trying
+                # it again.
+                self.upCooldown = min(2 * self.upCooldown,
+                                      MAX_UP_COOLDOWN_FRAMES)
+            return self.changeTier(self.tier + 1)
+
+        if self.lastP95 < STEP_UP_FRACTION * self.targetFrameTime and \
+                self.tier > 0 and framesSinceChange >= self.upCooldown:
+            return self.changeTier(self.tier - 1)
+
+        if self.lastStepWasUp and framesSinceChange >= FAILED_UP_FRAMES:
+            # The last step up has stuck, so forget about past failures.
+            self.upCooldown = UP_COOLDOWN_FRAMES
+        return None
+
+    def changeTier(self, newTier):
+        self.lastStepWasUp = newTier < self.tier
+        self.tier = newTier
+        self.lastChangeFrame = self.frameCount
+        self.window.clear()
+        return newTier
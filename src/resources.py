@@ -0,0 +1,127 @@
+import os
+import resource
+
+from src.logconfig import newLogger
+
+log = newLogger(__name__)
+
+# The kinds of resources we keep count of. These are the Panda3D/Bullet objects
+# that we create at runtime and that are expensive to leak: they either pin
+# memory in the scene graph or cost time every physics step.
+KIND_NODEPATH      = "NodePath"
+KIND_GHOST         = "Ghost"
+KIND_RIGID_BODY    = "RigidBody"
+KIND_SHAPE         = "Shape"
+KIND_TEXTURE       = "Texture"
+KIND_TEXTURE_STAGE = "TextureStage"
+
+ALL_KINDS = (
+    KIND_NODEPATH,
+    KIND_GHOST,
+    KIND_RIGID_BODY,
+    KIND_SHAPE,
+    KIND_TEXTURE,
+    KIND_TEXTURE_STAGE,
+)
+
+# Maps (kind, creator) -> number of live resources of that kind which were
+# created by that creator. The creator is just a string naming the code that
+# made the resource (such as "world.makeBullet").
+#
+# Note that we deliberately track counts rather than the objects themselves:
+# the Python wrappers for Panda3D objects are created on the fly, so two
+# wrappers for the same underlying object don't necessarily have the same id(),
+# and holding on to them would keep the objects alive anyway.
+liveCounts = {}
+
+# Same keys as liveCounts, but never decremented. Useful for telling a creator
+# that makes a lot of short-lived resources apart from one that makes a few
+# long-lived ones.
+totalCreated = {}
+
+
+def noteCreated(kind, creator, count=1):
+    assert kind in ALL_KINDS
+    key = (kind, creator)
+    liveCounts[key]   = liveCounts.get(key, 0)   + count
+    totalCreated[key] = totalCreated.get(key, 0) + count
+
+def noteDestroyed(kind, creator, count=1):
+    assert kind in ALL_KINDS
+    key = (kind, creator)
+    newCount = liveCounts.get(key, 0) - count
+    if newCount < 0:
+        # Someone released more than they created. That's a bookkeeping bug
+        # rather than a leak, but it would hide real leaks from the same
+        # creator, so complain loudly.
+        log.warning("Released more %s than were created by %s.",
+                    kind, creator)
+        newCount = 0
+    liveCounts[key] = newCount
+
+def noteBodyCreated(creator, numShapes=1):
+    """
+    Shorthand for the common case of creating a NodePath wrapping a rigid body
+    with some shapes attached.
+    """
+
+    noteCreated(KIND_NODEPATH,   creator)
+    noteCreated(KIND_RIGID_BODY, creator)
+    noteCreated(KIND_SHAPE,      creator, numShapes)
+
+def noteBodyDestroyed(creator, numShapes=1):
+    noteDestroyed(KIND_NODEPATH,   creator)
+    noteDestroyed(KIND_RIGID_BODY, creator)
+    noteDestroyed(KIND_SHAPE,      creator, numShapes)
+
+
+def getLiveCount(kind, creator=None):
+    """
+    Return the number of live resources of the given kind, either for a single
+    creator or (if creator is None) summed across all creators.
+    """
+
+    if creator is not None:
+        return liveCounts.get((kind, creator), 0)
+    return sum(count for (countKind, _), count in liveCounts.items()
+               if countKind == kind)
+
+def getLiveCounts():
+    """
+    Return a dict mapping each kind to the total number of live resources of
+    that kind.
+    """
+
+    return dict((kind, getLiveCount(kind)) for kind in ALL_KINDS)
+
+def getLiveCountsByCreator():
+    """
+    Return a copy of the (kind, creator) -> count dict, omitting zero entries.
+    """
+
+    return dict((key, count) for key, count in liveCounts.items() if count)
+
+
+def getRssBytes():
+    """
+    Return the resident set size of this process in bytes.
+
+    On Linux we read the current RSS out of /proc. Elsewhere we fall back to
+    the peak RSS reported by getrusage, which is good enough for noticing
+    growth but will never go back down.
+    """
+
+    try:
+        with open("/proc/self/statm") as statm:
+            residentPages = int(statm.read().split()[1])
+        return residentPages * os.sysconf("SC_PAGE_SIZE")
+    except (IOError, OSError, ValueError, IndexError):
+        # ru_maxrss is in kilobytes on Linux but bytes on macOS. We only get
+        # here off of Linux, so assume bytes.
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def logResourceCounts():
+    for (kind, creator), count in sorted(getLiveCountsByCreator().items()):
+        log.info("    %-12s %-28s %6d", kind, creator, count)
+    log.info("    RSS: %.1f MiB", getRssBytes() / (1024.0 * 1024.0))
@@ -0,0 +1,41 @@
+"""
+The decision of which frames to re-render the shadow map on, kept apart from
+shadows.py so that it can be used (and tested) without Panda3D.
+"""
+
+
+class ShadowScheduler(object):
+    """
+    Decides which frames to render the shadow map on, given when the static
+    scenery changed and when the dynamic casters moved.
+    """
+
+    def __init__(self, updateInterval=1):
+        super(ShadowScheduler, self).__init__()
+
+        self.updateInterval = updateInterval
+        # Start out dirty, since there's no shadow map yet.
+        self.staticDirty  = True
+        self.dynamicDirty = False
+        self.framesSinceRender = 0
+
+    def markStaticDirty(self):
+        self.staticDirty = True
+
+    def markDynamicDirty(self):
+        self.dynamicDirty = True
+
+    def startFrame(self):
+        """
+        Return whether to render the shadow map this frame.
+        """
+
+        self.framesSinceRender += 1
+        render = self.staticDirty or (
+            self.dynamicDirty and
+            self.framesSinceRender >= self.updateInterval)
+        if render:
+            self.staticDirty  = False
+            self.dynamicDirty = False
+            self.framesSinceRender = 0
+        return render
@@ -0,0 +1,189 @@
+"""
+Only re-render the shadow map when something that casts a shadow has changed.
+
+Rendering a point light's shadow map means rendering every caster into all
+six faces of a cube map, which is the most expensive thing in our frame. But
+most casters are static scenery that never moves, so most frames would render
+exactly the same shadow map as the frame before. Instead, the offscreen buffer
+that Panda3D renders the shadow map into is left switched off, and switched on
+for a frame only when:
+  - the static scenery changed (the streaming module attached or detached a
+    chunk), which re-renders on the very next frame; or
+  - a dynamic caster has moved (or been removed) since the last render, which
+    re-renders at most once every updateInterval frames.
+So when nothing is moving, there is no shadow pass at all, and otherwise its
+frequency is set by the dynamic casters alone.
+
+Note that it's the buffer that has to be switched off, not the light's camera:
+the buffer's display regions clear the depth of every face each time the
+buffer is drawn, whether or not their camera is active, so switching off just
+the camera would leave an empty shadow map. An inactive buffer isn't drawn at
+all, so its texture keeps the last map rendered into it.
+
+Panda3D's generated shaders only support one shadow map per light, so static
+and dynamic casters still share a single map, and re-rendering it redraws
+both. Casters too small to show up in the shadow map at all (like bullets) are
+hidden from the shadow camera entirely, rather than causing re-renders that
+can't change anything.
+"""
+
+from panda3d.core import BitMask32
+from panda3d.core import Mat4
+
+from src import streaming
+from src.logconfig import newLogger
+from src.physics import REMOVED_TAG
+from src.shadow_scheduler import ShadowScheduler
+from src.telemetry import incrementCounter
+
+log = newLogger(__name__)
+
+# Camera mask bit for the shadow camera. Nodes hidden with this mask still show
+# up for the main camera, but don't cast shadows.
+SHADOW_CAMERA_MASK = BitMask32.bit(1)
+
+# Dynamic casters smaller than this (in meters) are hidden from the shadow
+# camera. With the light 30 m up, each texel of a 512 x 512 cube map face
+# covers about 0.1 m of floor, so anything smaller would barely show anyway.
+MIN_CASTER_SIZE = 0.1
+
+# A dynamic caster that has moved by less than this (comparing each entry of
+# its transform matrix) since the last shadow render doesn't count as moved.
+MOVE_THRESHOLD = 1e-3
+
+# Sort for the task that decides whether to render the shadow map this frame.
+# This is after the physics task (sort 0) has moved things, and before igLoop
+# (sort 50) renders.
+SHADOW_TASK_SORT = 45
+
+app = None
+scheduler = None
+
+shadowLightNP = None
+
+# The buffer the shadow map is rendered into, or None if we haven't found it
+# yet. Panda3D makes it the first time something lit by the light is drawn,
+# and makes a new one when the shadow map's size changes.
+shadowBuffer = None
+
+# Shadow map resolution, or 0 if shadows are off.
+shadowSize = 0
+
+# List of (NodePath, Mat4) for each dynamic caster, where the Mat4 is its
+# transform (relative to render) as of the last shadow render.
+dynamicCasters = []
+
+
+def initShadows(app_):
+    global app, scheduler
+    app = app_
+    scheduler = ShadowScheduler()
+
+    streaming.sceneryChangedCallbacks.append(scheduler.markStaticDirty)
+    app.taskMgr.add(updateShadowsTask, "UpdateShadows", sort=SHADOW_TASK_SORT)
+
+    # The main camera sees everything, including the nodes hidden from the
+    # shadow camera. If we're running headless, there is no main camera.
+    if app.camNode is not None:
+        app.camNode.setCameraMask(app.camNode.getCameraMask() &
+                                  ~SHADOW_CAMERA_MASK)
+
+
+def setShadowLight(lightNP, size):
+    """
+    Make the light at lightNP cast shadows, using a shadow cube map of the
+    given resolution, rendered only when needed.
+    """
+
+    global shadowLightNP
+    shadowLightNP = lightNP
+    shadowLightNP.node().setCameraMask(SHADOW_CAMERA_MASK)
+    setShadowQuality(size, scheduler.updateInterval)
+
+def setShadowQuality(size, updateInterval):
+    """
+    Change the shadow map resolution (0 for no shadows at all), and how many
+    frames to wait between re-renders for moving casters.
+    """
+
+    global shadowSize, shadowBuffer
+    scheduler.updateInterval = updateInterval
+    if size == shadowSize:
+        return
+    shadowSize = size
+
+    # Either way, the old buffer is gone.
+    shadowBuffer = None
+    light = shadowLightNP.node()
+    if size > 0:
+        light.setShadowCaster(True, size, size)
+    else:
+        light.setShadowCaster(False)
+
+
+def addDynamicCaster(casterNP, size):
+    """
+    Register casterNP, which is about size meters across, as a shadow caster
+    that can move. Static scenery doesn't need registering.
+    """
+
+    if size < MIN_CASTER_SIZE:
+        casterNP.hide(SHADOW_CAMERA_MASK)
+        return
+    dynamicCasters.append((casterNP, Mat4(casterNP.getMat(app.render))))
+    scheduler.markDynamicDirty()
+
+
+def updateShadowsTask(task):
+    global shadowBuffer
+
+    if shadowLightNP is None or shadowSize <= 0:
+        return task.cont
+
+    if shadowBuffer is None:
+        shadowBuffer = findShadowBuffer()
+        if shadowBuffer is None:
+            # Not made yet. When it is, it starts out active, so the first
+            # shadow map gets rendered regardless.
+            return task.cont
+        # We may not have let it render anything yet.
+        scheduler.markStaticDirty()
+
+    if not scheduler.dynamicDirty and haveDynamicCastersChanged():
+        scheduler.markDynamicDirty()
+    render = scheduler.startFrame()
+    shadowBuffer.setActive(render)
+    if render:
+        incrementCounter("shadows.renders")
+        rememberDynamicCasters()
+    return task.cont
+
+def findShadowBuffer():
+    """
+    Return the buffer that shadowLightNP's shadow map is rendered into, or None
+    if there isn't one. It's the one whose display regions (one per cube map
+    face) render from the light.
+    """
+
+    engine = app.graphicsEngine
+    for i in range(engine.getNumWindows()):
+        output = engine.getWindow(i)
+        for j in range(output.getNumDisplayRegions()):
+            if output.getDisplayRegion(j).getCamera() == shadowLightNP:
+                return output
+    return None
+
+def haveDynamicCastersChanged():
+    for casterNP, mat in dynamicCasters:
+        if casterNP.isEmpty() or casterNP.hasTag(REMOVED_TAG) or \
+                not casterNP.getMat(app.render).almostEqual(mat,
+                                                            MOVE_THRESHOLD):
+            return True
+    return False
+
+def rememberDynamicCasters():
+    global dynamicCasters
+    dynamicCasters = [(casterNP, Mat4(casterNP.getMat(app.render)))
+                      for casterNP, _ in dynamicCasters
+                      if not (casterNP.isEmpty() or
+                              casterNP.hasTag(REMOVED_TAG))]
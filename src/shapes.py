@@ -0,0 +1,241 @@
+"""
+Pick cheap collision shapes for geometry.
+
+Bullet's narrowphase cost depends heavily on the shape type: spheres, capsules
+and boxes are cheapest, convex hulls cost more, and triangle meshes cost the
+most. So rather than giving everything a triangle mesh, we look at the actual
+geometry and use the cheapest primitive that fits it exactly (it contains
+every vertex, and its volume is no more than a little bigger than that of the
+mesh), falling back to convex hulls, which are conservative (they never miss
+a collision, though they can report one slightly early for concave models).
+
+Everything here returns a list of (shape, TransformState) pairs, to be added
+to a rigid body with node.addShape(shape, transform). A body with several
+shapes is Bullet's compound shape. Shapes can be shared between bodies, so
+results are cached.
+"""
+
+import numpy as np
+
+from panda3d.bullet import BulletBoxShape
+from panda3d.bullet import BulletCapsuleShape
+from panda3d.bullet import BulletConvexHullShape
+from panda3d.bullet import BulletSphereShape
+from panda3d.bullet import XUp
+from panda3d.bullet import YUp
+from panda3d.bullet import ZUp
+from panda3d.core import GeomVertexReader
+from panda3d.core import Point3
+from panda3d.core import TransformState
+from panda3d.core import Vec3
+
+from src.logconfig import newLogger
+
+log = newLogger(__name__)
+
+# Panels are flat, but we give their collision boxes this much thickness
+# behind the visible (+z) face, so the surface stays exactly where it was.
+PANEL_THICKNESS = 0.1
+
+# Geometry flatter than this in some direction is given this thickness, so
+# that it still has some volume to collide with.
+MIN_THICKNESS = 0.01
+
+# A primitive which contains every vertex counts as an exact fit if its volume
+# is at most this fraction bigger than the mesh's. This leaves room for the
+# mesh being a polygonal approximation of a curved surface.
+VOLUME_TOLERANCE = 0.1
+
+SHAPE_SPHERE  = "sphere"
+SHAPE_CAPSULE = "capsule"
+SHAPE_BOX     = "box"
+
+# Capsule axis (as an index into x, y, z) -> Bullet's up axis constant.
+CAPSULE_UP_AXES = [XUp, YUp, ZUp]
+
+panelShapeCache = {}
+modelShapeCache = {}
+
+
+def getPanelShapes(width, height):
+    """
+    Return the shapes for a (width x height) panel with its bottom-left corner
+    at the origin, lying in the x,y-plane and facing +z.
+    """
+
+    key = (width, height)
+    if key not in panelShapeCache:
+        shape = BulletBoxShape(Vec3(0.5 * width, 0.5 * height,
+                                    0.5 * PANEL_THICKNESS))
+        transform = TransformState.makePos(
+            Point3(0.5 * width, 0.5 * height, -0.5 * PANEL_THICKNESS))
+        panelShapeCache[key] = [(shape, transform)]
+    return panelShapeCache[key]
+
+
+def getModelShapes(modelName, modelNP):
+    """
+    Return shapes fitted to the model at modelNP, which was loaded from
+    modelName. Only the first model loaded under a given name is actually
+    examined; later calls return the same shapes.
+    """
+
+    if modelName not in modelShapeCache:
+        shapes = fitModelShapes(modelNP)
+        log.debug("Fitted %s with %s.", modelName,
+                  ", ".join(shape.getClassType().getName()
+                            for shape, _ in shapes))
+        modelShapeCache[modelName] = shapes
+    return modelShapeCache[modelName]
+
+
+def fitModelShapes(modelNP):
+    """
+    Fit shapes to the geometry under modelNP, in modelNP's coordinate system.
+
+    If a single primitive fits the whole model, use that. Otherwise, if the
+    model is made of several parts, fit each part separately (a primitive if
+    one fits, else a convex hull) and combine them. Otherwise use a single
+    convex hull.
+    """
+
+    # Note that adding up the parts' volumes assumes they don't overlap.
+    parts = getMeshes(modelNP)
+    if not parts:
+        log.warning("Model %s has no geometry to fit a shape to.", modelNP)
+        return []
+
+    allPoints = np.concatenate([points for points, _ in parts])
+    fit = fitPrimitive(allPoints, sum(volume for _, volume in parts))
+    if fit is not None:
+        return [makePrimitiveShape(fit)]
+
+    if len(parts) == 1:
+        return [makeHullShape(allPoints)]
+
+    shapes = []
+    for points, volume in parts:
+        fit = fitPrimitive(points, volume)
+        if fit is not None:
+            shapes.append(makePrimitiveShape(fit))
+        else:
+            shapes.append(makeHullShape(points))
+    return shapes
+
+
+def getMeshes(modelNP):
+    """
+    Return a list of (points, volume) for each Geom under modelNP, where points
+    is an (N, 3) array of its vertices in modelNP's coordinate system and
+    volume is the volume it encloses.
+    """
+
+    parts = []
+    for geomNP in modelNP.findAllMatches("**/+GeomNode"):
+        mat = geomNP.getMat(modelNP)
+        geomNode = geomNP.node()
+        for i in range(geomNode.getNumGeoms()):
+            geom = geomNode.getGeom(i)
+            reader = GeomVertexReader(geom.getVertexData(), "vertex")
+            points = []
+            while not reader.isAtEnd():
+                point = mat.xformPoint(Point3(reader.getData3f()))
+                points.append((point.getX(), point.getY(), point.getZ()))
+            if not points:
+                continue
+
+            triangles = []
+            for j in range(geom.getNumPrimitives()):
+                primitive = geom.getPrimitive(j).decompose()
+                for k in range(primitive.getNumPrimitives()):
+                    start = primitive.getPrimitiveStart(k)
+                    if primitive.getPrimitiveEnd(k) - start == 3:
+                        triangles.append([primitive.getVertex(start + n)
+                                          for n in range(3)])
+            points = np.array(points)
+            parts.append((points, getMeshVolume(points, np.array(triangles))))
+    return parts
+
+
+def getMeshVolume(points, triangles):
+    """
+    Return the volume enclosed by a triangle mesh, given its (N, 3) vertices
+    and (M, 3) vertex indices. The result is only meaningful if the mesh is
+    closed; open meshes (like a single flat panel) come out with little or no
+    volume, so no primitive will count as fitting them.
+    """
+
+    if len(triangles) == 0:
+        return 0.0
+    # Sum the signed volumes of the tetrahedra formed by each triangle and
+    # the origin.
+    a, b, c = (points[triangles[:, n]] for n in range(3))
+    return abs(np.einsum("ij,ij->i", a, np.cross(b, c)).sum()) / 6.0
+
+
+def fitPrimitive(points, meshVolume):
+    """
+    Find the cheapest primitive that exactly fits a mesh with the given (N, 3)
+    array of vertices and enclosed volume. Return a tuple (kind, center,
+    params, volume), or None if no primitive fits. For spheres params is the
+    radius; for boxes it's the half-extents along x, y and z; for capsules
+    it's (radius, halfHeight, axis), where halfHeight is half the length of
+    the cylindrical part.
+
+    Each candidate primitive is made just big enough to contain every vertex,
+    and therefore the whole mesh. So if its volume is close to the mesh's,
+    there can't be much empty space between them.
+    """
+
+    low  = points.min(axis=0)
+    high = points.max(axis=0)
+    center = 0.5 * (low + high)
+    halfExtents = np.maximum(0.5 * (high - low), 0.5 * MIN_THICKNESS)
+    offsets = points - center
+
+    # The bounding box.
+    fits = [(SHAPE_BOX, center, halfExtents, 8.0 * np.prod(halfExtents))]
+
+    # Sphere around the center of the bounding box.
+    radius = np.linalg.norm(offsets, axis=1).max()
+    fits.append((SHAPE_SPHERE, center, radius,
+                 4.0 / 3.0 * np.pi * radius ** 3))
+
+    # Capsule along the longest axis of the bounding box.
+    axis = int(np.argmax(halfExtents))
+    along = np.abs(offsets[:, axis])
+    across = np.linalg.norm(np.delete(offsets, axis, axis=1), axis=1)
+    radius = max(across.max(), 0.5 * MIN_THICKNESS)
+    # The cylinder has to be long enough that the points beyond its ends fit
+    # in the hemispherical caps.
+    halfHeight = max(0.0, (along - np.sqrt(radius ** 2 - across ** 2)).max())
+    if halfHeight > 0:
+        fits.append((SHAPE_CAPSULE, center, (radius, halfHeight, axis),
+                     np.pi * radius ** 2 * (2.0 * halfHeight +
+                                            4.0 / 3.0 * radius)))
+
+    bestFit = min(fits, key=lambda fit: fit[3])
+    if bestFit[3] > (1.0 + VOLUME_TOLERANCE) * meshVolume:
+        return None
+    return bestFit
+
+
+def makePrimitiveShape(fit):
+    kind, center, params, _ = fit
+    if kind == SHAPE_BOX:
+        shape = BulletBoxShape(Vec3(*params))
+    elif kind == SHAPE_SPHERE:
+        shape = BulletSphereShape(params)
+    else:
+        radius, halfHeight, axis = params
+        shape = BulletCapsuleShape(radius, 2.0 * halfHeight,
+                                   CAPSULE_UP_AXES[axis])
+    return shape, TransformState.makePos(Point3(*center))
+
+
+def makeHullShape(points):
+    shape = BulletConvexHullShape()
+    # Models usually repeat each vertex once per face that uses it.
+    for x, y, z in np.unique(points, axis=0):
+        shape.addPoint(Point3(x, y, z))
+    return shape, TransformState.makeIdentity()
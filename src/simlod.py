@@ -0,0 +1,260 @@
+import numpy as np
+
+from panda3d.core import TransformState
+from panda3d.core import Vec3
+
+from src import graphics
+from src import physics
+from src.logconfig import newLogger
+from src.physics import COLLIDE_MASK_ENTITY
+from src.physics import COLLIDE_MASK_GROUND_PLANE
+from src.physics import COLLIDE_MASK_SCENERY
+from src.physics import REMOVED_TAG
+from src.physics import TICK_DT
+from src.world_config import GRAVITY_ACCEL
+
+log = newLogger(__name__)
+
+# Simulation level-of-detail tiers, from most to least expensive.
+#   - FULL: simulated by Bullet every tick, with CCD if the body wants it.
+#   - COARSE: taken out of Bullet's hands (made kinematic, no CCD) and moved
+#     ballistically by us every COARSE_TICK_DIVISOR ticks, using a single
+#     sweep test to stop it when it hits something.
+#   - FROZEN: kinematic and not moved at all.
+# In both of the reduced tiers we remember the body's velocity, so that when
+# it's promoted back to FULL it carries on as if nothing happened.
+TIER_FULL   = 0
+TIER_COARSE = 1
+TIER_FROZEN = 2
+
+ALL_TIERS  = (TIER_FULL, TIER_COARSE, TIER_FROZEN)
+TIER_NAMES = {TIER_FULL: "full", TIER_COARSE: "coarse", TIER_FROZEN: "frozen"}
+
+# Bodies farther than this from every point of interest are demoted to
+# COARSE, and farther than FROZEN_DISTANCE to FROZEN. They're only promoted
+# again once they're HYSTERESIS closer than that, so that bodies hovering
+# around a boundary don't flip back and forth every update.
+COARSE_DISTANCE = 20.0
+FROZEN_DISTANCE = 40.0
+HYSTERESIS      = 2.0
+
+# How often (in ticks) to re-evaluate every body's tier.
+LOD_UPDATE_INTERVAL = 10
+
+# COARSE bodies are moved once every this many ticks.
+COARSE_TICK_DIVISOR = 6
+
+# What a COARSE body's sweep can hit. Like bullets, but ignoring other
+# entities and bullets, which are moving and likely far away anyway.
+COARSE_SWEEP_MASK = (COLLIDE_MASK_GROUND_PLANE | COLLIDE_MASK_SCENERY |
+                     COLLIDE_MASK_ENTITY)
+
+app = None
+
+# All bodies managed by this module.
+managedBodies = []
+# The same ManagedBody objects, keyed by NodePath.getKey().
+managedBodiesByKey = {}
+
+# NodePaths of things that make nearby bodies relevant (the player, bots).
+interestNodes = []
+# Extra regions that are relevant even with nobody in them, as a list of
+# (Point3 center, radius).
+interestRegions = []
+
+# Number of tier changes so far, by (fromTier, toTier).
+transitionCounts = {}
+
+
+def initSimLod(app_):
+    global app
+    app = app_
+
+    addInterestNode(graphics.playerNP)
+    physics.addPostTickCallback(updateSimLod)
+
+
+def addInterestNode(nodePath):
+    interestNodes.append(nodePath)
+
+def addInterestRegion(center, radius):
+    interestRegions.append((center, radius))
+
+
+def manageBody(bodyNP):
+    """
+    Let this module move the dynamic rigid body at bodyNP between tiers. The
+    body is forgotten automatically once it's removed via physics.removeBody.
+    """
+
+    body = ManagedBody(bodyNP)
+    managedBodies.append(body)
+    managedBodiesByKey[bodyNP.getKey()] = body
+
+
+def getEffectiveVelocity(bodyNP):
+    """
+    Return (linearVel, angularVel) for a body, whether or not it's currently
+    in a reduced tier. (In the reduced tiers, Bullet thinks it's not moving.)
+    """
+
+    body = managedBodiesByKey.get(bodyNP.getKey())
+    if body is not None and body.tier != TIER_FULL:
+        return Vec3(body.linearVel), Vec3(body.angularVel)
+    node = bodyNP.node()
+    return node.getLinearVelocity(), node.getAngularVelocity()
+
+def setEffectiveVelocity(bodyNP, linearVel, angularVel):
+    body = managedBodiesByKey.get(bodyNP.getKey())
+    if body is not None and body.tier != TIER_FULL:
+        body.linearVel  = Vec3(linearVel)
+        body.angularVel = Vec3(angularVel)
+    else:
+        node = bodyNP.node()
+        node.setLinearVelocity(linearVel)
+        node.setAngularVelocity(angularVel)
+        node.setActive(True)
+
+
+def getTierCounts():
+    """
+    Return a dict mapping each tier name to the number of bodies in that tier.
+    """
+
+    counts = dict((TIER_NAMES[tier], 0) for tier in ALL_TIERS)
+    for body in managedBodies:
+        counts[TIER_NAMES[body.tier]] += 1
+    return counts
+
+
+def updateSimLod(tickCount):
+    global managedBodies
+
+    if tickCount % COARSE_TICK_DIVISOR == 0:
+        for body in managedBodies:
+            if body.tier == TIER_COARSE:
+                body.coarseStep(COARSE_TICK_DIVISOR * TICK_DT)
+
+    if tickCount % LOD_UPDATE_INTERVAL != 0:
+        return
+
+    for body in managedBodies:
+        if body.bodyNP.hasTag(REMOVED_TAG):
+            del managedBodiesByKey[body.bodyNP.getKey()]
+    managedBodies = [body for body in managedBodies
+                     if not body.bodyNP.hasTag(REMOVED_TAG)]
+    if not managedBodies:
+        return
+
+    distances = distancesToInterest(np.array(
+        [tuple(body.bodyNP.getPos(app.render)) for body in managedBodies]))
+    currentTiers = np.array([body.tier for body in managedBodies])
+    newTiers = chooseTiers(distances, currentTiers)
+    for body, newTier in zip(managedBodies, newTiers):
+        if newTier != body.tier:
+            key = (body.tier, int(newTier))
+            transitionCounts[key] = transitionCounts.get(key, 0) + 1
+            body.setTier(int(newTier))
+
+
+def distancesToInterest(positions):
+    """
+    Given an (N, 3) array of positions, return an (N,) array of the distance
+    from each to the nearest point or region of interest. Distances are
+    measured from the edge of a region, and are 0 inside it.
+    """
+
+    centers = [tuple(nodePath.getPos(app.render))
+               for nodePath in interestNodes if not nodePath.isEmpty()]
+    radii = [0.0] * len(centers)
+    for center, radius in interestRegions:
+        centers.append(tuple(center))
+        radii.append(radius)
+    if not centers:
+        return np.full(len(positions), np.inf)
+
+    offsets = positions[:, np.newaxis, :] - np.array(centers)[np.newaxis]
+    distances = np.linalg.norm(offsets, axis=2) - np.array(radii)
+    return np.maximum(distances.min(axis=1), 0.0)
+
+
+def chooseTiers(distances, currentTiers):
+    """
+    Pick the tier for each body, given its distance from the nearest point of
+    interest and its current tier.
+    """
+
+    # Thresholds for leaving the current tier are shifted by the hysteresis.
+    # A body only gets promoted once it's HYSTERESIS closer than the
+    # boundary it was demoted at.
+    coarseAt = np.where(currentTiers >= TIER_COARSE,
+                        COARSE_DISTANCE - HYSTERESIS, COARSE_DISTANCE)
+    frozenAt = np.where(currentTiers >= TIER_FROZEN,
+                        FROZEN_DISTANCE - HYSTERESIS, FROZEN_DISTANCE)
+    tiers = np.full(len(distances), TIER_FULL)
+    tiers[distances > coarseAt] = TIER_COARSE
+    tiers[distances > frozenAt] = TIER_FROZEN
+    return tiers
+
+
+class ManagedBody(object):
+    def __init__(self, bodyNP):
+        super(ManagedBody, self).__init__()
+
+        self.bodyNP = bodyNP
+        self.tier   = TIER_FULL
+
+        node = bodyNP.node()
+        self.ccdMotionThreshold = node.getCcdMotionThreshold()
+        # Only used in the reduced tiers, where Bullet isn't tracking the
+        # velocity for us.
+        self.linearVel  = Vec3(0, 0, 0)
+        self.angularVel = Vec3(0, 0, 0)
+
+    def setTier(self, newTier):
+        node = self.bodyNP.node()
+        if self.tier == TIER_FULL:
+            # Leaving full simulation; take over from Bullet.
+            self.linearVel  = node.getLinearVelocity()
+            self.angularVel = node.getAngularVelocity()
+            node.setCcdMotionThreshold(0)
+            node.setKinematic(True)
+            node.setLinearVelocity(Vec3(0, 0, 0))
+            node.setAngularVelocity(Vec3(0, 0, 0))
+        elif newTier == TIER_FULL:
+            # Hand the body back to Bullet, moving the way it was before.
+            node.setKinematic(False)
+            node.setCcdMotionThreshold(self.ccdMotionThreshold)
+            node.setLinearVelocity(self.linearVel)
+            node.setAngularVelocity(self.angularVel)
+            node.setActive(True)
+        self.tier = newTier
+
+    def coarseStep(self, dt):
+        """
+        Move a COARSE body ballistically by dt seconds, stopping it if it hits
+        anything on the way.
+        """
+
+        if self.linearVel.length() == 0:
+            # Already come to rest.
+            return
+
+        self.linearVel.setZ(self.linearVel.getZ() - GRAVITY_ACCEL * dt)
+        fromPos = self.bodyNP.getPos(app.render)
+        toPos = fromPos + self.linearVel * dt
+
+        node = self.bodyNP.node()
+        shape = node.getShape(0)
+        if shape.isConvex():
+            result = physics.world.sweepTestClosest(
+                shape, TransformState.makePos(fromPos),
+                TransformState.makePos(toPos), COARSE_SWEEP_MASK, 0.0)
+            if result.hasHit():
+                # Rather than simulating a bounce, just stop; nobody is
+                # close enough to see the difference. If a player comes
+                # near, Bullet takes over again from wherever we stopped.
+                toPos = fromPos + (toPos - fromPos) * result.getHitFraction()
+                self.linearVel  = Vec3(0, 0, 0)
+                self.angularVel = Vec3(0, 0, 0)
+        self.bodyNP.setPos(app.render, toPos)
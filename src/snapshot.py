@@ -0,0 +1,421 @@
+import collections
+import struct
+
+from panda3d.core import Point3
+from panda3d.core import Quat
+from panda3d.core import Vec3
+
+from src import graphics
+from src import physics
+from src.graphics import toggleSmileyFrowney
+from src.logconfig import newLogger
+from src.physics import REMOVED_TAG
+from src.simlod import getEffectiveVelocity
+from src.simlod import setEffectiveVelocity
+
+log = newLogger(__name__)
+
+# Binary format for snapshots of the dynamic state of the world. Everything is
+# little-endian. A snapshot is:
+#   - A header (HEADER_STRUCT)
+#   - The player state (PLAYER_STRUCT)
+#   - For a full snapshot: one BODY_STRUCT record per tracked body.
+#   - For a delta snapshot: one BODY_STRUCT record per body that was added or
+#     changed since the base snapshot, followed by the snapshot IDs of the
+#     bodies removed since then (ID_STRUCT each).
+#
+# Bump SNAPSHOT_VERSION whenever any of this changes.
+SNAPSHOT_MAGIC   = b"SMSH"
+SNAPSHOT_VERSION = 1
+
+SNAPSHOT_TYPE_FULL  = 0
+SNAPSHOT_TYPE_DELTA = 1
+
+# magic, version, type, tick, base tick (deltas only), number of body
+# records, number of removed IDs (deltas only).
+HEADER_STRUCT = struct.Struct("<4sHBIIII")
+# Position (3), heading, head pitch, vertical velocity, whether grounded,
+# whether the smiley is a frowney, and the input used during the tick: linear
+# movement (x, y), angular movement, and jump speed (0 if not jumping).
+PLAYER_STRUCT = struct.Struct("<3f3fBB4f")
+# Snapshot ID, kind, position (3), quaternion (4), linear velocity (3),
+# angular velocity (3).
+BODY_STRUCT = struct.Struct("<IB3f4f3f3f")
+ID_STRUCT = struct.Struct("<I")
+
+# The tag holding each tracked body's snapshot ID.
+SNAPSHOT_ID_TAG = "snapshotId"
+
+# How many ticks of history to keep for rollback, and how often (in ticks) to
+# store a full snapshot rather than a delta.
+HISTORY_LENGTH     = 120
+KEYFRAME_INTERVAL  = 15
+
+app = None
+playerController = None
+
+# Maps snapshot ID -> (kind, bodyNP) for every body we know how to snapshot.
+trackedBodies = {}
+nextSnapshotId = 1
+
+# Maps kind -> function which creates a fresh body of that kind (and calls
+# trackBody on it). Used to bring back bodies that existed in a snapshot but
+# have since been removed.
+bodyFactories = {}
+
+# The player's input at the start of the current tick. Captured before the
+# controllers run, since they consume the jump.
+currentTickInput = (0.0, 0.0, 0.0, 0.0)
+
+history = None
+
+
+def initSnapshots(app_, playerController_):
+    global app, playerController, history
+    app = app_
+    playerController = playerController_
+
+    history = SnapshotHistory(HISTORY_LENGTH, KEYFRAME_INTERVAL)
+    physics.addPreTickCallback(recordTickInput, first=True)
+    physics.addPostTickCallback(recordTick)
+
+
+def registerBodyKind(kind, factory):
+    """
+    Let snapshots include bodies of the given kind (a small integer). factory
+    should create a new body of that kind, attach it, pass it to trackBody, and
+    return its NodePath; restoring a snapshot then overwrites its state.
+    """
+
+    bodyFactories[kind] = factory
+
+
+def trackBody(bodyNP, kind, snapshotId=None):
+    """
+    Include the dynamic body at bodyNP in snapshots. Bodies are forgotten once
+    they're removed with physics.removeBody.
+    """
+
+    global nextSnapshotId
+    if snapshotId is None:
+        snapshotId = nextSnapshotId
+        nextSnapshotId += 1
+    bodyNP.setTag(SNAPSHOT_ID_TAG, str(snapshotId))
+    trackedBodies[snapshotId] = (kind, bodyNP)
+
+
+def pruneRemovedBodies():
+    for snapshotId, (_, bodyNP) in list(trackedBodies.items()):
+        if bodyNP.hasTag(REMOVED_TAG):
+            del trackedBodies[snapshotId]
+
+
+###############################################################################
+# Capturing and restoring
+
+def captureSnapshot():
+    """
+    Return a full snapshot of the current state, as a byte string.
+    """
+
+    pruneRemovedBodies()
+    render = app.render
+
+    bodyIds = sorted(trackedBodies)
+    buf = bytearray(HEADER_STRUCT.size + PLAYER_STRUCT.size +
+                    BODY_STRUCT.size * len(bodyIds))
+    HEADER_STRUCT.pack_into(buf, 0, SNAPSHOT_MAGIC, SNAPSHOT_VERSION,
+                            SNAPSHOT_TYPE_FULL, physics.tickCount, 0,
+                            len(bodyIds), 0)
+    offset = HEADER_STRUCT.size
+
+    playerPos = graphics.playerNP.getPos(render)
+    PLAYER_STRUCT.pack_into(
+        buf, offset, playerPos.getX(), playerPos.getY(), playerPos.getZ(),
+        graphics.playerNP.getH(), graphics.playerHeadNP.getP(),
+        playerController.verticalVel, playerController.isGrounded,
+        graphics.smileyIsFrowney, *currentTickInput)
+    offset += PLAYER_STRUCT.size
+
+    for snapshotId in bodyIds:
+        kind, bodyNP = trackedBodies[snapshotId]
+        pos  = bodyNP.getPos(render)
+        quat = bodyNP.getQuat(render)
+        linearVel, angularVel = getEffectiveVelocity(bodyNP)
+        BODY_STRUCT.pack_into(
+            buf, offset, snapshotId, kind,
+            pos.getX(), pos.getY(), pos.getZ(),
+            quat.getR(), quat.getI(), quat.getJ(), quat.getK(),
+            linearVel.getX(), linearVel.getY(), linearVel.getZ(),
+            angularVel.getX(), angularVel.getY(), angularVel.getZ())
+        offset += BODY_STRUCT.size
+
+    return bytes(buf)
+
+
+def restoreSnapshot(data):
+    """
+    Restore the state saved by captureSnapshot. Bodies created since the
+    snapshot are removed, and bodies removed since then are recreated.
+    """
+
+    global currentTickInput
+
+    header, playerState, bodyRecords, _ = parseSnapshot(data)
+    _, _, snapshotType, tick, _, _, _ = header
+    assert snapshotType == SNAPSHOT_TYPE_FULL
+    render = app.render
+
+    (x, y, z, heading, pitch, verticalVel, isGrounded, isFrowney,
+     moveX, moveY, angular, jumpSpeed) = playerState
+    graphics.playerNP.setPos(render, x, y, z)
+    graphics.playerNP.setH(heading)
+    graphics.playerHeadNP.setP(pitch)
+    graphics.invalidateTransformCache()
+    playerController.verticalVel = verticalVel
+    playerController.isGrounded  = bool(isGrounded)
+    if bool(isFrowney) != graphics.smileyIsFrowney:
+        toggleSmileyFrowney()
+    currentTickInput = (moveX, moveY, angular, jumpSpeed)
+
+    pruneRemovedBodies()
+    for snapshotId in set(trackedBodies) - set(bodyRecords):
+        _, bodyNP = trackedBodies.pop(snapshotId)
+        physics.removeBody(bodyNP)
+
+    for snapshotId, record in bodyRecords.items():
+        (_, kind, px, py, pz, qr, qi, qj, qk,
+         lx, ly, lz, ax, ay, az) = BODY_STRUCT.unpack(record)
+        if snapshotId not in trackedBodies:
+            bodyNP = bodyFactories[kind]()
+            # The factory tracked it under a new ID; move it to the old one.
+            del trackedBodies[int(bodyNP.getTag(SNAPSHOT_ID_TAG))]
+            trackBody(bodyNP, kind, snapshotId)
+        _, bodyNP = trackedBodies[snapshotId]
+        bodyNP.setPosQuat(render, Point3(px, py, pz), Quat(qr, qi, qj, qk))
+        setEffectiveVelocity(bodyNP, Vec3(lx, ly, lz), Vec3(ax, ay, az))
+
+    physics.tickCount = tick
+
+
+def parseSnapshot(data):
+    """
+    Split a snapshot into (header, playerState, bodyRecords, removedIds), where
+    header and playerState are the unpacked tuples, bodyRecords maps snapshot
+    ID to the packed BODY_STRUCT record, and removedIds is a list of IDs (only
+    nonempty for delta snapshots).
+    """
+
+    header = HEADER_STRUCT.unpack_from(data, 0)
+    magic, version, _, _, _, numBodies, numRemoved = header
+    if magic != SNAPSHOT_MAGIC:
+        raise ValueError("Not a snapshot.")
+    if version != SNAPSHOT_VERSION:
+        raise ValueError("Snapshot version {} is not supported (expected {})"
+                         .format(version, SNAPSHOT_VERSION))
+    offset = HEADER_STRUCT.size
+
+    playerState = PLAYER_STRUCT.unpack_from(data, offset)
+    offset += PLAYER_STRUCT.size
+
+    bodyRecords = {}
+    for _ in range(numBodies):
+        record = data[offset:offset + BODY_STRUCT.size]
+        bodyRecords[ID_STRUCT.unpack_from(record, 0)[0]] = record
+        offset += BODY_STRUCT.size
+
+    removedIds = []
+    for _ in range(numRemoved):
+        removedIds.append(ID_STRUCT.unpack_from(data, offset)[0])
+        offset += ID_STRUCT.size
+
+    return header, playerState, bodyRecords, removedIds
+
+
+###############################################################################
+# Deltas
+
+def makeDelta(baseData, data):
+    """
+    Return a delta snapshot which turns the full snapshot baseData into the
+    full snapshot data. Only the bodies which changed are stored.
+    """
+
+    baseHeader, _, baseRecords, _ = parseSnapshot(baseData)
+    header, _, records, _ = parseSnapshot(data)
+
+    changed = [record for snapshotId, record in sorted(records.items())
+               if baseRecords.get(snapshotId) != record]
+    removed = sorted(set(baseRecords) - set(records))
+
+    playerStart = HEADER_STRUCT.size
+    playerEnd   = playerStart + PLAYER_STRUCT.size
+    return b"".join(
+        [HEADER_STRUCT.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION,
+                            SNAPSHOT_TYPE_DELTA, header[3], baseHeader[3],
+                            len(changed), len(removed)),
+         data[playerStart:playerEnd]] +
+        changed +
+        [ID_STRUCT.pack(snapshotId) for snapshotId in removed])
+
+
+def applyDelta(baseData, deltaData):
+    """
+    Inverse of makeDelta: return the full snapshot obtained by applying
+    deltaData to baseData.
+    """
+
+    baseHeader, _, records, _ = parseSnapshot(baseData)
+    header, _, changedRecords, removedIds = parseSnapshot(deltaData)
+    if header[2] != SNAPSHOT_TYPE_DELTA or header[4] != baseHeader[3]:
+        raise ValueError("Delta for tick {} does not apply to tick {}."
+                         .format(header[4], baseHeader[3]))
+
+    records.update(changedRecords)
+    for snapshotId in removedIds:
+        del records[snapshotId]
+
+    playerStart = HEADER_STRUCT.size
+    playerEnd   = playerStart + PLAYER_STRUCT.size
+    return b"".join(
+        [HEADER_STRUCT.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION,
+                            SNAPSHOT_TYPE_FULL, header[3], 0,
+                            len(records), 0),
+         deltaData[playerStart:playerEnd]] +
+        [record for _, record in sorted(records.items())])
+
+
+###############################################################################
+# History and rollback
+
+class SnapshotHistory(object):
+    """
+    Ring buffer of the last few ticks' snapshots. Every keyframeInterval ticks
+    we store a full snapshot; the rest are stored as deltas against the most
+    recent full one, so any tick can be rebuilt from at most two entries.
+    """
+
+    def __init__(self, length, keyframeInterval):
+        super(SnapshotHistory, self).__init__()
+
+        self.keyframeInterval = keyframeInterval
+        # Deque of (tick, data), oldest first. data is either full or a delta.
+        self.entries = collections.deque(maxlen=length)
+        # Full snapshots, keyed by tick. Kept as long as some entry needs them.
+        self.keyframes = {}
+        self.lastKeyframeTick = None
+
+    def add(self, data):
+        tick = HEADER_STRUCT.unpack_from(data, 0)[3]
+
+        # If we've gone back in time (rollback), everything after this tick is
+        # now stale.
+        while self.entries and self.entries[-1][0] >= tick:
+            self.entries.pop()
+        if self.lastKeyframeTick is not None and \
+                self.lastKeyframeTick >= tick:
+            self.lastKeyframeTick = None
+
+        if self.lastKeyframeTick is None or \
+                tick - self.lastKeyframeTick >= self.keyframeInterval:
+            self.keyframes[tick] = data
+            self.lastKeyframeTick = tick
+            self.entries.append((tick, data))
+        else:
+            baseData = self.keyframes[self.lastKeyframeTick]
+            self.entries.append((tick, makeDelta(baseData, data)))
+
+        # Forget keyframes that nothing refers to anymore.
+        oldestTick = self.entries[0][0]
+        for keyframeTick in list(self.keyframes):
+            if keyframeTick < oldestTick and \
+                    not self.hasDeltaAgainst(keyframeTick):
+                del self.keyframes[keyframeTick]
+
+    def hasDeltaAgainst(self, keyframeTick):
+        # Deltas are always against the most recent keyframe before them, so
+        # only the oldest entries can refer to an expired keyframe.
+        for _, data in self.entries:
+            header = HEADER_STRUCT.unpack_from(data, 0)
+            if header[2] == SNAPSHOT_TYPE_FULL:
+                return False
+            if header[4] == keyframeTick:
+                return True
+        return False
+
+    def getTicks(self):
+        return [tick for tick, _ in self.entries]
+
+    def getFull(self, tick):
+        """
+        Return the full snapshot for the given tick, or None if it's not in
+        the history.
+        """
+
+        for entryTick, data in self.entries:
+            if entryTick == tick:
+                header = HEADER_STRUCT.unpack_from(data, 0)
+                if header[2] == SNAPSHOT_TYPE_FULL:
+                    return data
+                return applyDelta(self.keyframes[header[4]], data)
+        return None
+
+    def getInput(self, tick):
+        """
+        Return the player input recorded for the given tick, or None.
+        """
+
+        for entryTick, data in self.entries:
+            if entryTick == tick:
+                return PLAYER_STRUCT.unpack_from(data, HEADER_STRUCT.size)[8:]
+        return None
+
+
+def recordTickInput(dt):  # pylint: disable=unused-argument
+    global currentTickInput
+    jumpSpeed = playerController.pendingJumpSpeed
+    currentTickInput = (playerController.linearMovement.getX(),
+                        playerController.linearMovement.getY(),
+                        playerController.angularMovement,
+                        jumpSpeed if jumpSpeed is not None else 0.0)
+
+
+def recordTick(tickCount):  # pylint: disable=unused-argument
+    history.add(captureSnapshot())
+
+
+def rollback(tick):
+    """
+    Restore the state as of the end of the given tick, then re-simulate up to
+    the current tick, replaying the player's recorded input. Use this after
+    changing something about the past (say, a late-arriving event) to get the
+    corrected present. Return False if the tick is no longer in the history.
+    """
+
+    data = history.getFull(tick)
+    if data is None:
+        return False
+
+    currentTick = physics.tickCount
+    savedInput = (Vec3(playerController.linearMovement),
+                  playerController.angularMovement)
+
+    # Look up all the inputs first: every replayed tick is recorded again,
+    # which drops the history entries after it, including the inputs for the
+    # ticks still to be replayed.
+    replayInputs = [history.getInput(replayTick)
+                    for replayTick in range(tick + 1, currentTick + 1)]
+
+    restoreSnapshot(data)
+    for replayInput in replayInputs:
+        if replayInput is not None:
+            moveX, moveY, angular, jumpSpeed = replayInput
+            playerController.setLinearMovement(Vec3(moveX, moveY, 0))
+            playerController.setAngularMovement(angular)
+            if jumpSpeed > 0:
+                playerController.doJump(jumpSpeed)
+        physics.doPhysicsOneTick()
+
+    playerController.setLinearMovement(savedInput[0])
+    playerController.setAngularMovement(savedInput[1])
+    return True
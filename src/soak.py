@@ -0,0 +1,154 @@
+"""
+Long-running headless soak test. Fires bullets continuously and fails if the
+number of live resources or the process's memory use keeps growing.
+
+Run with:
+    python -m src.soak --duration 600
+"""
+
+import argparse
+import sys
+import time
+
+from src import physics
+from src.control import clicked
+from src.graphics import changePlayerHeadingPitch
+from src.headless import makeHeadlessApp
+from src.headless import stepFrames
+from src.headless import useFixedFrameRate
+from src.logconfig import newLogger
+from src.main import initModules
+from src.resources import getLiveCounts
+from src.resources import getRssBytes
+from src.resources import logResourceCounts
+from src.world import BULLET_LIFETIME
+
+log = newLogger(__name__)
+
+# The soak test runs on a fixed (non-real-time) clock at this rate.
+SIM_FRAME_RATE = 60
+
+# Shots per simulated second.
+DEFAULT_FIRE_RATE = 20.0
+
+# How long to run before taking the baseline measurements, in simulated
+# seconds. This needs to be longer than BULLET_LIFETIME, so that bullet
+# creation and expiry have reached a steady state; otherwise the baseline
+# would be artificially low.
+WARMUP_SECONDS = BULLET_LIFETIME + 5.0
+
+# How often to check the counts against the baseline, in simulated seconds.
+CHECK_INTERVAL = 5.0
+
+# How far above the baseline each count is allowed to go. Counts fluctuate a
+# little depending on exactly when bullets expire relative to the check.
+DEFAULT_COUNT_SLACK = 10
+
+# How far above the baseline the RSS is allowed to go, in bytes. Python's
+# allocator and Panda3D's caches both grow a bit before settling down, so this
+# can't be zero.
+DEFAULT_RSS_SLACK = 32 * 1024 * 1024
+
+# Degrees to turn between shots, so that bullets go off in all directions
+# rather than piling up in one spot.
+DEGREES_PER_SHOT = 37
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument("--duration", type=float, default=60.0,
+                        help="Wall-clock seconds to run for (after warmup).")
+    parser.add_argument("--fire-rate", type=float, default=DEFAULT_FIRE_RATE,
+                        help="Shots per simulated second.")
+    parser.add_argument("--count-slack", type=int,
+                        default=DEFAULT_COUNT_SLACK,
+                        help="Allowed growth of any resource count.")
+    parser.add_argument("--rss-slack-mib", type=float,
+                        default=DEFAULT_RSS_SLACK / (1024.0 * 1024.0),
+                        help="Allowed growth of resident memory, in MiB.")
+    args = parser.parse_args()
+
+    failures = runSoak(args.duration, args.fire_rate, args.count_slack,
+                       int(args.rss_slack_mib * 1024 * 1024))
+    if failures:
+        log.error("Soak test FAILED:")
+        for failure in failures:
+            log.error("    %s", failure)
+        sys.exit(1)
+    log.info("Soak test passed.")
+
+
+def runSoak(duration, fireRate=DEFAULT_FIRE_RATE,
+            countSlack=DEFAULT_COUNT_SLACK, rssSlack=DEFAULT_RSS_SLACK):
+    """
+    Run the soak test for duration wall-clock seconds. Return a list of
+    strings describing everything that grew beyond its bound; an empty list
+    means the test passed.
+    """
+
+    app = makeHeadlessApp()
+    initModules(app)
+    useFixedFrameRate(SIM_FRAME_RATE)
+
+    shooter = Shooter(app, fireRate)
+
+    log.info("Warming up for %.0f simulated seconds.", WARMUP_SECONDS)
+    runSimulatedSeconds(app, shooter, WARMUP_SECONDS)
+    baseline = takeMeasurements(app)
+    log.info("Baseline:")
+    logResourceCounts()
+
+    failures = []
+    endTime = time.time() + duration
+    while time.time() < endTime and not failures:
+        runSimulatedSeconds(app, shooter, CHECK_INTERVAL)
+        current = takeMeasurements(app)
+        for name, value in sorted(current.items()):
+            slack = rssSlack if name == "rss" else countSlack
+            if value > baseline[name] + slack:
+                failures.append("{} grew from {} to {} (allowed {})"
+                                .format(name, baseline[name], value, slack))
+
+    log.info("Final:")
+    logResourceCounts()
+    return failures
+
+
+def runSimulatedSeconds(app, shooter, seconds):
+    numFrames = int(seconds * SIM_FRAME_RATE)
+    for _ in range(numFrames):
+        shooter.update()
+        stepFrames(app, 1)
+
+
+def takeMeasurements(app):
+    """
+    Return a dict of everything that's supposed to stay bounded. In addition to
+    our own bookkeeping, ask Panda3D and Bullet directly, in case someone
+    creates resources without telling the resources module.
+    """
+
+    measurements = dict(("live " + kind, count)
+                        for kind, count in getLiveCounts().items())
+    measurements["physics rigid bodies"] = physics.world.getNumRigidBodies()
+    measurements["scene graph nodes"] = app.render.countNumDescendants()
+    measurements["rss"] = getRssBytes()
+    return measurements
+
+
+class Shooter(object):
+    def __init__(self, app, fireRate):
+        super(Shooter, self).__init__()
+        self.app = app
+        self.framesPerShot = max(1, int(round(SIM_FRAME_RATE / fireRate)))
+        self.frameCount = 0
+
+    def update(self):
+        self.frameCount += 1
+        if self.frameCount % self.framesPerShot == 0:
+            changePlayerHeadingPitch(DEGREES_PER_SHOT, 0)
+            clicked()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+import collections
+import math
+import time
+
+from src.graphics import getPlayerPos
+from src.logconfig import newLogger
+from src.world_config import CHUNK_ATTACH_RADIUS
+from src.world_config import CHUNK_BUILD_BUDGET
+from src.world_config import CHUNK_DETACH_RADIUS
+from src.world_config import CHUNK_PREFETCH_RADIUS
+from src.world_config import CHUNK_SIZE
+from src.world_config import CHUNK_UNLOAD_RADIUS
+
+log = newLogger(__name__)
+
+app = None
+
+# Maps chunk coordinates (x, y) -> Chunk, for every chunk that has any pieces
+# at all, whether or not it's currently loaded.
+chunks = {}
+
+# Chunks that are built, partially built, or waiting to be built. Only these
+# need to be considered for detaching and unloading, so the per-frame work
+# depends on the size of the player's neighbourhood rather than the map.
+activeChunks = set()
+
+# Chunks waiting to be built (in whole or in part), nearest first-ish.
+buildQueue = collections.deque()
+
+# Coordinates of the chunk the player was in the last time we checked.
+centerCoords = None
+
+# Functions to call (with no arguments) whenever a chunk is attached or
+# detached; for anything that has to know when the static scenery changes.
+sceneryChangedCallbacks = []
+
+
+def initStreaming(app_):
+    global app
+    app = app_
+
+    app.taskMgr.add(streamChunksTask, "StreamChunks")
+
+
+def addStaticPiece(minX, minY, maxX, maxY, factory):
+    """
+    Add a piece of static scenery covering the rectangle from (minX, minY) to
+    (maxX, maxY) to every chunk that rectangle overlaps. factory is called
+    with no arguments to build the piece when the first of those chunks is
+    loaded. It should return an unattached object with attach(), detach(), and
+    destroy() methods, such as a Panel created with attach=False.
+    """
+
+    piece = StaticPiece(factory)
+    minCoords = chunkCoordsForPoint(minX, minY)
+    maxCoords = chunkCoordsForPoint(maxX, maxY)
+    for x in range(minCoords[0], maxCoords[0] + 1):
+        for y in range(minCoords[1], maxCoords[1] + 1):
+            if (x, y) not in chunks:
+                chunks[(x, y)] = Chunk((x, y))
+            chunks[(x, y)].pieces.append(piece)
+
+
+def chunkCoordsForPoint(x, y):
+    return (int(math.floor(x / CHUNK_SIZE)), int(math.floor(y / CHUNK_SIZE)))
+
+
+def chunkDistance(coords1, coords2):
+    return max(abs(coords1[0] - coords2[0]), abs(coords1[1] - coords2[1]))
+
+
+def streamChunksTask(task):
+    updateStreaming()
+    return task.cont
+
+
+def updateStreaming():
+    global centerCoords
+
+    playerPos = getPlayerPos()
+    newCenter = chunkCoordsForPoint(playerPos.getX(), playerPos.getY())
+    if newCenter != centerCoords:
+        centerCoords = newCenter
+        recenter()
+
+    # Always finish building anything the player is right next to, budget or
+    # no budget; otherwise they could fall through the floor.
+    for chunk in chunksWithin(CHUNK_ATTACH_RADIUS):
+        if not chunk.isBuilt():
+            chunk.buildSome(deadline=None)
+        chunk.attach()
+
+    deadline = time.time() + CHUNK_BUILD_BUDGET
+    while buildQueue and time.time() < deadline:
+        chunk = buildQueue[0]
+        if chunk.buildSome(deadline):
+            buildQueue.popleft()
+
+
+def recenter():
+    """
+    Called when the player moves into a different chunk. Queue up newly nearby
+    chunks for building, and detach or unload ones that are now far away.
+    """
+
+    for chunk in list(activeChunks):
+        distance = chunkDistance(chunk.coords, centerCoords)
+        if distance > CHUNK_UNLOAD_RADIUS:
+            chunk.unload()
+            activeChunks.discard(chunk)
+            if chunk in buildQueue:
+                buildQueue.remove(chunk)
+        elif distance > CHUNK_DETACH_RADIUS:
+            chunk.detach()
+
+    for chunk in chunksWithin(CHUNK_PREFETCH_RADIUS):
+        if chunk not in activeChunks:
+            activeChunks.add(chunk)
+            buildQueue.append(chunk)
+
+
+def chunksWithin(radius):
+    centerX, centerY = centerCoords
+    for x in range(centerX - radius, centerX + radius + 1):
+        for y in range(centerY - radius, centerY + radius + 1):
+            chunk = chunks.get((x, y))
+            if chunk is not None:
+                yield chunk
+
+
+def notifySceneryChanged():
+    for callback in sceneryChangedCallbacks:
+        callback()
+
+
+class StaticPiece(object):
+    """
+    A piece of static scenery, which may be shared by several chunks. It's
+    built while any of them is loaded, and attached while any of them is
+    attached.
+    """
+
+    def __init__(self, factory):
+        super(StaticPiece, self).__init__()
+
+        self.factory = factory
+        # The object built by factory, or None.
+        self.obj = None
+        # Number of chunks that have loaded and attached the piece.
+        self.numHolders  = 0
+        self.numAttached = 0
+
+    def acquire(self):
+        if self.numHolders == 0:
+            self.obj = self.factory()
+        self.numHolders += 1
+
+    def release(self):
+        self.numHolders -= 1
+        if self.numHolders == 0:
+            self.obj.destroy()
+            self.obj = None
+
+    def attach(self):
+        if self.numAttached == 0:
+            self.obj.attach()
+        self.numAttached += 1
+
+    def detach(self):
+        self.numAttached -= 1
+        if self.numAttached == 0:
+            self.obj.detach()
+
+
+class Chunk(object):
+    def __init__(self, coords):
+        super(Chunk, self).__init__()
+
+        self.coords = coords
+        # StaticPieces overlapping the chunk.
+        self.pieces = []
+        # The chunk has loaded the first numLoaded of its pieces.
+        self.numLoaded = 0
+        self.isAttached = False
+
+    def isBuilt(self):
+        return self.numLoaded == len(self.pieces)
+
+    def buildSome(self, deadline):
+        """
+        Build pieces until they're all built or time.time() passes deadline.
+        (A deadline of None means build everything.) Return whether the chunk
+        is now completely built.
+        """
+
+        while not self.isBuilt():
+            if deadline is not None and time.time() >= deadline:
+                return False
+            # If another chunk already loaded the piece, this is free.
+            piece = self.pieces[self.numLoaded]
+            piece.acquire()
+            self.numLoaded += 1
+            if self.isAttached:
+                piece.attach()
+        return True
+
+    def attach(self):
+        if self.isAttached:
+            return
+        log.debug("Attaching chunk %s.", self.coords)
+        for piece in self.pieces[:self.numLoaded]:
+            piece.attach()
+        self.isAttached = True
+        notifySceneryChanged()
+
+    def detach(self):
+        if not self.isAttached:
+            return
+        log.debug("Detaching chunk %s.", self.coords)
+        for piece in self.pieces[:self.numLoaded]:
+            piece.detach()
+        self.isAttached = False
+        notifySceneryChanged()
+
+    def unload(self):
+        self.detach()
+        log.debug("Unloading chunk %s.", self.coords)
+        for piece in self.pieces[:self.numLoaded]:
+            piece.release()
+        self.numLoaded = 0
@@ -0,0 +1,333 @@
+"""
+Run many headless simulations in parallel, sweeping over combinations of
+tuning parameters, and report how each combination behaves.
+
+Every run gets its own process (Panda3D only allows one ShowBase per process),
+with one combination of parameter values and one scripted scenario. Parameters
+are given by the name of a module-level constant, such as SUBSTEP_DT,
+GRAVITY_ACCEL, PLAYER_HEIGHT or PLAYER_MAX_SPEED, and are overridden in every
+module that has imported that name.
+
+Run with:
+    python -m src.sweep --param SUBSTEP_DT=0.001667,0.000833 \\
+        --param GRAVITY_ACCEL=9.81,15 --scenario walk --scenario barrage
+"""
+
+import argparse
+import itertools
+import json
+import math
+import multiprocessing
+import sys
+import time
+import traceback
+
+from src.logconfig import newLogger
+
+log = newLogger(__name__)
+
+# Scenario names. See runScenarioTick.
+SCENARIO_STAND   = "stand"   # Stand still on the floor.
+SCENARIO_WALK    = "walk"    # Run around in circles, jumping now and then.
+SCENARIO_BARRAGE = "barrage" # Stand still and fire fast bullets everywhere.
+
+ALL_SCENARIOS = (SCENARIO_STAND, SCENARIO_WALK, SCENARIO_BARRAGE)
+
+DEFAULT_TICKS = 1200
+
+# Ticks to let the player settle onto the floor before measuring.
+SETTLE_TICKS = 60
+
+WALK_TURN_RATE     = 60.0 # Degrees per second
+WALK_JUMP_INTERVAL = 120  # Ticks
+
+BARRAGE_INTERVAL     = 3    # Ticks between shots
+BARRAGE_SPEED        = 80.0 # Meters per second
+BARRAGE_HEADING_STEP = 37.0 # Degrees between consecutive shots
+BARRAGE_PITCHES      = (-60.0, -30.0, -10.0, 0.0, 10.0)
+
+# A bullet this far outside the arena's walls, or this far below the floor,
+# has tunnelled through.
+TUNNEL_MARGIN = 0.5
+
+# The player is considered to have sunk into the floor if the bottom of their
+# collision sphere is more than this far below it.
+FLOOR_PENETRATION_TOLERANCE = 0.05
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip(),
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--param", action="append", default=[],
+                        metavar="NAME=V1,V2,...",
+                        help="A parameter and the values to try. Can be "
+                             "given more than once; every combination is "
+                             "run.")
+    parser.add_argument("--scenario", action="append", choices=ALL_SCENARIOS,
+                        help="Scenario to run each combination in. Can be "
+                             "given more than once. Default: all of them.")
+    parser.add_argument("--ticks", type=int, default=DEFAULT_TICKS,
+                        help="Ticks to simulate in each run.")
+    parser.add_argument("--processes", type=int,
+                        default=multiprocessing.cpu_count(),
+                        help="Number of runs at once. Default: one per core.")
+    parser.add_argument("--output", metavar="PATH",
+                        help="Also write the results to PATH as JSON.")
+    args = parser.parse_args()
+
+    paramValues = [parseParam(param) for param in args.param]
+    jobs = makeJobs(paramValues, args.scenario or ALL_SCENARIOS, args.ticks)
+    results = runSweep(jobs, args.processes)
+    logReport(results)
+    if args.output:
+        with open(args.output, "w") as outputFile:
+            json.dump(results, outputFile, indent=2, sort_keys=True)
+    if any(result["error"] for result in results):
+        sys.exit(1)
+
+
+def parseParam(spec):
+    """
+    Parse "NAME=V1,V2,..." into (NAME, [V1, V2, ...]).
+    """
+
+    name, _, values = spec.partition("=")
+    if not name or not values:
+        raise ValueError("Bad --param {!r}; expected NAME=V1,V2,...".format(
+            spec))
+    return name, [parseValue(value) for value in values.split(",")]
+
+def parseValue(value):
+    try:
+        return int(value)
+    except ValueError:
+        return float(value)
+
+
+def makeJobs(paramValues, scenarios, numTicks):
+    """
+    Return a job for every combination of parameter values and scenario, as a
+    list of (params, scenario, numTicks) tuples, where params is a dict.
+    """
+
+    names = [name for name, _ in paramValues]
+    combos = itertools.product(*[values for _, values in paramValues])
+    return [(dict(zip(names, combo)), scenario, numTicks)
+            for combo in combos for scenario in scenarios]
+
+
+def runSweep(jobs, numProcesses):
+    log.info("Running %d simulations, %d at a time.", len(jobs), numProcesses)
+    startTime = time.time()
+    # maxtasksperchild=1 gives each run a fresh process, and therefore a fresh
+    # Panda3D and Bullet world.
+    pool = multiprocessing.Pool(numProcesses, maxtasksperchild=1)
+    try:
+        results = []
+        for result in pool.imap_unordered(runJob, jobs, chunksize=1):
+            results.append(result)
+            log.info("[%d/%d] %s %s%s", len(results), len(jobs),
+                     result["scenario"], formatParams(result["params"]),
+                     " FAILED" if result["error"] else "")
+    finally:
+        pool.close()
+        pool.join()
+    log.info("Sweep took %.1f s.", time.time() - startTime)
+    results.sort(key=lambda result: (result["scenario"],
+                                     sorted(result["params"].items())))
+    return results
+
+
+def runJob(job):
+    """
+    Run one simulation in this (worker) process, and return its metrics as a
+    dict. Exceptions are caught and reported in the result, so that one bad
+    combination doesn't bring down the whole sweep.
+    """
+
+    params, scenario, numTicks = job
+    result = {"params": params, "scenario": scenario, "error": None}
+    try:
+        result.update(simulate(params, scenario, numTicks))
+    except Exception: # pylint: disable=broad-except
+        result["error"] = traceback.format_exc()
+    return result
+
+
+def simulate(params, scenario, numTicks):
+    # Importing src.main imports every module the game uses, so that all
+    # their copies of the parameters exist before we override them.
+    from src import main as smushMain
+    from src.headless import makeHeadlessApp
+    from src.headless import useFixedFrameRate
+    from src.physics import TICK_RATE
+
+    for name, value in params.items():
+        setParameter(name, value)
+    # The kill zone removes bullets that go through the floor and respawns
+    # the player, so with it the tunnelling and sinking counts would always
+    # be zero.
+    setParameter("KILL_ZONE_ENABLED", False)
+
+    app = makeHeadlessApp()
+    smushMain.initModules(app)
+    # One tick per frame, so each frame's cost is one tick's cost.
+    useFixedFrameRate(TICK_RATE)
+    for _ in range(SETTLE_TICKS):
+        app.taskMgr.step()
+
+    metrics = RunMetrics()
+    for tick in range(numTicks):
+        runScenarioTick(scenario, tick)
+        startTime = time.time()
+        app.taskMgr.step()
+        metrics.tickTimes.append(time.time() - startTime)
+        metrics.observe(scenario)
+    return metrics.summarize(TICK_RATE)
+
+
+def setParameter(name, value):
+    """
+    Override the module-level constant name in every one of our modules that
+    has it.
+    """
+
+    from src import physics
+
+    modules = [module for moduleName, module in list(sys.modules.items())
+               if module is not None and
+               (moduleName == "src" or moduleName.startswith("src.")) and
+               hasattr(module, name)]
+    if not modules:
+        raise KeyError("No module has a parameter named {}".format(name))
+    for module in modules:
+        setattr(module, name, value)
+
+    # Keep values derived from the parameter consistent with it.
+    if name == "SUBSTEP_DT":
+        physics.SUBSTEPS_PER_TICK = int(round(physics.TICK_DT / value))
+
+
+def runScenarioTick(scenario, tick):
+    from panda3d.core import Vec3
+
+    from src import control
+    from src import world
+    from src.graphics import getPlayerHeadPos
+
+    controller = world.playerController
+    if scenario == SCENARIO_WALK:
+        controller.setLinearMovement(Vec3(0, control.PLAYER_MAX_SPEED, 0))
+        controller.setAngularMovement(WALK_TURN_RATE)
+        if tick % WALK_JUMP_INTERVAL == 0:
+            controller.doJump(control.getJumpSpeed())
+    elif scenario == SCENARIO_BARRAGE:
+        if tick % BARRAGE_INTERVAL == 0:
+            shot = tick // BARRAGE_INTERVAL
+            heading = math.radians(shot * BARRAGE_HEADING_STEP)
+            pitch = math.radians(BARRAGE_PITCHES[shot % len(BARRAGE_PITCHES)])
+            # Heading 0 faces +y, and positive headings turn to the left.
+            direction = Vec3(-math.sin(heading) * math.cos(pitch),
+                             math.cos(heading) * math.cos(pitch),
+                             math.sin(pitch))
+            world.makeBullet(getPlayerHeadPos(),
+                             math.degrees(heading),
+                             direction * BARRAGE_SPEED)
+
+
+class RunMetrics(object):
+    def __init__(self):
+        super(RunMetrics, self).__init__()
+
+        self.tickTimes = []
+        # Keys (NodePath.getKey()) of bullets seen outside the arena.
+        self.tunnelledBullets = set()
+        self.bulletsSeen = set()
+        # Player state, for judging how stable the player is.
+        self.wasGrounded = None
+        self.groundedFlips = 0
+        self.groundedHeights = []
+        self.belowFloorTicks = 0
+
+    def observe(self, scenario):
+        from src import graphics
+        from src import world
+        from src.physics import REMOVED_TAG
+        from src.world_config import PLAYER_HEIGHT
+
+        for _, bulletNP in world.liveBullets:
+            if bulletNP.hasTag(REMOVED_TAG):
+                continue
+            key = bulletNP.getKey()
+            self.bulletsSeen.add(key)
+            pos = bulletNP.getPos(world.app.render)
+            if pos.getX() < world.MIN_X - TUNNEL_MARGIN or \
+                    pos.getX() > world.MAX_X + TUNNEL_MARGIN or \
+                    pos.getY() < world.MIN_Y - TUNNEL_MARGIN or \
+                    pos.getY() > world.MAX_Y + TUNNEL_MARGIN or \
+                    pos.getZ() < -TUNNEL_MARGIN:
+                self.tunnelledBullets.add(key)
+
+        controller = world.playerController
+        playerZ = graphics.playerNP.getZ(world.app.render)
+        if playerZ - 0.5 * PLAYER_HEIGHT < -FLOOR_PENETRATION_TOLERANCE:
+            self.belowFloorTicks += 1
+        # Jumping deliberately leaves the ground, so only count unplanned
+        # changes of state.
+        if scenario != SCENARIO_WALK and self.wasGrounded is not None and \
+                controller.isGrounded != self.wasGrounded:
+            self.groundedFlips += 1
+        self.wasGrounded = controller.isGrounded
+        if controller.isGrounded:
+            self.groundedHeights.append(playerZ)
+
+    def summarize(self, tickRate):
+        tickTimesMs = sorted(1000.0 * tickTime for tickTime in self.tickTimes)
+        heights = self.groundedHeights
+        if heights:
+            meanHeight = sum(heights) / len(heights)
+            heightStddev = math.sqrt(sum((height - meanHeight) ** 2
+                                         for height in heights) /
+                                     len(heights))
+        else:
+            heightStddev = None
+        seconds = float(len(self.tickTimes)) / tickRate
+        return {
+            "meanTickMs": sum(tickTimesMs) / len(tickTimesMs),
+            "p95TickMs":  tickTimesMs[int(0.95 * (len(tickTimesMs) - 1))],
+            "bulletsFired": len(self.bulletsSeen),
+            "tunnelled": len(self.tunnelledBullets),
+            "groundedFlipsPerSecond": self.groundedFlips / seconds,
+            "groundedHeightStddevMm": (None if heightStddev is None
+                                       else 1000.0 * heightStddev),
+            "belowFloorTicks": self.belowFloorTicks,
+        }
+
+
+def formatParams(params):
+    return " ".join("{}={}".format(name, value)
+                    for name, value in sorted(params.items()))
+
+
+def logReport(results):
+    log.info("%-8s %-40s %8s %8s %9s %7s %8s %8s",
+             "scenario", "params", "mean ms", "p95 ms", "tunnelled",
+             "flips/s", "jitter", "sunk")
+    for result in results:
+        if result["error"]:
+            log.info("%-8s %-40s FAILED:\n%s", result["scenario"],
+                     formatParams(result["params"]), result["error"])
+            continue
+        jitter = result["groundedHeightStddevMm"]
+        log.info("%-8s %-40s %8.3f %8.3f %4d/%-4d %7.2f %8s %8d",
+                 result["scenario"], formatParams(result["params"]),
+                 result["meanTickMs"], result["p95TickMs"],
+                 result["tunnelled"], result["bulletsFired"],
+                 result["groundedFlipsPerSecond"],
+                 "-" if jitter is None else "{:.2f}mm".format(jitter),
+                 result["belowFloorTicks"])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+import collections
+import time
+
+from src.logconfig import newLogger
+
+log = newLogger(__name__)
+
+# How often to write the current gauges to the debug log, in seconds.
+TELEMETRY_LOG_INTERVAL = 5.0
+
+# How many recent events to remember.
+EVENT_HISTORY = 1000
+
+# Sort for the task that marks the start of each frame's work. It runs before
+# every other task.
+FRAME_START_SORT = -100
+
+app = None
+
+# Latest value of each gauge, by name. Gauges are for things that have a
+# current value, like "frame interval jitter".
+gauges = {}
+
+# Running totals, by name. Counters are for things that happen, like "bodies
+# demoted to the coarse tier".
+counters = {}
+
+# Recent notable events, oldest first, as (wallTime, name, fieldsDict).
+events = collections.deque(maxlen=EVENT_HISTORY)
+
+# time.time() at the start of the current frame's work. Everything that times
+# frames measures from here, so that they all agree on when a frame started.
+frameStartTime = 0.0
+
+# Functions to call (with no arguments) at the start of each frame, right
+# after frameStartTime is updated.
+frameStartCallbacks = []
+
+
+def initTelemetry(app_):
+    global app
+    app = app_
+
+    app.taskMgr.add(frameStartTask, "FrameStart", sort=FRAME_START_SORT)
+    app.taskMgr.doMethodLater(TELEMETRY_LOG_INTERVAL, logTelemetryTask,
+                              "LogTelemetry")
+
+
+def setGauge(name, value):
+    gauges[name] = value
+
+def incrementCounter(name, amount=1):
+    counters[name] = counters.get(name, 0) + amount
+
+def recordEvent(name, **fields):
+    events.append((time.time(), name, fields))
+    log.debug("Event %s: %s", name, fields)
+
+
+def addFrameStartCallback(callback):
+    frameStartCallbacks.append(callback)
+
+def getFrameStartTime():
+    return frameStartTime
+
+
+def getEvents(name=None):
+    """
+    Return the recent events with the given name (or all of them if name is
+    None), oldest first.
+    """
+
+    return [event for event in events if name is None or event[1] == name]
+
+
+def frameStartTask(task):
+    global frameStartTime
+    frameStartTime = time.time()
+    for callback in frameStartCallbacks:
+        callback()
+    return task.cont
+
+def logTelemetryTask(task):
+    for name, value in sorted(gauges.items()):
+        log.debug("    %-32s %s", name, value)
+    for name, value in sorted(counters.items()):
+        log.debug("    %-32s %d", name, value)
+    return task.again
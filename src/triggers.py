@@ -0,0 +1,136 @@
+"""
+Trigger volumes: regions of space that notice when things enter and leave
+them, without pushing anything around.
+
+Each trigger is a Bullet ghost object in the TRIGGER collision group. Bullet's
+broadphase already keeps every ghost's list of overlapping objects up to date
+as part of the physics step (and the collision group matrix keeps scenery and
+the ground out of those lists), so all we do after each tick is compare that
+list to the one from the previous tick and call onEnter/onExit for whatever
+changed. A trigger that had nothing in it last tick and has nothing in it now
+costs one call into Bullet, so having lots of idle triggers is cheap.
+
+The broadphase works on bounding boxes, so by default a trigger counts
+anything whose bounding box overlaps its own. Triggers whose shape is far from
+box-like (or which need to be precise, such as a hit zone) can set exact=True
+to have each candidate confirmed with a narrowphase contact test; that test
+only runs while something is inside the trigger's bounding box.
+"""
+
+from panda3d.bullet import BulletGhostNode
+from panda3d.core import NodePath
+
+from src import physics
+from src.logconfig import newLogger
+from src.physics import COLLIDE_MASK_TRIGGER
+from src.resources import KIND_GHOST
+from src.resources import KIND_NODEPATH
+from src.resources import KIND_SHAPE
+from src.resources import noteCreated
+from src.resources import noteDestroyed
+from src.telemetry import setGauge
+
+log = newLogger(__name__)
+
+TRIGGER_CREATOR = "triggers.Trigger"
+
+app = None
+
+allTriggers = []
+
+
+def initTriggers(app_):
+    global app
+    app = app_
+
+    physics.addPostTickCallback(updateTriggers)
+
+
+def updateTriggers(tickCount): # pylint: disable=unused-argument
+    checked = 0
+    for trigger in list(allTriggers):
+        if trigger.update():
+            checked += 1
+    setGauge("triggers.checked per tick", checked)
+
+
+class Trigger(object):
+    """
+    A trigger volume with the given shape, at pos relative to parent (render
+    by default). It reports objects whose collide mask shares a bit with mask,
+    calling onEnter(trigger, np) on the tick an object starts overlapping it
+    and onExit(trigger, np) on the tick it stops. An object that is removed
+    while inside the trigger gets an onExit on the next tick, with a NodePath
+    that has already been removed.
+    """
+
+    def __init__(self, name, shape, pos, mask, onEnter=None, onExit=None,
+                 parent=None, exact=False):
+        super(Trigger, self).__init__()
+
+        self.mask = mask
+        self.onEnter = onEnter
+        self.onExit = onExit
+        self.exact = exact
+
+        # The objects currently inside, as NodePath.getKey() -> NodePath.
+        self.overlaps = {}
+
+        ghost = BulletGhostNode(name)
+        ghost.addShape(shape)
+        if parent is None:
+            parent = app.render
+        self.ghostNP = parent.attachNewNode(ghost)
+        self.ghostNP.setPos(pos)
+        self.ghostNP.setCollideMask(COLLIDE_MASK_TRIGGER)
+        physics.world.attachGhost(ghost)
+
+        noteCreated(KIND_NODEPATH, TRIGGER_CREATOR)
+        noteCreated(KIND_GHOST,    TRIGGER_CREATOR)
+        noteCreated(KIND_SHAPE,    TRIGGER_CREATOR)
+        allTriggers.append(self)
+
+    def destroy(self):
+        """
+        Remove the trigger. It doesn't call onExit for anything still inside.
+        """
+
+        if self not in allTriggers:
+            return
+        allTriggers.remove(self)
+        physics.world.removeGhost(self.ghostNP.node())
+        self.ghostNP.removeNode()
+        self.overlaps = {}
+
+        noteDestroyed(KIND_NODEPATH, TRIGGER_CREATOR)
+        noteDestroyed(KIND_GHOST,    TRIGGER_CREATOR)
+        noteDestroyed(KIND_SHAPE,    TRIGGER_CREATOR)
+
+    def update(self):
+        """
+        Call onEnter and onExit for everything that entered or left since the
+        last update. Return whether there was anything to check.
+        """
+
+        ghost = self.ghostNP.node()
+        if ghost.getNumOverlappingNodes() == 0 and not self.overlaps:
+            return False
+
+        current = {}
+        for node in ghost.getOverlappingNodes():
+            if (node.getIntoCollideMask() & self.mask).isZero():
+                continue
+            if self.exact and physics.world.contactTestPair(
+                    ghost, node).getNumContacts() == 0:
+                continue
+            nodeNP = NodePath(node)
+            current[nodeNP.getKey()] = nodeNP
+
+        previous, self.overlaps = self.overlaps, current
+        for key, nodeNP in previous.items():
+            if key not in current and self.onExit is not None:
+                self.onExit(self, nodeNP)
+        for key, nodeNP in current.items():
+            if key not in previous and self.onEnter is not None:
+                self.onEnter(self, nodeNP)
+        return True
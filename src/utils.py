@@ -21,3 +21,63 @@ def moveVectorTowardByAtMost(fromVec, toVec, maxDelta):
         vecDelta *= maxDelta / vecDelta.length()
         return fromVec + vecDelta
 
+
+class RingBuffer(object):
+    """
+    Bookkeeping for a fixed number of slots that are handed out in order,
+    wrapping around and reusing the oldest slot once they're all in use. This
+    only keeps track of slot numbers; the caller stores whatever goes in the
+    slots (typically rows of a preallocated array).
+    """
+
+    def __init__(self, capacity):
+        super(RingBuffer, self).__init__()
+
+        assert capacity > 0
+        self.capacity = capacity
+        # Slot of the oldest live entry, and the number of live entries.
+        self.start = 0
+        self.count = 0
+
+    def push(self):
+        """
+        Return the slot for a new entry. If every slot is in use, the oldest
+        entry is overwritten.
+        """
+
+        if self.count == self.capacity:
+            slot = self.start
+            self.start = (self.start + 1) % self.capacity
+        else:
+            slot = (self.start + self.count) % self.capacity
+            self.count += 1
+        return slot
+
+    def popOldest(self):
+        """
+        Free the slot of the oldest entry and return it.
+        """
+
+        assert self.count > 0
+        slot = self.start
+        self.start = (self.start + 1) % self.capacity
+        self.count -= 1
+        return slot
+
+    def oldest(self):
+        return self.start
+
+    def liveRanges(self):
+        """
+        Return the live slots as a list of (firstSlot, numSlots) ranges, oldest
+        first. Since the live slots are contiguous apart from wrapping around
+        the end, there are never more than two ranges.
+        """
+
+        end = self.start + self.count
+        if end <= self.capacity:
+            ranges = [(self.start, self.count)]
+        else:
+            ranges = [(self.start, self.capacity - self.start),
+                      (0, end - self.capacity)]
+        return [(first, num) for first, num in ranges if num > 0]
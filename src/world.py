@@ -1,29 +1,48 @@
+import collections
 import os
 import sys
 
-from panda3d.bullet import BulletCharacterControllerNode
+from panda3d.bullet import BulletBoxShape
 from panda3d.bullet import BulletPlaneShape
 from panda3d.bullet import BulletRigidBodyNode
 from panda3d.bullet import BulletSphereShape
 from panda3d.core import AmbientLight
+from panda3d.core import ClockObject
 from panda3d.core import Filename
+from panda3d.core import Mat3
 from panda3d.core import Point3
 from panda3d.core import PointLight
 from panda3d.core import VBase4
 from panda3d.core import Vec3
+from panda3d.core import composeMatrix
 
 from src import graphics # TODO[#2]
 from src import physics  # TODO[#2]
 
 from src.entities.panel import Floor
 from src.entities.panel import Wall
+from src.graphics import getPlayerHeadPos
 from src.graphics import getPlayerHeadingPitch
 from src.graphics import getRelativePlayerHeadVector
+from src.graphics import toggleSmileyFrowney
+from src.hitscan import addHitCallback
+from src.kinematic import KinematicController
+from src.kinematic import stepAllControllers
 from src.logconfig import newLogger
 from src.physics import COLLIDE_MASK_BULLET
+from src.physics import COLLIDE_MASK_ENTITY
 from src.physics import COLLIDE_MASK_GROUND_PLANE
 from src.physics import COLLIDE_MASK_PLAYER
 from src.physics import COLLIDE_MASK_SCENERY
+from src.shapes import getModelShapes
+from src.shadows import addDynamicCaster
+from src.shadows import setShadowLight
+from src.simlod import manageBody
+from src.snapshot import registerBodyKind
+from src.snapshot import trackBody
+from src.streaming import addStaticPiece
+from src.streaming import updateStreaming
+from src.triggers import Trigger
 from src.world_config import PLAYER_HEIGHT
 
 MIN_X =  -8
@@ -31,10 +50,42 @@ MAX_X =   8
 MIN_Y = -14
 MAX_Y =  14
 
+# Bullets are removed once they have existed for this many seconds, or once
+# there are more than MAX_LIVE_BULLETS of them (oldest first), whichever comes
+# first. Without this they would pile up for the rest of the session.
+BULLET_LIFETIME  = 10.0
+MAX_LIVE_BULLETS = 200
+
+BULLET_CREATOR = "world.makeBullet"
+
+# Anything that falls this far below the floor is out of the game: the player
+# is put back at the spawn point and anything else is removed. The kill zone
+# extends this far past the walls on every side.
+KILL_ZONE_TOP    = -0.5
+KILL_ZONE_MARGIN =  2.0
+
+# Whether to have a kill zone at all. Tools that measure how often things get
+# through the floor (like sweep.py) turn it off, since it hides exactly that.
+KILL_ZONE_ENABLED = True
+
+PLAYER_SPAWN_POS = Point3(0, 0, 1)
+
+# Kinds of bodies, for snapshot.py.
+BODY_KIND_BULLET = 1
+
 log = newLogger(__name__)
 
 app = None
 
+playerController = None
+
+# Deque of (creationTime, bulletNP), oldest first.
+liveBullets = collections.deque()
+
+# Maps NodePath.getKey() of a body -> function to call (with no arguments)
+# when that body falls into the kill zone. Bodies without one are removed.
+fallHandlers = {}
+
 
 def initWorld(app_):
     """
@@ -59,26 +110,27 @@ def initWorld(app_):
     # point lighting
     pointLight = PointLight("pointLight")
     pointLight.setColor(VBase4(0.8, 0.8, 0.8, 1))
-    # Use a 512 x 512 resolution shadow map
-    pointLight.setShadowCaster(True, 512, 512)
     pointLightNP = app.render.attachNewNode(pointLight)
     pointLightNP.setPos(0,0,30)
     app.render.setLight(pointLightNP)
+    # Use a 512 x 512 resolution shadow map. (quality.py lowers this when
+    # frames are taking too long.)
+    setShadowLight(pointLightNP, 512)
 
-    # Define the floor and walls.
-    # TODO: Keep track of these objects?
-
-    Floor(app, Point3(MIN_X, MIN_Y, 0), (0, 0, 0),
-          (MAX_X - MIN_X), (MAX_Y - MIN_Y))
+    # Define the floor and walls. These are static scenery, so rather than
+    # creating them directly, hand them to the streaming module, which creates
+    # them when the player gets near.
+    addPanel(Floor, Point3(MIN_X, MIN_Y, 0), (0, 0, 0),
+             (MAX_X - MIN_X), (MAX_Y - MIN_Y))
 
     # North wall
-    Wall(app, Point3(MIN_X, MAX_Y, 0), (0, 90,   0), (MAX_X - MIN_X), 2)
+    addPanel(Wall, Point3(MIN_X, MAX_Y, 0), (0, 90,   0), (MAX_X - MIN_X), 2)
     # South wall
-    Wall(app, Point3(MAX_X, MIN_Y, 0), (0, 90, 180), (MAX_X - MIN_X), 2)
+    addPanel(Wall, Point3(MAX_X, MIN_Y, 0), (0, 90, 180), (MAX_X - MIN_X), 2)
     # West wall
-    Wall(app, Point3(MIN_X, MIN_Y, 0), (0, 90,  90), (MAX_Y - MIN_Y), 2)
+    addPanel(Wall, Point3(MIN_X, MIN_Y, 0), (0, 90,  90), (MAX_Y - MIN_Y), 2)
     # East wall
-    Wall(app, Point3(MAX_X, MAX_Y, 0), (0, 90, -90), (MAX_Y - MIN_Y), 2)
+    addPanel(Wall, Point3(MAX_X, MAX_Y, 0), (0, 90, -90), (MAX_Y - MIN_Y), 2)
 
     # TODO[bullet]: Factor out all the logic below that creates objects.
 
@@ -104,13 +156,14 @@ def initWorld(app_):
     groundNP = app.render.attachNewNode(groundNode)
     groundNP.setPos(0, 0, -1)
     groundNP.setCollideMask(COLLIDE_MASK_GROUND_PLANE)
-    physics.world.attachRigidBody(groundNode)
+    physics.attachBody(groundNP, "world.initWorld")
 
     # A floating spherical object which can be toggled between a smiley and
     # a frowney. Called the smiley for historical reasons.
-    smileyShape = BulletSphereShape(1.0)
+    graphics.smileyModel = loadExampleModel("smiley")
     smileyNode = BulletRigidBodyNode("Smiley")
-    smileyNode.addShape(smileyShape)
+    for shape, transform in getModelShapes("smiley", graphics.smileyModel):
+        smileyNode.addShape(shape, transform)
 
     graphics.smileyNP = app.render.attachNewNode(smileyNode)
     # Lift the smiley/frowney up a bit so that if the player runs into it,
@@ -119,42 +172,131 @@ def initWorld(app_):
     # underground. At this point it's just for historical reasons.
     graphics.smileyNP.setPos(-5, 10, 1.25)
     graphics.smileyNP.setCollideMask(COLLIDE_MASK_SCENERY)
-    physics.world.attachRigidBody(smileyNode)
+    physics.attachBody(graphics.smileyNP, "world.initWorld")
 
-    graphics.smileyModel = loadExampleModel("smiley")
     graphics.smileyModel.reparentTo(graphics.smileyNP)
+    addDynamicCaster(graphics.smileyNP, 2.0)
     graphics.frowneyModel = loadExampleModel("frowney")
+    addHitCallback(onHitscanHit)
 
+    # The player is a kinematic body: Bullet doesn't move it, but it still
+    # pushes other things around. We move it ourselves using a
+    # KinematicController.
     playerShape = BulletSphereShape(0.5 * PLAYER_HEIGHT)
-    # Second param is step_height.
-    player = BulletCharacterControllerNode(playerShape, 0.2, "Player")
-    player.setMaxSlope(45.0)
-    # The example code does this, but I don't think it has any effect? Seems
-    # like the player defaults to the world gravity if it's not otherwise
-    # specified.
-    # player.setGravity(9.81)
+    player = BulletRigidBodyNode("Player")
+    player.addShape(playerShape)
+    player.setKinematic(True)
 
     # TODO[#2][bullet]: Why does graphics own playerNP?!
     # TODO[#2]: Functions in graphics.py to set pos and hpr.
     # TODO[#2]: ...what about the physics code in control.py?
     graphics.playerNP = app.render.attachNewNode(player)
-    graphics.playerNP.setPos(0, 0, 1)
+    graphics.playerNP.setPos(PLAYER_SPAWN_POS)
     graphics.playerNP.setCollideMask(COLLIDE_MASK_PLAYER)
-    physics.world.attachCharacter(player)
+    physics.attachBody(graphics.playerNP, "world.initWorld")
+
+    global playerController
+    playerController = KinematicController(graphics.playerNP, playerShape,
+                                           stepHeight=0.2, maxSlope=45.0)
+    physics.addPreTickCallback(stepAllControllers)
+    # The controller moves the player during the tick, so the cached player
+    # transforms are stale once it's over.
+    physics.addPostTickCallback(graphics.onTickFinished)
+
     graphics.playerHeadNP = graphics.playerNP.attachNewNode("PlayerHead")
 
     # Put the player's head a little below the actual top of the player so
     # that if you're standing right under an object, the object is still
     # within your camera's viewing frustum.
     graphics.playerHeadNP.setPos(0, 0, 0.3 * PLAYER_HEIGHT)
-    app.camera.reparentTo(graphics.playerHeadNP)
-    # Move the camera's near plane closer than the default (1) so that when
-    # the player butts their head against a wall, they don't see through
-    # it. In general, this distance should be close enough that the near
-    # plane stays within the player's hitbox (even as the player's head
-    # rotates in place). For more on camera/lens geometry in Panda3D, see:
-    #     https://www.panda3d.org/manual/index.php/Lenses_and_Field_of_View
-    app.camLens.setNear(0.1)
+    # If we're running headless without any window, then there's no camera.
+    if app.camera is not None:
+        app.camera.reparentTo(graphics.playerHeadNP)
+    if app.camLens is not None:
+        # Move the camera's near plane closer than the default (1) so that when
+        # the player butts their head against a wall, they don't see through
+        # it. In general, this distance should be close enough that the near
+        # plane stays within the player's hitbox (even as the player's head
+        # rotates in place). For more on camera/lens geometry in Panda3D, see:
+        #     https://www.panda3d.org/manual/index.php/Lenses_and_Field_of_View
+        app.camLens.setNear(0.1)
+
+    if KILL_ZONE_ENABLED:
+        addKillZone()
+    setFallHandler(graphics.playerNP, respawnPlayer)
+
+    app.taskMgr.add(expireBulletsTask, "ExpireBullets")
+
+    # When restoring a snapshot, bring back bullets that have since been
+    # removed. The snapshot sets their actual position and velocity.
+    registerBodyKind(BODY_KIND_BULLET,
+                     lambda: makeBullet(Point3(0, 0, 0), 0, Vec3(0, 0, 0)))
+
+    # Load the scenery around the player right away, so that they have
+    # something to stand on for the first frame.
+    updateStreaming()
+
+
+def addPanel(panelClass, pos, hpr, width, height):
+    """
+    Register a panel (of class panelClass) as static scenery, to be created by
+    the streaming module when needed. The panel goes in every chunk it
+    overlaps.
+    """
+
+    # The panel's corners, in render's coordinate system. It spans (0, 0) to
+    # (width, height) in its own x,y-plane.
+    rotation = Mat3()
+    composeMatrix(rotation, Vec3(1, 1, 1), Vec3(*hpr))
+    corners = [pos + rotation.xform(Vec3(x, y, 0))
+               for x in (0, width) for y in (0, height)]
+
+    addStaticPiece(min(corner.getX() for corner in corners),
+                   min(corner.getY() for corner in corners),
+                   max(corner.getX() for corner in corners),
+                   max(corner.getY() for corner in corners),
+                   lambda: panelClass(app, pos, hpr, width, height,
+                                      attach=False))
+
+
+def addKillZone():
+    """
+    Add a trigger volume between the floor and the ground plane, to catch
+    anything that glitches through the floor.
+    """
+
+    # It only needs to reach down as far as the ground plane (z=-1), since
+    # that stops everything from falling any further.
+    halfExtents = Vec3(0.5 * (MAX_X - MIN_X) + KILL_ZONE_MARGIN,
+                       0.5 * (MAX_Y - MIN_Y) + KILL_ZONE_MARGIN,
+                       0.5 * (KILL_ZONE_TOP + 1))
+    center = Point3(0.5 * (MIN_X + MAX_X), 0.5 * (MIN_Y + MAX_Y),
+                    0.5 * (KILL_ZONE_TOP - 1))
+    Trigger("KillZone", BulletBoxShape(halfExtents), center,
+            COLLIDE_MASK_PLAYER | COLLIDE_MASK_ENTITY | COLLIDE_MASK_BULLET,
+            onEnter=onEnterKillZone)
+
+def setFallHandler(bodyNP, handler):
+    """
+    Call handler() when the body at bodyNP falls into the kill zone, instead
+    of removing the body. For bodies that something else owns and keeps using,
+    such as players.
+    """
+
+    fallHandlers[bodyNP.getKey()] = handler
+
+def onEnterKillZone(trigger, bodyNP): # pylint: disable=unused-argument
+    handler = fallHandlers.get(bodyNP.getKey())
+    if handler is not None:
+        handler()
+    else:
+        physics.removeBody(bodyNP)
+
+def respawnPlayer():
+    log.info("Player fell through the floor; respawning.")
+    graphics.playerNP.setPos(PLAYER_SPAWN_POS)
+    playerController.verticalVel = 0.0
+    graphics.invalidateTransformCache()
 
 
 def loadModel(modelName):
@@ -180,6 +322,28 @@ def loadExampleModel(modelName):
 
 
 def makePlayerBullet():
+    # Note: see
+    #     https://www.panda3d.org/manual/index.php/
+    #         Bullet_Continuous_Collision_Detection
+    # for an alternate strategy for aiming a bullet where the player is
+    # looking. The example code there uses base.camLens.extrude.
+    # TODO[bullet]: Actually track the player's velocity, add it to the
+    # bullet's velocity here.
+    playerVel = Vec3(0, 0, 0)
+    bulletVel = playerVel + getRelativePlayerHeadVector(Vec3(0, 30, 0))
+
+    playerHeading, _ = getPlayerHeadingPitch()
+    # Note: bullets do not collide with the player, which means we are able
+    # to create new bullets inside the player without issue.
+    return makeBullet(getPlayerHeadPos(), playerHeading, bulletVel)
+
+
+def makeBullet(pos, heading, velocity):
+    """
+    Create a bullet at pos (in render's coordinate system), moving with the
+    given velocity. Return its NodePath.
+    """
+
     radius = 0.02
     shape = BulletSphereShape(radius)
 
@@ -194,21 +358,19 @@ def makePlayerBullet():
 
     physicsNP = app.render.attachNewNode(node)
     physicsNP.setCollideMask(COLLIDE_MASK_BULLET)
-    physics.world.attachRigidBody(node)
+    physics.attachBody(physicsNP, BULLET_CREATOR)
+    manageBody(physicsNP)
+    trackBody(physicsNP, BODY_KIND_BULLET)
 
-    # Note: see
-    #     https://www.panda3d.org/manual/index.php/
-    #         Bullet_Continuous_Collision_Detection
-    # for an alternate strategy for aiming a bullet where the player is
-    # looking. The example code there uses base.camLens.extrude.
-    # TODO[bullet]: Actually track the player's velocity, add it to the
-    # bullet's velocity here.
-    playerVel = Vec3(0, 0, 0)
-    bulletVel = playerVel + getRelativePlayerHeadVector(Vec3(0, 30, 0))
+    liveBullets.append((ClockObject.getGlobalClock().getFrameTime(),
+                        physicsNP))
+    while len(liveBullets) > MAX_LIVE_BULLETS:
+        _, oldestNP = liveBullets.popleft()
+        physics.removeBody(oldestNP)
 
     # TODO: Also account for the player's angular velocity.
     # physicsNP.node().getPhysicsObject().setVelocity(playerVel + bulletVel)
-    node.setLinearVelocity(bulletVel)
+    node.setLinearVelocity(velocity)
 
     ball = app.loader.loadModel("smiley")
     ball.reparentTo(physicsNP)
@@ -216,10 +378,20 @@ def makePlayerBullet():
     # Intentionally don't set the pitch, because the balls can't roll and it
     # would look weird if they were all stuck at different arbitrary pitches.
     # TODO[bullet]: They should be able to roll now, so we should set this.
-    playerHeading, _ = getPlayerHeadingPitch()
-    physicsNP.setH(playerHeading)
-    # Note: bullets do not collide with the player, which means we are able
-    # to create new bullets inside the player without issue.
-    physicsNP.setPos(app.render.getRelativePoint(graphics.playerHeadNP,
-                                                 Point3(0, 0, 0)))
+    physicsNP.setH(heading)
+    physicsNP.setPos(pos)
+    addDynamicCaster(physicsNP, 2 * radius)
+    return physicsNP
+
+
+def onHitscanHit(hit):
+    if hit.hitNP.getKey() == graphics.smileyNP.getKey():
+        toggleSmileyFrowney()
+
 
+def expireBulletsTask(task):
+    now = ClockObject.getGlobalClock().getFrameTime()
+    while liveBullets and now - liveBullets[0][0] > BULLET_LIFETIME:
+        _, bulletNP = liveBullets.popleft()
+        physics.removeBody(bulletNP)
+    return task.cont
@@ -7,3 +7,22 @@ PLAYER_HEIGHT = 2.0
 # Magnitude.
 GRAVITY_ACCEL = 9.81
 
+
+# Static scenery is divided into square chunks of this size (in the x,y-plane),
+# which are streamed in and out depending on where the player is. See
+# streaming.py.
+CHUNK_SIZE = 16.0
+
+# Distances, in chunks, from the chunk containing the player. Chunks within
+# CHUNK_PREFETCH_RADIUS are built in the background; chunks within
+# CHUNK_ATTACH_RADIUS are added to the scene graph and physics world. The
+# larger DETACH and UNLOAD radii provide hysteresis, so that walking back and
+# forth across a chunk boundary doesn't repeatedly load and unload the same
+# chunks.
+CHUNK_ATTACH_RADIUS   = 1
+CHUNK_PREFETCH_RADIUS = 2
+CHUNK_DETACH_RADIUS   = 2
+CHUNK_UNLOAD_RADIUS   = 3
+
+# Maximum time to spend building chunks per frame, in seconds.
+CHUNK_BUILD_BUDGET = 0.002
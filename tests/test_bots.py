@@ -0,0 +1,32 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("panda3d")
+
+# pylint: disable=wrong-import-position
+from src import bots
+from src.bots import BEHAVIOUR_STRAFE
+from src.world import MAX_X
+from src.world import MIN_X
+# pylint: enable=wrong-import-position
+
+
+@pytest.mark.parametrize("x, heading", [(MAX_X - 0.5,   0.0),
+                                        (MAX_X - 0.5, 180.0),
+                                        (MIN_X + 0.5,   0.0),
+                                        (MIN_X + 0.5, 180.0)])
+def test_strafers_near_edge_head_back_in(monkeypatch, x, heading):
+    monkeypatch.setattr(bots, "behaviours", np.array([BEHAVIOUR_STRAFE]))
+    monkeypatch.setattr(bots, "wanderHeadings", np.zeros(1))
+    monkeypatch.setattr(bots, "strafeSigns", np.array([1.0]))
+    monkeypatch.setattr(bots, "fireCooldowns", np.zeros(1))
+    positions = np.array([[x, 0.0, 1.0]])
+    target = np.array([0.0, 10.0, 1.0])
+
+    # However many ticks they spend near the edge, they keep strafing the
+    # same way (toward the middle) rather than flipping back and forth.
+    for _ in range(3):
+        localVels, _, _, _ = bots.computeSteering(
+            positions, np.array([heading]), target, 1.0 / 60)
+        renderVelX = localVels[0, 0] * np.cos(np.radians(heading))
+        assert renderVelX * x < 0
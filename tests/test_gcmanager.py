@@ -0,0 +1,125 @@
+from src.gcmanager import FORCE_GEN0_FACTOR
+from src.gcmanager import FORCE_GEN2_FACTOR
+from src.gcmanager import GcManager
+
+
+class FakeGc(object):
+    def __init__(self):
+        self.counts = [0, 0, 0]
+        self.collected = []
+        self.enabled = True
+        self.callbacks = []
+
+    def disable(self):
+        self.enabled = False
+
+    def get_count(self):
+        return tuple(self.counts)
+
+    def get_threshold(self):
+        return (700, 10, 10)
+
+    def collect(self, generation):
+        # Like the real thing: survivors move up a generation, which counts
+        # as one collection of the younger generation for the next one up.
+        self.collected.append(generation)
+        for gen in range(generation + 1):
+            self.counts[gen] = 0
+        if generation < 2:
+            self.counts[generation + 1] += 1
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def makeManager():
+    fakeGc = FakeGc()
+    clock = FakeClock()
+    manager = GcManager(1.0 / 60, gcModule=fakeGc, clock=clock)
+    manager.install()
+    return manager, fakeGc, clock
+
+
+def test_install_disables_automatic_collection():
+    manager, fakeGc, _ = makeManager()
+    assert not fakeGc.enabled
+    assert manager.onGcEvent in fakeGc.callbacks
+
+
+def test_collects_only_when_due_and_time_allows():
+    manager, fakeGc, clock = makeManager()
+
+    manager.startFrame()
+    assert manager.collectInSpareTime() is None
+
+    fakeGc.counts = [700, 10, 0]
+    # Most of the frame is used up; only enough time for generation 0.
+    clock.now += 0.0150
+    assert manager.collectInSpareTime() == 0
+
+    fakeGc.counts = [700, 10, 0]
+    manager.startFrame()
+    assert manager.collectInSpareTime() == 1
+    assert fakeGc.collected == [0, 1]
+    assert [pause.frame for pause in manager.pauses] == [1, 2]
+
+
+def test_budget_counts_from_given_frame_start():
+    manager, fakeGc, clock = makeManager()
+    clock.now = 1.0
+    # The frame started a while before we heard about it, so there's only
+    # time left for generation 0.
+    manager.startFrame(clock.now - 0.0150)
+    fakeGc.counts = [700, 10, 0]
+    assert manager.collectInSpareTime() == 0
+
+
+def test_never_collects_gen2_in_spare_time():
+    manager, fakeGc, _ = makeManager()
+    manager.startFrame()
+    fakeGc.counts = [0, 10, 10]
+    # Plenty of time for a full collection, but only a young one happens.
+    manager.pauseEstimates[2] = 0.0
+    assert manager.collectInSpareTime() == 1
+    assert fakeGc.collected == [1]
+
+
+def test_forces_gen0_when_never_time():
+    manager, fakeGc, clock = makeManager()
+    manager.startFrame()
+    clock.now += 1.0
+    fakeGc.counts = [700, 0, 0]
+    assert manager.collectInSpareTime() is None
+    fakeGc.counts = [FORCE_GEN0_FACTOR * 700, 0, 0]
+    assert manager.collectInSpareTime() == 0
+    assert manager.pauses[-1].reason == "forced"
+
+
+def test_records_external_collections():
+    manager, _, clock = makeManager()
+    manager.onGcEvent("start", {"generation": 2})
+    clock.now += 0.005
+    manager.onGcEvent("stop", {"generation": 2})
+    pause = manager.pauses[-1]
+    assert (pause.generation, pause.reason) == (2, "external")
+    assert abs(pause.seconds - 0.005) < 1e-9
+
+
+def test_gen2_collected_eventually():
+    manager, fakeGc, clock = makeManager()
+    # Every frame allocates enough to make generation 0 due, and always has
+    # time for young collections but never for a full one.
+    manager.pauseEstimates[2] = 1.0
+    for _ in range(2 * FORCE_GEN2_FACTOR * 10 * 11):
+        manager.startFrame()
+        fakeGc.counts[0] += 700
+        clock.now += 0.001
+        manager.collectInSpareTime()
+    assert 2 in fakeGc.collected
+    fullPauses = [pause for pause in manager.pauses if pause.generation == 2]
+    assert all(pause.reason == "forced" for pause in fullPauses)
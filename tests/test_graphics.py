@@ -0,0 +1,109 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("panda3d")
+
+# pylint: disable=wrong-import-position
+from panda3d.core import NodePath
+from panda3d.core import Point3
+from panda3d.core import Vec3
+
+from src import graphics
+from src import physics
+from src import snapshot
+from src.snapshot import HEADER_STRUCT
+from src.snapshot import PLAYER_STRUCT
+from src.snapshot import SNAPSHOT_MAGIC
+from src.snapshot import SNAPSHOT_TYPE_FULL
+from src.snapshot import SNAPSHOT_VERSION
+# pylint: enable=wrong-import-position
+
+
+class FakeApp(object):
+    def __init__(self):
+        self.render = NodePath("render")
+        # Like a headless app, which has no camera.
+        self.camera = None
+
+
+class FakeController(object):
+    def __init__(self):
+        self.verticalVel = 0.0
+        self.isGrounded  = True
+
+
+@pytest.fixture
+def player(monkeypatch):
+    app = FakeApp()
+    playerNP = app.render.attachNewNode("Player")
+    playerNP.setPos(1, 2, 3)
+    playerNP.setH(30)
+    headNP = playerNP.attachNewNode("PlayerHead")
+    headNP.setPos(0, 0, 0.6)
+    headNP.setP(-20)
+
+    monkeypatch.setattr(graphics, "app", app)
+    monkeypatch.setattr(graphics, "playerNP", playerNP)
+    monkeypatch.setattr(graphics, "playerHeadNP", headNP)
+    monkeypatch.setattr(graphics, "latestTick", 0)
+    monkeypatch.setattr(graphics, "transformCacheTick", None)
+    return app, playerNP, headNP
+
+
+def test_batched_head_vectors_match_panda(player):
+    app, _, headNP = player
+    vectors = np.array([[0, 1, 0], [1, 0, 0], [0, 0, 1], [0.3, -2, 5]])
+
+    converted = graphics.getRelativePlayerHeadVectors(vectors)
+
+    for vector, result in zip(vectors, converted):
+        expected = app.render.getRelativeVector(headNP, Vec3(*vector))
+        assert np.allclose(result, tuple(expected), atol=1e-5)
+        single = graphics.getRelativePlayerHeadVector(Vec3(*vector))
+        assert np.allclose(result, tuple(single), atol=1e-5)
+
+
+def assertHeadPosIs(pos):
+    assert graphics.getPlayerHeadPos().almostEqual(pos, 1e-5)
+
+
+def test_cache_refreshed_after_tick(player):
+    app, playerNP, headNP = player
+    assertHeadPosIs(headNP.getPos(app.render))
+
+    # Moving the player within a tick isn't seen until the tick is over.
+    playerNP.setPos(5, 5, 5)
+    assertHeadPosIs(Point3(1, 2, 3.6))
+    graphics.onTickFinished(1)
+    assertHeadPosIs(Point3(5, 5, 5.6))
+
+
+def test_cache_refreshed_after_turning(player):
+    app, _, headNP = player
+    graphics.getPlayerHeadForward()
+    graphics.changePlayerHeadingPitch(45, 10)
+    expected = app.render.getRelativeVector(headNP, Vec3(0, 1, 0))
+    assert graphics.getPlayerHeadForward().almostEqual(expected, 1e-5)
+    assert graphics.getPlayerHeadingPitch() == (pytest.approx(75),
+                                                pytest.approx(-10))
+
+
+def test_cache_refreshed_after_snapshot_restore(player, monkeypatch):
+    app, _, headNP = player
+    monkeypatch.setattr(snapshot, "app", app)
+    monkeypatch.setattr(snapshot, "playerController", FakeController())
+    monkeypatch.setattr(snapshot, "trackedBodies", {})
+    monkeypatch.setattr(graphics, "smileyIsFrowney", False)
+    monkeypatch.setattr(physics, "tickCount", 0)
+    graphics.getPlayerHeadPos()
+
+    data = (HEADER_STRUCT.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION,
+                               SNAPSHOT_TYPE_FULL, 7, 0, 0, 0) +
+            PLAYER_STRUCT.pack(-4, 6, 2, 90, 0, 0, 1, 0, 0, 0, 0, 0))
+    snapshot.restoreSnapshot(data)
+
+    assertHeadPosIs(Point3(-4, 6, 2.6))
+    assert graphics.getPlayerHeadingPitch() == (
+        pytest.approx(90), pytest.approx(0))
+    assert graphics.getPlayerHeadForward().almostEqual(
+        app.render.getRelativeVector(headNP, Vec3(0, 1, 0)), 1e-5)
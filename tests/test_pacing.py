@@ -0,0 +1,63 @@
+from src.pacing import FramePacer
+
+
+# Each time the fake clock is read, it advances by this much, so that the pacer
+# can spin on it.
+CLOCK_TICK = 1e-5
+TOLERANCE  = 2 * CLOCK_TICK
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 100.0
+        self.sleeps = []
+
+    def clock(self):
+        self.now += CLOCK_TICK
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def makePacer(fakeClock):
+    return FramePacer(50.0, 10.0, clock=fakeClock.clock,
+                      sleep=fakeClock.sleep)
+
+
+def test_even_intervals_despite_uneven_work():
+    fakeClock = FakeClock()
+    pacer = makePacer(fakeClock)
+    pacer.waitForNextFrame()
+    for workTime in [0.001, 0.015, 0.005, 0.019, 0.0]:
+        fakeClock.now += workTime
+        pacer.waitForNextFrame()
+
+    stats = pacer.getJitterStats()
+    assert abs(stats.meanMs - 20.0) < 1000 * TOLERANCE
+    assert stats.maxDeviationMs < 1000 * TOLERANCE
+
+
+def test_idle_uses_lower_rate():
+    fakeClock = FakeClock()
+    pacer = makePacer(fakeClock)
+    pacer.waitForNextFrame()
+    pacer.setIdle(True)
+    startTime = fakeClock.now
+    pacer.waitForNextFrame()
+    assert abs((fakeClock.now - startTime) - 0.1) < TOLERANCE
+
+
+def test_slow_frame_does_not_cause_burst():
+    fakeClock = FakeClock()
+    pacer = makePacer(fakeClock)
+    pacer.waitForNextFrame()
+    # One frame takes far longer than the target interval...
+    fakeClock.now += 0.2
+    pacer.waitForNextFrame()
+    # ...and the next one should still get a full interval, rather than
+    # several zero-length frames to catch up.
+    startTime = fakeClock.now
+    pacer.waitForNextFrame()
+    assert abs((fakeClock.now - startTime) - 0.02) < TOLERANCE
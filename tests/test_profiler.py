@@ -0,0 +1,41 @@
+import json
+import threading
+import time
+
+from src import profiler
+from src.profiler import Sampler
+
+
+def busyTask(task):  # pylint: disable=unused-argument
+    endTime = time.time() + 0.1
+    while time.time() < endTime:
+        spin()
+
+def spin():
+    sum(range(100))
+
+
+def test_samples_are_tagged_with_task():
+    sampler = Sampler(threading.current_thread().ident, 0.001, 1000)
+    sampler.frameNumber = 7
+    sampler.start()
+    try:
+        busyTask(None)
+    finally:
+        sampler.stop()
+
+    samples = list(sampler.recentSamples)
+    assert samples
+    assert all(sample.frameNumber == 7 for sample in samples)
+
+    collapsed = profiler.formatCollapsed(samples)
+    assert "task busyTask;" in collapsed
+    assert "spin (test_profiler.py:" in collapsed
+
+    speedscope = profiler.makeSpeedscope("test", samples)
+    # Make sure it survives a round trip through JSON.
+    speedscope = json.loads(json.dumps(speedscope))
+    frameNames = [frame["name"] for frame in speedscope["shared"]["frames"]]
+    assert "frame 7" in frameNames
+    profile = speedscope["profiles"][0]
+    assert len(profile["samples"]) == len(profile["weights"]) == len(samples)
@@ -0,0 +1,65 @@
+from src.quality import FAILED_UP_FRAMES
+from src.quality import QualityGovernor
+from src.quality import UP_COOLDOWN_FRAMES
+from src.quality import WINDOW_FRAMES
+
+TARGET = 1.0 / 60
+
+
+def runTrace(governor, frameTimes):
+    """
+    Feed frameTimes to governor; return a list of (frameIndex, newTier) for
+    every tier change.
+    """
+
+    changes = []
+    for i, frameTime in enumerate(frameTimes):
+        newTier = governor.addFrameTime(frameTime)
+        if newTier is not None:
+            changes.append((i, newTier))
+    return changes
+
+
+def test_steady_on_target_never_changes():
+    governor = QualityGovernor(TARGET)
+    assert runTrace(governor, [0.8 * TARGET] * 5000) == []
+
+
+def test_occasional_spikes_are_ignored():
+    # Under 5% of frames are slow, so the p95 is still fine.
+    trace = [0.8 * TARGET if i % 50 else 3 * TARGET for i in range(5000)]
+    assert runTrace(QualityGovernor(TARGET), trace) == []
+
+
+def test_steps_down_one_tier_per_window():
+    governor = QualityGovernor(TARGET)
+    changes = runTrace(governor, [2 * TARGET] * (10 * WINDOW_FRAMES))
+    assert changes == [(WINDOW_FRAMES - 1, 1),
+                       (2 * WINDOW_FRAMES - 1, 2),
+                       (3 * WINDOW_FRAMES - 1, 3)]
+
+
+def test_steps_up_after_cooldown():
+    governor = QualityGovernor(TARGET, startTier=2)
+    changes = runTrace(governor, [0.3 * TARGET] * (3 * UP_COOLDOWN_FRAMES))
+    assert [tier for _, tier in changes] == [1, 0]
+    assert changes[0][0] == UP_COOLDOWN_FRAMES - 1
+
+
+def test_failed_step_up_backs_off():
+    governor = QualityGovernor(TARGET, startTier=1)
+    # Tier 0 is too slow, tier 1 has lots of headroom. We should try tier 0,
+    # fail, and then wait twice as long before trying again.
+    changes = []
+    for i in range(6 * UP_COOLDOWN_FRAMES):
+        frameTime = 2 * TARGET if governor.tier == 0 else 0.3 * TARGET
+        newTier = governor.addFrameTime(frameTime)
+        if newTier is not None:
+            changes.append((i, newTier))
+
+    upFrames = [i for i, tier in changes if tier == 0]
+    assert len(upFrames) >= 2
+    downAfterFirstUp = [i for i, tier in changes
+                        if tier == 1 and i > upFrames[0]][0]
+    assert downAfterFirstUp - upFrames[0] < FAILED_UP_FRAMES
+    assert upFrames[1] - downAfterFirstUp >= 2 * UP_COOLDOWN_FRAMES
@@ -0,0 +1,25 @@
+from src import resources
+from src.resources import KIND_NODEPATH
+from src.resources import KIND_RIGID_BODY
+from src.resources import KIND_SHAPE
+
+
+def test_counts_by_creator():
+    resources.noteBodyCreated("test.a", numShapes=2)
+    resources.noteBodyCreated("test.a", numShapes=2)
+    resources.noteBodyCreated("test.b")
+    resources.noteBodyDestroyed("test.a", numShapes=2)
+
+    assert resources.getLiveCount(KIND_NODEPATH,   "test.a") == 1
+    assert resources.getLiveCount(KIND_RIGID_BODY, "test.b") == 1
+    assert resources.getLiveCount(KIND_SHAPE,      "test.a") == 2
+    assert resources.totalCreated[(KIND_NODEPATH, "test.a")] == 2
+
+
+def test_overrelease_does_not_go_negative():
+    resources.noteDestroyed(KIND_SHAPE, "test.c")
+    assert resources.getLiveCount(KIND_SHAPE, "test.c") == 0
+
+
+def test_rss_is_positive():
+    assert resources.getRssBytes() > 0
@@ -0,0 +1,32 @@
+from src.shadow_scheduler import ShadowScheduler
+
+
+def runFrames(scheduler, numFrames):
+    return [scheduler.startFrame() for _ in range(numFrames)]
+
+
+def test_renders_once_then_only_when_dirty():
+    scheduler = ShadowScheduler(updateInterval=1)
+    assert runFrames(scheduler, 3) == [True, False, False]
+
+    scheduler.markStaticDirty()
+    assert runFrames(scheduler, 2) == [True, False]
+
+
+def test_moving_casters_are_throttled():
+    scheduler = ShadowScheduler(updateInterval=3)
+    runFrames(scheduler, 1)
+
+    renders = []
+    for _ in range(9):
+        scheduler.markDynamicDirty()
+        renders.append(scheduler.startFrame())
+    assert renders == [False, False, True, False, False, True, False, False,
+                       True]
+
+
+def test_static_changes_are_not_throttled():
+    scheduler = ShadowScheduler(updateInterval=4)
+    runFrames(scheduler, 1)
+    scheduler.markStaticDirty()
+    assert scheduler.startFrame()
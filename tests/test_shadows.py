@@ -0,0 +1,104 @@
+import pytest
+
+pytest.importorskip("panda3d")
+
+# pylint: disable=wrong-import-position
+from panda3d.core import CardMaker
+from panda3d.core import PNMImage
+from panda3d.core import Point2
+from panda3d.core import Point3
+from panda3d.core import PointLight
+from panda3d.core import loadPrcFileData
+
+from src import shadows
+from src import streaming
+from src import telemetry
+# pylint: enable=wrong-import-position
+
+SHADOWED_POINT = Point3(0, 0, 0)
+LIT_POINT      = Point3(4, 0, 0)
+
+
+@pytest.fixture
+def app():
+    from direct.showbase.ShowBase import ShowBase
+
+    loadPrcFileData("", "window-type offscreen")
+    loadPrcFileData("", "audio-library-name null")
+    try:
+        base = ShowBase()
+    except Exception: # pylint: disable=broad-except
+        pytest.skip("Can't open an offscreen buffer here.")
+    gsg = base.win.getGsg() if base.win is not None else None
+    if gsg is None or not gsg.getSupportsBasicShaders():
+        base.destroy()
+        pytest.skip("No shader support here, so no shadows.")
+    yield base
+    base.destroy()
+
+
+def makeScene(app):
+    """
+    A floor, lit by a point light 10 m above it, with a 2 x 2 m card halfway
+    between them casting a shadow around the origin.
+    """
+
+    floorMaker = CardMaker("Floor")
+    floorMaker.setFrame(-10, 10, -10, 10)
+    floorNP = app.render.attachNewNode(floorMaker.generate())
+    floorNP.setP(-90)
+
+    casterMaker = CardMaker("Caster")
+    casterMaker.setFrame(-1, 1, -1, 1)
+    casterNP = app.render.attachNewNode(casterMaker.generate())
+    casterNP.setP(-90)
+    casterNP.setZ(5)
+
+    lightNP = app.render.attachNewNode(PointLight("Light"))
+    lightNP.setPos(0, 0, 10)
+    app.render.setLight(lightNP)
+    app.render.setShaderAuto()
+
+    # Looking down at the floor from the side, so the caster doesn't hide
+    # the shadow.
+    app.cam.setPos(0, -15, 15)
+    app.cam.lookAt(SHADOWED_POINT)
+    return lightNP
+
+
+def getBrightness(app, point):
+    screenshot = PNMImage()
+    assert app.win.getScreenshot(screenshot)
+    projected = Point2()
+    assert app.camLens.project(app.cam.getRelativePoint(app.render, point),
+                               projected)
+    x = int((projected.getX() + 1) / 2 * (screenshot.getXSize() - 1))
+    y = int((1 - projected.getY()) / 2 * (screenshot.getYSize() - 1))
+    return screenshot.getBright(x, y)
+
+
+def test_shadow_survives_frames_that_skip_rendering(app, monkeypatch):
+    monkeypatch.setattr(shadows, "shadowSize", 0)
+    monkeypatch.setattr(shadows, "shadowBuffer", None)
+    monkeypatch.setattr(shadows, "dynamicCasters", [])
+    monkeypatch.setattr(streaming, "sceneryChangedCallbacks", [])
+    shadows.initShadows(app)
+    shadows.setShadowLight(makeScene(app), 256)
+
+    for _ in range(4):
+        app.taskMgr.step()
+    assert shadows.shadowBuffer is not None
+    shadowed = getBrightness(app, SHADOWED_POINT)
+    lit      = getBrightness(app, LIT_POINT)
+    assert shadowed < 0.5 * lit
+
+    # Nothing changes from here on, so the shadow map isn't rendered again,
+    # but the shadow is still there.
+    rendersBefore = telemetry.counters.get("shadows.renders", 0)
+    for _ in range(5):
+        app.taskMgr.step()
+    assert telemetry.counters.get("shadows.renders", 0) == rendersBefore
+    assert not shadows.shadowBuffer.isActive()
+    assert getBrightness(app, SHADOWED_POINT) == pytest.approx(shadowed,
+                                                               abs=0.05)
+    assert getBrightness(app, LIT_POINT) == pytest.approx(lit, abs=0.05)
@@ -0,0 +1,86 @@
+import itertools
+
+import numpy as np
+import pytest
+
+pytest.importorskip("panda3d")
+
+from src.shapes import SHAPE_BOX      # pylint: disable=wrong-import-position
+from src.shapes import SHAPE_CAPSULE  # pylint: disable=wrong-import-position
+from src.shapes import SHAPE_SPHERE   # pylint: disable=wrong-import-position
+from src.shapes import fitModelShapes # pylint: disable=wrong-import-position
+from src.shapes import fitPrimitive   # pylint: disable=wrong-import-position
+from src.shapes import getMeshVolume  # pylint: disable=wrong-import-position
+
+
+def spherePoints(radius, center=(0, 0, 0)):
+    rng = np.random.RandomState(0)
+    directions = rng.normal(size=(500, 3))
+    directions /= np.linalg.norm(directions, axis=1)[:, np.newaxis]
+    return np.array(center) + radius * directions
+
+
+def test_mesh_volume():
+    # A tetrahedron with three edges along the axes, away from the origin.
+    points = np.array([[0, 0, 0], [1, 0, 0], [0, 2, 0], [0, 0, 3]]) + 5.0
+    triangles = np.array([[0, 2, 1], [0, 1, 3], [0, 3, 2], [1, 2, 3]])
+    assert getMeshVolume(points, triangles) == pytest.approx(1.0)
+
+
+def test_box_fits_a_box_not_a_sphere():
+    # The corners of a box lie on a sphere too, but the sphere has much more
+    # volume than the mesh.
+    corners = np.array(list(itertools.product([-1, 1], [2, 4], [0, 1])))
+    kind, center, halfExtents, _ = fitPrimitive(corners, 4.0)
+    assert kind == SHAPE_BOX
+    assert np.allclose(center, (0, 3, 0.5))
+    assert np.allclose(halfExtents, (1, 1, 0.5))
+
+
+def test_sphere_fits_a_sphere():
+    kind, center, radius, _ = fitPrimitive(spherePoints(2.0, (1, 1, 1)),
+                                           4.0 / 3.0 * np.pi * 2.0 ** 3)
+    assert kind == SHAPE_SPHERE
+    assert np.allclose(center, (1, 1, 1), atol=0.05)
+    assert radius == pytest.approx(2.0, abs=0.05)
+
+
+def test_stretched_sphere_fits_a_capsule():
+    # Two half-spheres joined by a cylinder of length 4 along y.
+    points = spherePoints(0.5)
+    points[:, 1] += np.where(points[:, 1] >= 0, 2.0, -2.0)
+    volume = np.pi * 0.5 ** 2 * (4.0 + 4.0 / 3.0 * 0.5)
+    kind, _, (radius, halfHeight, axis), _ = fitPrimitive(points, volume)
+    assert kind == SHAPE_CAPSULE
+    assert axis == 1
+    assert radius == pytest.approx(0.5, abs=0.01)
+    assert halfHeight == pytest.approx(2.0, abs=0.05)
+
+
+def test_cone_fits_nothing():
+    # Every vertex of a cone lies on the surface of its bounding box, but the
+    # box has nearly four times the volume.
+    angles = np.linspace(0, 2 * np.pi, 32, endpoint=False)
+    base = np.stack([np.cos(angles), np.sin(angles), np.zeros(32)], axis=1)
+    points = np.concatenate([base, [[0, 0, 3]]])
+    assert fitPrimitive(points, np.pi) is None
+
+
+def test_open_mesh_fits_nothing():
+    corners = np.array([[0, 0, 0], [1, 0, 0], [1, 1, 0], [0, 1, 0]])
+    triangles = np.array([[0, 1, 2], [0, 2, 3]])
+    assert fitPrimitive(corners, getMeshVolume(corners, triangles)) is None
+
+
+def test_smiley_model_gets_a_sphere():
+    from panda3d.bullet import BulletSphereShape
+    from panda3d.core import Filename
+    from panda3d.core import Loader
+    from panda3d.core import NodePath
+
+    modelNode = Loader.getGlobalPtr().loadSync(Filename("smiley"))
+    if modelNode is None:
+        pytest.skip("The smiley model isn't on the model path.")
+    shapes = fitModelShapes(NodePath(modelNode))
+    assert len(shapes) == 1
+    assert isinstance(shapes[0][0], BulletSphereShape)
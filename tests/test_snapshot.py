@@ -0,0 +1,112 @@
+import pytest
+
+pytest.importorskip("panda3d")
+
+# pylint: disable=wrong-import-position
+from src import physics
+from src import snapshot
+from src.snapshot import BODY_STRUCT
+from src.snapshot import HEADER_STRUCT
+from src.snapshot import PLAYER_STRUCT
+from src.snapshot import SNAPSHOT_MAGIC
+from src.snapshot import SNAPSHOT_TYPE_FULL
+from src.snapshot import SNAPSHOT_VERSION
+from src.snapshot import SnapshotHistory
+from src.snapshot import applyDelta
+from src.snapshot import makeDelta
+# pylint: enable=wrong-import-position
+
+
+def makeSnapshot(tick, bodies, moveX=0.0):
+    """
+    Return a full snapshot for tick, with a player whose recorded input has
+    the given x movement, and bodies given as a dict of snapshot ID -> x
+    position.
+    """
+
+    records = [BODY_STRUCT.pack(snapshotId, 1, x, 0, 0, 1, 0, 0, 0,
+                                0, 0, 0, 0, 0, 0)
+               for snapshotId, x in sorted(bodies.items())]
+    return b"".join(
+        [HEADER_STRUCT.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION,
+                            SNAPSHOT_TYPE_FULL, tick, 0, len(records), 0),
+         PLAYER_STRUCT.pack(0, 0, 0, 0, 0, 0, 1, 0, moveX, 0, 0, 0)] +
+        records)
+
+
+def test_delta_round_trip():
+    base = makeSnapshot(10, {1: 0.0, 2: 5.0, 3: 7.0})
+    data = makeSnapshot(12, {1: 0.0, 2: 6.0, 4: 1.0}, moveX=3.0)
+
+    delta = makeDelta(base, data)
+    # Only the changed body (2) and the new one (4) are stored.
+    assert len(delta) < len(data)
+    assert applyDelta(base, delta) == data
+
+    with pytest.raises(ValueError):
+        applyDelta(data, delta)
+
+
+def test_history_trims_to_length_and_rewinds():
+    history = SnapshotHistory(length=5, keyframeInterval=3)
+    for tick in range(1, 11):
+        history.add(makeSnapshot(tick, {1: float(tick)}))
+    assert history.getTicks() == [6, 7, 8, 9, 10]
+    for tick in range(6, 11):
+        assert history.getFull(tick) == makeSnapshot(tick, {1: float(tick)})
+    assert history.getFull(5) is None
+    # Keyframes that no remaining entry needs are dropped.
+    assert min(history.keyframes) >= 4
+
+    # Going back in time drops everything from that tick on.
+    history.add(makeSnapshot(8, {1: -1.0}))
+    assert history.getTicks() == [6, 7, 8]
+    assert history.getFull(8) == makeSnapshot(8, {1: -1.0})
+
+
+class FakeController(object):
+    def __init__(self):
+        from panda3d.core import Vec3
+        self.linearMovement = Vec3(0, 0, 0)
+        self.angularMovement = 0.0
+        self.jumps = []
+
+    def setLinearMovement(self, velocity):
+        self.linearMovement = velocity
+
+    def setAngularMovement(self, degreesPerSecond):
+        self.angularMovement = degreesPerSecond
+
+    def doJump(self, jumpSpeed):
+        self.jumps.append(jumpSpeed)
+
+
+def test_rollback_replays_recorded_input_every_tick(monkeypatch):
+    history = SnapshotHistory(length=20, keyframeInterval=4)
+    controller = FakeController()
+    monkeypatch.setattr(snapshot, "history", history)
+    monkeypatch.setattr(snapshot, "playerController", controller)
+    monkeypatch.setattr(snapshot, "restoreSnapshot",
+                        lambda data: setattr(
+                            physics, "tickCount",
+                            HEADER_STRUCT.unpack_from(data, 0)[3]))
+
+    # The input for tick N had an x movement of N.
+    for tick in range(1, 11):
+        history.add(makeSnapshot(tick, {}, moveX=float(tick)))
+    monkeypatch.setattr(physics, "tickCount", 10)
+
+    replayed = []
+    def doPhysicsOneTick():
+        # Like the real tick, this records a new snapshot for the tick, as
+        # recordTick does.
+        physics.tickCount += 1
+        moveX = controller.linearMovement.getX()
+        replayed.append((physics.tickCount, moveX))
+        history.add(makeSnapshot(physics.tickCount, {}, moveX=moveX))
+    monkeypatch.setattr(physics, "doPhysicsOneTick", doPhysicsOneTick)
+
+    assert snapshot.rollback(5)
+    assert replayed == [(tick, float(tick)) for tick in range(6, 11)]
+    assert physics.tickCount == 10
+    assert not snapshot.rollback(100)
@@ -0,0 +1,20 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+pytest.importorskip("panda3d")
+
+# The soak test is meant to run for a long time, but that's too slow for every
+# test run. Set SMUSH_SOAK_SECONDS to run it for longer.
+SOAK_SECONDS = os.environ.get("SMUSH_SOAK_SECONDS", "10")
+
+
+def test_soak():
+    # Panda3D only allows one ShowBase per process, so run the soak test in its
+    # own interpreter.
+    repoDir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    status = subprocess.call([sys.executable, "-m", "src.soak",
+                              "--duration", SOAK_SECONDS], cwd=repoDir)
+    assert status == 0
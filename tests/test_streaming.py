@@ -0,0 +1,55 @@
+import pytest
+
+pytest.importorskip("panda3d")
+
+# pylint: disable=wrong-import-position
+from src import streaming
+from src.world_config import CHUNK_SIZE
+# pylint: enable=wrong-import-position
+
+
+class FakePiece(object):
+    def __init__(self, log):
+        self.log = log
+        log.append("build")
+
+    def attach(self):
+        self.log.append("attach")
+
+    def detach(self):
+        self.log.append("detach")
+
+    def destroy(self):
+        self.log.append("destroy")
+
+
+def test_large_piece_shared_between_chunks(monkeypatch):
+    monkeypatch.setattr(streaming, "chunks", {})
+    monkeypatch.setattr(streaming, "sceneryChangedCallbacks", [])
+    log = []
+    # Spans chunks (0, 0) and (1, 0).
+    streaming.addStaticPiece(0.5 * CHUNK_SIZE, 0, 1.5 * CHUNK_SIZE, 1,
+                             lambda: FakePiece(log))
+    left  = streaming.chunks[(0, 0)]
+    right = streaming.chunks[(1, 0)]
+    assert sorted(streaming.chunks) == [(0, 0), (1, 0)]
+
+    left.buildSome(deadline=None)
+    right.buildSome(deadline=None)
+    left.attach()
+    right.attach()
+    assert log == ["build", "attach"]
+
+    # Still needed by the right chunk, so it stays.
+    left.detach()
+    left.unload()
+    assert log == ["build", "attach"]
+
+    right.detach()
+    assert log == ["build", "attach", "detach"]
+    right.unload()
+    assert log == ["build", "attach", "detach", "destroy"]
+
+    # Loading either chunk again builds it afresh.
+    right.buildSome(deadline=None)
+    assert log[-1] == "build"
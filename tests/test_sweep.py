@@ -0,0 +1,17 @@
+from src.sweep import makeJobs
+from src.sweep import parseParam
+
+
+def test_parse_param():
+    assert parseParam("GRAVITY_ACCEL=9.81,20") == ("GRAVITY_ACCEL",
+                                                   [9.81, 20])
+
+
+def test_jobs_cover_every_combination():
+    jobs = makeJobs([("A", [1, 2]), ("B", [3, 4, 5])], ["stand", "walk"], 10)
+    assert len(jobs) == 2 * 3 * 2
+    assert ({"A": 2, "B": 4}, "walk", 10) in jobs
+
+
+def test_no_params_is_one_run_per_scenario():
+    assert makeJobs([], ["stand"], 10) == [({}, "stand", 10)]
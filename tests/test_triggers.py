@@ -0,0 +1,67 @@
+import pytest
+
+pytest.importorskip("panda3d")
+
+# pylint: disable=wrong-import-position
+from panda3d.bullet import BulletBoxShape
+from panda3d.bullet import BulletRigidBodyNode
+from panda3d.bullet import BulletSphereShape
+from panda3d.bullet import BulletWorld
+from panda3d.core import NodePath
+from panda3d.core import Point3
+from panda3d.core import Vec3
+
+from src import physics
+from src import triggers
+from src.physics import COLLIDE_MASK_BULLET
+from src.physics import COLLIDE_MASK_PLAYER
+from src.triggers import Trigger
+# pylint: enable=wrong-import-position
+
+
+def test_trigger_reports_only_changes(monkeypatch):
+    monkeypatch.setattr(physics, "world", BulletWorld())
+    monkeypatch.setattr(triggers, "allTriggers", [])
+    render = NodePath("render")
+
+    events = []
+    trigger = Trigger("Test", BulletBoxShape(Vec3(1, 1, 1)), Point3(0, 0, 0),
+                      COLLIDE_MASK_PLAYER,
+                      onEnter=lambda _, np: events.append(("enter", np)),
+                      onExit=lambda _, np: events.append(("exit", np)),
+                      parent=render)
+
+    body = BulletRigidBodyNode("Body")
+    body.addShape(BulletSphereShape(0.25))
+    body.setKinematic(True)
+    bodyNP = render.attachNewNode(body)
+    bodyNP.setPos(5, 0, 0)
+    bodyNP.setCollideMask(COLLIDE_MASK_PLAYER)
+    physics.world.attachRigidBody(body)
+
+    def step():
+        physics.world.doPhysics(physics.TICK_DT, 1, physics.TICK_DT)
+        return trigger.update()
+
+    assert not step()
+    assert events == []
+
+    bodyNP.setPos(0, 0, 0)
+    step()
+    step()
+    assert [kind for kind, _ in events] == ["enter"]
+    assert events[0][1].getKey() == bodyNP.getKey()
+
+    bodyNP.setPos(5, 0, 0)
+    step()
+    assert [kind for kind, _ in events] == ["enter", "exit"]
+    assert not step()
+
+    # Objects outside the trigger's mask are ignored.
+    bodyNP.setCollideMask(COLLIDE_MASK_BULLET)
+    bodyNP.setPos(0, 0, 0)
+    step()
+    assert len(events) == 2
+
+    trigger.destroy()
+    assert triggers.allTriggers == []
@@ -0,0 +1,26 @@
+from src.utils import RingBuffer
+
+
+def test_ring_buffer_overwrites_oldest():
+    ring = RingBuffer(3)
+    assert [ring.push() for _ in range(3)] == [0, 1, 2]
+    assert ring.liveRanges() == [(0, 3)]
+
+    # Full; the next two entries replace the two oldest.
+    assert [ring.push() for _ in range(2)] == [0, 1]
+    assert ring.count == 3
+    assert ring.oldest() == 2
+    assert ring.liveRanges() == [(2, 1), (0, 2)]
+
+
+def test_ring_buffer_pop_oldest():
+    ring = RingBuffer(4)
+    for _ in range(6):
+        ring.push()
+    assert ring.popOldest() == 2
+    assert ring.popOldest() == 3
+    assert ring.liveRanges() == [(0, 2)]
+    ring.popOldest()
+    ring.popOldest()
+    assert ring.count == 0
+    assert ring.liveRanges() == []
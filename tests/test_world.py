@@ -0,0 +1,67 @@
+import pytest
+
+pytest.importorskip("panda3d")
+
+# pylint: disable=wrong-import-position
+from panda3d.core import NodePath
+from panda3d.core import Point3
+
+from src import graphics
+from src import physics
+from src import world
+# pylint: enable=wrong-import-position
+
+
+class FakeApp(object):
+    def __init__(self):
+        self.render = NodePath("render")
+        self.camera = None
+
+
+class FakeController(object):
+    def __init__(self):
+        self.verticalVel = -5.0
+
+
+def test_kill_zone_calls_fall_handler_or_removes_body(monkeypatch):
+    monkeypatch.setattr(world, "fallHandlers", {})
+    removed = []
+    monkeypatch.setattr(physics, "removeBody", removed.append)
+    render = NodePath("render")
+    playerNP = render.attachNewNode("Player")
+    crateNP = render.attachNewNode("Crate")
+
+    falls = []
+    world.setFallHandler(playerNP, lambda: falls.append(playerNP))
+    # Another NodePath to the same node counts as the same body.
+    world.onEnterKillZone(None, render.find("Player"))
+    assert falls == [playerNP]
+    assert removed == []
+
+    world.onEnterKillZone(None, crateNP)
+    assert falls == [playerNP]
+    assert removed == [crateNP]
+
+
+def test_respawn_moves_player_and_refreshes_cache(monkeypatch):
+    app = FakeApp()
+    playerNP = app.render.attachNewNode("Player")
+    playerNP.setPos(0, 0, -1)
+    headNP = playerNP.attachNewNode("PlayerHead")
+    headNP.setPos(0, 0, 0.6)
+    controller = FakeController()
+    monkeypatch.setattr(graphics, "app", app)
+    monkeypatch.setattr(graphics, "playerNP", playerNP)
+    monkeypatch.setattr(graphics, "playerHeadNP", headNP)
+    monkeypatch.setattr(graphics, "latestTick", 0)
+    monkeypatch.setattr(graphics, "transformCacheTick", None)
+    monkeypatch.setattr(world, "playerController", controller)
+    graphics.getPlayerHeadPos()
+
+    world.respawnPlayer()
+
+    spawn = world.PLAYER_SPAWN_POS
+    assert playerNP.getPos() == spawn
+    assert controller.verticalVel == 0.0
+    assert graphics.getPlayerHeadPos().almostEqual(
+        Point3(spawn.getX(), spawn.getY(), spawn.getZ() + 0.6), 1e-5)